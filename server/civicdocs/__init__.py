@@ -1,34 +1,212 @@
+import atexit
+import logging
+
 from pyramid.config import Configurator
-from sqlalchemy import engine_from_config
+from pyramid.settings import (
+    asbool,
+    aslist,
+    )
 
 from .models import (
-    DBSession,
+    session_scope,
     Base,
+    Jobs,
+    Scrapers,
+    Dispatchers,
+    Workers,
+    )
+from .cache import (
+    Cache,
+    backend_from_url,
     )
+from .heartbeats import (
+    HeartbeatBuffer,
+    flush_heartbeats,
+    )
+from .notify import notifier_from_settings
+from .blobs import blob_store_from_settings
+from .frontier import (
+    Frontier,
+    flush_frontier,
+    )
+from .renderers import json_renderer
+from .schemas import build_schemas
+from .tasks import PeriodicTask
+
+
+log = logging.getLogger(__name__)
+
+
+def reap_expired_leases(session_factory, notifier):
+    with session_scope(session_factory) as dbsession:
+        count = Jobs.reap_expired_leases(dbsession)
+        if count:
+            notifier.publish(dbsession)
+    if count:
+        log.info('Returned %s jobs with expired leases to the queue', count)
+
+
+def sweep_stale_nodes(session_factory, stale_seconds, notifier):
+    with session_scope(session_factory) as dbsession:
+        for cls in (Dispatchers, Workers):
+            ids = cls.sweep_stale(dbsession, stale_seconds)
+            if ids:
+                if cls is Dispatchers:
+                    # their leased jobs went back to the queue.
+                    notifier.publish(dbsession)
+                log.info('Marked %s %s stale', len(ids), cls.__tablename__)
+
+
+def configure_caches(settings):
+    maxsize = int(settings.get('civicdocs.cache.maxsize', 1024))
+    ttl = float(settings.get('civicdocs.cache.ttl', 30))
+    backend = backend_from_url(settings.get('civicdocs.cache.url'))
+    if maxsize <= 0:
+        return
+    for cls in (Scrapers, Dispatchers, Workers):
+        cls.__cache__ = Cache(cls.__tablename__, maxsize, ttl, backend)
+    Scrapers.__token_cache__ = Cache('scrapers.token', maxsize, ttl, backend)
 
 
 def main(global_config, **settings):
     """ This function returns a Pyramid WSGI application.
     """
-    engine = engine_from_config(settings, 'sqlalchemy.',
-                                isolation_level="AUTOCOMMIT")
-    DBSession.configure(bind=engine)
-    Base.metadata.bind = engine
+    configure_caches(settings)
+    build_schemas(Base)
+
+    for key, default in (('civicdocs.job_lease_seconds', 300),
+                         ('civicdocs.job_recrawl_seconds', 86400),
+                         ('civicdocs.job_retry_seconds', 60),
+                         ('civicdocs.job_max_backoff_seconds', 86400),
+                         ('civicdocs.host_max_concurrent', 2),
+                         ('civicdocs.host_min_delay_seconds', 5)):
+        settings[key] = int(settings.get(key, default))
+    settings['civicdocs.frontier.lease_seconds'] = int(
+        settings.get('civicdocs.frontier.lease_seconds', 300))
+    background_tasks = asbool(
+        settings.get('civicdocs.background_tasks', True))
+    # filters are written in the request when they aren't buffered.
+    settings['civicdocs.frontier.flush_interval'] = float(
+        settings.get('civicdocs.frontier.flush_interval', 5)
+        if background_tasks else 0)
+    settings['civicdocs.blobs.max_bytes'] = int(
+        settings.get('civicdocs.blobs.max_bytes', 100 * 1024 * 1024))
+    settings['civicdocs.node_stale_seconds'] = int(
+        settings.get('civicdocs.node_stale_seconds', 120))
+    for key, default in (('civicdocs.job_max_wait_seconds', 30),
+                         ('civicdocs.job_wait_recheck_seconds', 5)):
+        settings[key] = float(settings.get(key, default))
+    settings['civicdocs.stats.hosts'] = aslist(
+        settings.get('civicdocs.stats.hosts', '127.0.0.1 ::1'))
+
     config = Configurator(settings=settings)
     config.include('pyramid_chameleon')
+    config.add_renderer('json', json_renderer())
+    config.include('.models')
+
+    session_factory = config.registry['dbsession_factory']
+    notifier = notifier_from_settings(settings, session_factory.kw['bind'])
+    notifier.start()
+    config.registry['job_notifier'] = notifier
+    config.registry['blob_store'] = blob_store_from_settings(settings)
+    reaper_interval = float(
+        settings.get('civicdocs.lease_reaper_interval', 30))
+    if background_tasks and reaper_interval > 0:
+        PeriodicTask(
+            'lease-reaper',
+            reaper_interval,
+            reap_expired_leases,
+            session_factory,
+            notifier,
+        ).start()
+
+    sweep_interval = float(
+        settings.get('civicdocs.node_sweep_interval', 30))
+    if background_tasks and sweep_interval > 0:
+        PeriodicTask(
+            'stale-node-sweep',
+            sweep_interval,
+            sweep_stale_nodes,
+            session_factory,
+            settings['civicdocs.node_stale_seconds'],
+            notifier,
+        ).start()
+
+    # heartbeats are written in the request when they aren't buffered.
+    config.registry['heartbeats'] = None
+    heartbeat_flush_ms = int(
+        settings.get('civicdocs.heartbeat_flush_ms', 1000))
+    if background_tasks and heartbeat_flush_ms > 0:
+        heartbeats = HeartbeatBuffer()
+        config.registry['heartbeats'] = heartbeats
+        PeriodicTask(
+            'heartbeat-flush',
+            heartbeat_flush_ms / 1000.0,
+            flush_heartbeats,
+            heartbeats,
+            session_factory,
+        ).start()
+        atexit.register(flush_heartbeats, heartbeats, session_factory)
+
+    config.registry['frontier'] = Frontier(
+        int(settings.get('civicdocs.frontier.capacity', 100000)),
+        float(settings.get('civicdocs.frontier.error_rate', 0.001)),
+        int(settings.get('civicdocs.frontier.maxsize', 256)),
+    )
+    frontier_flush_interval = settings['civicdocs.frontier.flush_interval']
+    if frontier_flush_interval > 0:
+        PeriodicTask(
+            'frontier-flush',
+            frontier_flush_interval,
+            flush_frontier,
+            config.registry['frontier'],
+            session_factory,
+        ).start()
+        atexit.register(
+            flush_frontier,
+            config.registry['frontier'],
+            session_factory,
+        )
     config.add_static_view('static', 'static', cache_max_age=3600)
 
     config.add_route('/dispatchers', '/dispatchers')
     config.add_route('/dispatchers/{id}', '/dispatchers/{id}')
     config.add_route('/dispatchers/{id}/jobs', '/dispatchers/{id}/jobs')
+    config.add_route('/dispatchers/{id}/jobs/{job_id}/lease',
+                     '/dispatchers/{id}/jobs/{job_id}/lease')
+    config.add_route('/dispatchers/{id}/jobs/{job_id}/complete',
+                     '/dispatchers/{id}/jobs/{job_id}/complete')
+    config.add_route('/dispatchers/{id}/heartbeat',
+                     '/dispatchers/{id}/heartbeat')
+
+    config.add_route('/jobs/{id}/throughput', '/jobs/{id}/throughput')
+    config.add_route('/municipalities/{id}/throughput',
+                     '/municipalities/{id}/throughput')
 
     config.add_route('/workers', '/workers')
     config.add_route('/workers/{id}', '/workers/{id}')
+    config.add_route('/workers/{id}/heartbeat', '/workers/{id}/heartbeat')
     config.add_route('/workers/{id}/document', '/workers/{id}/document')
+    config.add_route('/workers/{id}/documents', '/workers/{id}/documents')
+    config.add_route('/workers/{id}/documents/{document_id}/content',
+                     '/workers/{id}/documents/{document_id}/content')
+    config.add_route('/workers/{id}/jobs/{job_id}/frontier',
+                     '/workers/{id}/jobs/{job_id}/frontier')
+    config.add_route('/workers/{id}/jobs/{job_id}/frontier/done',
+                     '/workers/{id}/jobs/{job_id}/frontier/done')
+    config.add_route('/workers/{id}/fetch_states',
+                     '/workers/{id}/fetch_states')
+    config.add_route('/workers/{id}/fetch_states/lookup',
+                     '/workers/{id}/fetch_states/lookup')
 
     config.add_route('/documents', '/documents')
+    config.add_route('/documents/facets', '/documents/facets')
+    config.add_route('/documents/{id}/content', '/documents/{id}/content')
+    config.add_route('/documents/{id}/changes', '/documents/{id}/changes')
 
     config.add_route('/search', '/search')
 
+    config.add_route('/stats/pool', '/stats/pool')
+
     config.scan()
     return config.make_wsgi_app()
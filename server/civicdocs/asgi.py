@@ -0,0 +1,353 @@
+'''
+Serves the civicdocs application to an ASGI server, for when many
+dispatchers and workers keep connections open.  Serve it with (ex.)
+
+    CIVICDOCS_CONFIG=production.ini \
+        uvicorn --factory civicdocs.asgi:from_environ
+
+Requests run the same Pyramid application as the WSGI server, on a pool
+of `civicdocs.asgi.threads` threads; size the database pool to match.
+Open connections, request bodies being received and long-polls (`GET
+/dispatchers/{id}/jobs?wait=`) are held by the event loop rather than a
+thread: a long-poll only takes a thread while it looks for jobs.
+'''
+import os
+import re
+import sys
+import json
+import asyncio
+import tempfile
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+from pyramid.paster import (
+    get_app,
+    setup_logging,
+    )
+
+from .models import session_scope
+from .notify import wait_timeout
+
+
+LONG_POLL_PATH = re.compile(r'^/dispatchers/[^/]+/jobs/?$')
+
+# Request bodies larger than this are spooled to a temporary file.
+MAX_MEMORY_BODY = 1024 * 1024
+
+
+class AsyncJobWaiter(object):
+    '''
+    Relays the notifications of a `JobNotifier` to coroutines on the
+    event loop; `generation` follows the notifier's.
+    '''
+
+    def __init__(self, loop, notifier):
+        self.loop = loop
+        self.notifier = notifier
+        self.generation = notifier.generation
+        self._changed = asyncio.Event()
+        notifier.listeners.append(self._listener)
+
+    def _listener(self, generation):
+        # called from the notifying thread.
+        self.loop.call_soon_threadsafe(self._notify, generation)
+
+    def _notify(self, generation):
+        self.generation = max(self.generation, generation)
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def wait(self, generation, timeout):
+        '''
+        Waits up to `timeout` seconds for a notification after
+        `generation`, returning whether one came.
+        '''
+        if self.generation != generation:
+            return True
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def close(self):
+        self.notifier.listeners.remove(self._listener)
+
+
+class ASGIApplication(object):
+    '''
+    An ASGI application running `wsgi_app`, a civicdocs Pyramid router,
+    on a pool of `threads`.
+    '''
+
+    def __init__(self, wsgi_app, threads=None):
+        self.wsgi_app = wsgi_app
+        registry = wsgi_app.registry
+        self.settings = registry.settings
+        self.notifier = registry['job_notifier']
+        self.session_factory = registry['dbsession_factory']
+        if threads is None:
+            threads = int(self.settings.get('civicdocs.asgi.threads', 8))
+        self.executor = ThreadPoolExecutor(
+            threads,
+            thread_name_prefix='civicdocs-asgi',
+        )
+        self.waiter = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            raise ValueError('unsupported scope: {0}'.format(scope['type']))
+        if self.waiter is None:
+            self.waiter = AsyncJobWaiter(asyncio.get_running_loop(),
+                                         self.notifier)
+        body = await self.read_body(receive)
+        if body is None:
+            # the client went away.
+            return
+        environ = self.environ(scope, body)
+        wait = self.long_poll_wait(scope)
+        if wait:
+            await self.long_poll(environ, wait, receive, send)
+        else:
+            await self.respond(environ, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self.waiter = AsyncJobWaiter(asyncio.get_running_loop(),
+                                             self.notifier)
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.waiter is not None:
+                    self.waiter.close()
+                self.executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def run(self, func, *args):
+        return asyncio.get_running_loop().run_in_executor(
+            self.executor,
+            func,
+            *args
+        )
+
+    async def read_body(self, receive):
+        body = tempfile.SpooledTemporaryFile(MAX_MEMORY_BODY)
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                body.close()
+                return None
+            body.write(message.get('body', b''))
+            if not message.get('more_body', False):
+                break
+        body.seek(0)
+        return body
+
+    def environ(self, scope, body):
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': latin1(scope.get('root_path', '')),
+            'PATH_INFO': latin1(scope['path']),
+            'QUERY_STRING': scope['query_string'].decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': 'HTTP/{0}'.format(
+                scope.get('http_version', '1.1')),
+            'REMOTE_ADDR': client[0],
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': body,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        for name, value in scope['headers']:
+            name = name.decode('latin-1')
+            value = value.decode('latin-1')
+            if name == 'content-type':
+                key = 'CONTENT_TYPE'
+            elif name == 'content-length':
+                key = 'CONTENT_LENGTH'
+            else:
+                key = 'HTTP_' + name.upper().replace('-', '_')
+            if key in environ:
+                value = environ[key] + ',' + value
+            environ[key] = value
+        # the body was read whole, even if it came chunked.
+        body.seek(0, os.SEEK_END)
+        environ['CONTENT_LENGTH'] = str(body.tell())
+        body.seek(0)
+        return environ
+
+    def call(self, environ):
+        '''
+        Calls the WSGI application, returning its status, headers and
+        response iterable.
+        '''
+        started = []
+
+        def start_response(status, headers, exc_info=None):
+            started[:] = [status, headers]
+
+        app_iter = self.wsgi_app(environ, start_response)
+        return started[0], started[1], app_iter
+
+    def call_buffered(self, environ):
+        status, headers, app_iter = self.call(environ)
+        try:
+            body = b''.join(app_iter)
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+        return status, headers, body
+
+    async def start_response(self, send, status, headers):
+        await send({
+            'type': 'http.response.start',
+            'status': int(status.split(' ', 1)[0]),
+            'headers': [
+                (name.lower().encode('latin-1'), value.encode('latin-1'))
+                for name, value in headers
+            ],
+        })
+
+    async def respond(self, environ, send):
+        status, headers, app_iter = await self.run(self.call, environ)
+        try:
+            await self.start_response(send, status, headers)
+            if isinstance(app_iter, (list, tuple)):
+                for chunk in app_iter:
+                    await send({
+                        'type': 'http.response.body',
+                        'body': chunk,
+                        'more_body': True,
+                    })
+            else:
+                # a streamed response (ex. the ndjson export) is read a
+                # chunk at a time on the pool.
+                iterator = iter(app_iter)
+                while True:
+                    chunk = await self.run(next, iterator, None)
+                    if chunk is None:
+                        break
+                    await send({
+                        'type': 'http.response.body',
+                        'body': chunk,
+                        'more_body': True,
+                    })
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            if hasattr(app_iter, 'close'):
+                await self.run(app_iter.close)
+
+    def long_poll_wait(self, scope):
+        '''
+        Returns the seconds a request for jobs may wait, capped by
+        `civicdocs.job_max_wait_seconds`.  Invalid waits are left to the
+        view to reject.
+        '''
+        if scope['method'] != 'GET' or \
+                not LONG_POLL_PATH.match(scope['path']):
+            return 0
+        query = urllib.parse.parse_qsl(
+            scope['query_string'].decode('latin-1'),
+            keep_blank_values=True,
+        )
+        waits = [value for key, value in query if key == 'wait']
+        try:
+            wait = float(waits[-1])
+        except (IndexError, ValueError):
+            return 0
+        if not wait >= 0:
+            return 0
+        return min(wait, float(
+            self.settings['civicdocs.job_max_wait_seconds']))
+
+    def wait_timeout(self, remaining):
+        with session_scope(self.session_factory) as dbsession:
+            return wait_timeout(
+                dbsession,
+                remaining,
+                float(self.settings['civicdocs.job_wait_recheck_seconds']),
+            )
+
+    async def long_poll(self, environ, wait, receive, send):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + wait
+        # the wait is done here rather than by the view, on a thread.
+        environ['QUERY_STRING'] = urllib.parse.urlencode([
+            (key, value) for key, value in urllib.parse.parse_qsl(
+                environ['QUERY_STRING'],
+                keep_blank_values=True,
+            ) if key != 'wait'
+        ])
+        disconnected = loop.create_task(wait_disconnect(receive))
+        try:
+            while True:
+                # read before looking, so a release in between still wakes.
+                generation = self.waiter.generation
+                status, headers, body = await self.run(
+                    self.call_buffered,
+                    dict(environ),
+                )
+                remaining = deadline - loop.time()
+                if remaining <= 0 or not status.startswith('200') or \
+                        claimed(body):
+                    break
+                timeout = await self.run(self.wait_timeout, remaining)
+                waiting = loop.create_task(
+                    self.waiter.wait(generation, timeout))
+                await asyncio.wait(
+                    (waiting, disconnected),
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if disconnected.done():
+                    waiting.cancel()
+                    return
+        finally:
+            disconnected.cancel()
+        await self.start_response(send, status, headers)
+        await send({'type': 'http.response.body', 'body': body})
+
+
+def latin1(path):
+    # WSGI carries paths as bytes decoded as latin-1.
+    return path.encode('utf-8').decode('latin-1')
+
+
+def claimed(body):
+    try:
+        return bool(json.loads(body.decode('utf-8')).get('jobs'))
+    except (ValueError, AttributeError):
+        return True
+
+
+async def wait_disconnect(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+def main(config_uri, name='main'):
+    '''
+    Returns the ASGI application of the `name` app of `config_uri`.
+    '''
+    setup_logging(config_uri)
+    return ASGIApplication(get_app(config_uri, name))
+
+
+def from_environ():
+    '''
+    Returns the ASGI application of the config file named by
+    `CIVICDOCS_CONFIG`, for servers that take an application factory.
+    '''
+    return main(os.environ['CIVICDOCS_CONFIG'])
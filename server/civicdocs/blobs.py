@@ -0,0 +1,211 @@
+import os
+import re
+import hashlib
+import tempfile
+
+from pyramid.httpexceptions import (
+    HTTPFound,
+    HTTPNotFound,
+    )
+from pyramid.response import (
+    FileResponse,
+    Response,
+    )
+from webob.static import FileIter
+
+
+CHUNK_SIZE = 64 * 1024
+
+SHA256 = re.compile(r'^[0-9a-f]{64}$')
+
+
+class BlobTooLarge(ValueError):
+    pass
+
+
+class BlobMismatch(ValueError):
+    pass
+
+
+def copy_hashed(fileobj, out, max_bytes=None, expected_sha256=None):
+    '''
+    Copies `fileobj` to `out` a chunk at a time, returning the sha256
+    hex digest and size of what was copied.  Raises `BlobTooLarge` past
+    `max_bytes`, and `BlobMismatch` if the digest isn't
+    `expected_sha256`.
+    '''
+    digest = hashlib.sha256()
+    size = 0
+    while True:
+        chunk = fileobj.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        if max_bytes is not None and size > max_bytes:
+            raise BlobTooLarge('larger than {0} bytes'.format(max_bytes))
+        digest.update(chunk)
+        out.write(chunk)
+    sha256 = digest.hexdigest()
+    if expected_sha256 is not None and sha256 != expected_sha256:
+        raise BlobMismatch('content has sha256 {0}'.format(sha256))
+    return sha256, size
+
+
+class FilesystemBlobStore(object):
+    '''
+    Keeps blobs as files under `root`, named by the sha256 of their
+    content (`ab/cd/abcd...`), so identical content is only kept once
+    whatever document it belongs to.  Uploads are written to a temporary
+    file under `root` and renamed into place once hashed, so a blob is
+    never seen half written.
+    '''
+
+    def __init__(self, root):
+        self.root = root
+        self.tmp = os.path.join(root, 'tmp')
+        os.makedirs(self.tmp, exist_ok=True)
+
+    def path(self, sha256):
+        return os.path.join(self.root, sha256[:2], sha256[2:4], sha256)
+
+    def exists(self, sha256):
+        return os.path.exists(self.path(sha256))
+
+    def put(self, fileobj, max_bytes=None, expected_sha256=None):
+        '''
+        Stores the content read from `fileobj`, returning its sha256 and
+        size.  See `copy_hashed` for the errors.
+        '''
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp)
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                sha256, size = copy_hashed(
+                    fileobj,
+                    out,
+                    max_bytes,
+                    expected_sha256,
+                )
+            path = self.path(sha256)
+            if os.path.exists(path):
+                os.remove(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return sha256, size
+
+    def response(self, request, sha256, content_type):
+        '''
+        Returns a response serving the blob, ranges included, or a 404 if
+        its file is missing (ex. after a partial restore).
+        '''
+        path = self.path(sha256)
+        try:
+            if request.range is None:
+                # whole files go out through the server's
+                # `wsgi.file_wrapper` (ex. sendfile) when it has one.
+                response = FileResponse(
+                    path,
+                    request,
+                    content_type=content_type,
+                )
+            else:
+                # a range seeks straight to its start.
+                size = os.path.getsize(path)
+                response = Response(
+                    app_iter=FileIter(open(path, 'rb')),
+                    content_type=content_type,
+                    conditional_response=True,
+                )
+                response.content_length = size
+        except OSError:
+            return HTTPNotFound()
+        response.accept_ranges = 'bytes'
+        response.etag = sha256
+        return response
+
+
+class S3BlobStore(object):
+    '''
+    Keeps blobs in an S3 compatible bucket, under `prefix` followed by
+    the sha256 of their content.  `endpoint_url` points it to a
+    stand-in for S3 (ex. MinIO) instead.  Uploads are spooled to a
+    temporary file while they are hashed, then sent once.  Downloads are
+    redirected to a presigned url, which S3 serves with ranges.  This
+    needs the optional `boto3` package.
+    '''
+
+    # uploads up to this size are spooled in memory.
+    MAX_MEMORY_UPLOAD = 1024 * 1024
+
+    def __init__(self, bucket, prefix='', endpoint_url=None, url_ttl=300):
+        try:
+            import boto3
+        except ImportError:
+            raise RuntimeError(
+                'the boto3 package is needed for an s3:// blob store url')
+        self.bucket = bucket
+        self.prefix = prefix
+        self.url_ttl = url_ttl
+        self._client = boto3.client('s3', endpoint_url=endpoint_url)
+
+    def key(self, sha256):
+        return self.prefix + sha256
+
+    def exists(self, sha256):
+        from botocore.exceptions import ClientError
+        try:
+            self._client.head_object(Bucket=self.bucket, Key=self.key(sha256))
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey'):
+                return False
+            raise
+        return True
+
+    def put(self, fileobj, max_bytes=None, expected_sha256=None):
+        with tempfile.SpooledTemporaryFile(self.MAX_MEMORY_UPLOAD) as out:
+            sha256, size = copy_hashed(
+                fileobj,
+                out,
+                max_bytes,
+                expected_sha256,
+            )
+            if not self.exists(sha256):
+                out.seek(0)
+                self._client.upload_fileobj(out, self.bucket, self.key(sha256))
+        return sha256, size
+
+    def response(self, request, sha256, content_type):
+        return HTTPFound(location=self._client.generate_presigned_url(
+            'get_object',
+            Params=dict(
+                Bucket=self.bucket,
+                Key=self.key(sha256),
+                ResponseContentType=content_type,
+            ),
+            ExpiresIn=self.url_ttl,
+        ))
+
+
+def blob_store_from_settings(settings):
+    '''
+    Returns the blob store of `civicdocs.blobs.url`, `file:///path` or
+    `s3://bucket/prefix/` (with `civicdocs.blobs.endpoint_url` for a
+    stand-in), or `None` if it isn't set.
+    '''
+    url = settings.get('civicdocs.blobs.url')
+    if not url:
+        return None
+    if url.startswith('file://'):
+        return FilesystemBlobStore(url[len('file://'):])
+    if url.startswith('s3://'):
+        bucket, _, prefix = url[len('s3://'):].partition('/')
+        return S3BlobStore(
+            bucket,
+            prefix,
+            settings.get('civicdocs.blobs.endpoint_url'),
+        )
+    raise ValueError('unsupported blob store url: {0}'.format(url))
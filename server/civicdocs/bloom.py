@@ -0,0 +1,72 @@
+import math
+
+
+class BloomFilter(object):
+    '''
+    A set of sha256 hex digests (ex. `civicdocs.urls.url_hash`) that
+    answers membership with no false negatives, and false positives at
+    about the `error_rate` it was sized for while it holds no more than
+    its capacity.  The digest is already uniform, so the `hashes` bit
+    positions are derived from it by double hashing rather than hashed
+    again.
+    '''
+
+    def __init__(self, size, hashes, bits=None):
+        self.size = size
+        self.hashes = hashes
+        if bits is None:
+            bits = bytearray((size + 7) // 8)
+        self.bits = bytearray(bits)
+
+    @property
+    def capacity(self):
+        '''
+        How many digests it holds before about half its bits are set,
+        which is about the capacity it was sized for (less the rounding
+        of `hashes`).
+        '''
+        return int(self.size * math.log(2) / self.hashes)
+
+    @classmethod
+    def for_capacity(cls, capacity, error_rate=0.001):
+        size = int(math.ceil(
+            -capacity * math.log(error_rate) / math.log(2) ** 2))
+        hashes = max(1, int(round(size / capacity * math.log(2))))
+        return cls(size, hashes)
+
+    def _positions(self, digest):
+        raw = bytes.fromhex(digest)
+        h1 = int.from_bytes(raw[:8], 'big')
+        h2 = int.from_bytes(raw[8:16], 'big') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, digest):
+        '''
+        Adds `digest`, returning whether it was not in the set already.
+        '''
+        added = False
+        for position in self._positions(digest):
+            byte, bit = divmod(position, 8)
+            if not self.bits[byte] & (1 << bit):
+                self.bits[byte] |= 1 << bit
+                added = True
+        return added
+
+    def __contains__(self, digest):
+        for position in self._positions(digest):
+            byte, bit = divmod(position, 8)
+            if not self.bits[byte] & (1 << bit):
+                return False
+        return True
+
+    def union(self, bits):
+        '''
+        Adds every digest of another filter of the same size, given its
+        `bits`.
+        '''
+        merged = int.from_bytes(self.bits, 'big') | \
+            int.from_bytes(bits, 'big')
+        self.bits = bytearray(merged.to_bytes(len(self.bits), 'big'))
+
+    def to_bytes(self):
+        return bytes(self.bits)
@@ -0,0 +1,147 @@
+import math
+import time
+import pickle
+import threading
+from collections import OrderedDict
+
+
+class LocalBackend(object):
+    '''
+    An in-memory stand-in for a shared backend, with the same interface.
+    Useful for tests and single process deployments.
+    '''
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.time():
+                del self._entries[key]
+                return None
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.time() + ttl)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class RedisBackend(object):
+    '''
+    Shares cache entries between processes through redis.  This needs
+    the optional `redis` package.
+    '''
+
+    def __init__(self, url):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError(
+                'the redis package is needed for a redis:// cache url')
+        self._redis = redis.StrictRedis.from_url(url)
+
+    def get(self, key):
+        return self._redis.get(key)
+
+    def set(self, key, value, ttl):
+        self._redis.set(key, value, px=int(math.ceil(ttl * 1000)))
+
+    def delete(self, key):
+        self._redis.delete(key)
+
+
+def backend_from_url(url):
+    if not url:
+        return None
+    if url == 'memory://':
+        return LocalBackend()
+    if url.startswith('redis://') or url.startswith('rediss://'):
+        return RedisBackend(url)
+    raise ValueError('unsupported cache url: {0}'.format(url))
+
+
+class Cache(object):
+    '''
+    A read through cache.  Entries are kept in a local LRU of at most
+    `maxsize` entries for `ttl` seconds.  If a shared `backend` is given,
+    local misses are looked up there (as pickles) before loading, so
+    several processes can share loads.  Entries must be invalidated
+    explicitly when the underlying row changes; the TTL bounds how stale
+    other processes' local entries can get.
+    '''
+
+    def __init__(self, name, maxsize=1024, ttl=30, backend=None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, key):
+        return 'civicdocs:{0}:{1}'.format(self.name, key)
+
+    def _get_local(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def _set_local(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.time() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def get(self, key, load):
+        '''
+        Returns the cached value for `key`, calling `load()` on a miss.
+        `None` is never cached.
+        '''
+        value = self._get_local(key)
+        if value is None and self.backend is not None:
+            data = self.backend.get(self._key(key))
+            if data is not None:
+                value = pickle.loads(data)
+                self._set_local(key, value)
+        if value is not None:
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = load()
+        if value is not None:
+            self.set(key, value)
+        return value
+
+    def set(self, key, value):
+        self._set_local(key, value)
+        if self.backend is not None:
+            self.backend.set(self._key(key), pickle.dumps(value), self.ttl)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.backend is not None:
+            self.backend.delete(self._key(key))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,156 @@
+import re
+import json
+from collections import defaultdict
+
+from .search import (
+    FIELD_WEIGHTS,
+    TOKEN_RE,
+    term_frequencies,
+    tokenize,
+)
+
+
+# Keywords (single terms, or phrases matched as consecutive words) and
+# regular expressions for each category, by category name.  Override them
+# with a JSON file of the same shape (`civicdocs.classify.rules`).
+DEFAULT_RULES = {
+    'Agendas': dict(
+        keywords=['agenda', 'agendas'],
+    ),
+    'Minutes': dict(
+        keywords=['minutes', 'meeting summary'],
+    ),
+    'Budgets': dict(
+        keywords=['budget', 'budgets', 'appropriation', 'appropriations',
+                  'capital improvement', 'fiscal year'],
+        patterns=[r'\bfy\s?\d{2,4}\b'],
+    ),
+    'Ordinances': dict(
+        keywords=['ordinance', 'ordinances', 'local law', 'code amendment'],
+    ),
+    'Resolutions': dict(
+        keywords=['resolution', 'resolutions'],
+    ),
+    'Public Notices': dict(
+        keywords=['notice', 'notices', 'public hearing', 'legal notice'],
+    ),
+    'Bids and Proposals': dict(
+        keywords=['bid', 'bids', 'rfp', 'rfq', 'rfb', 'request for proposals',
+                  'request for qualifications'],
+    ),
+    'Financial Reports': dict(
+        keywords=['audit', 'audited', 'financial statement',
+                  'financial statements', 'annual financial report',
+                  'treasurer'],
+    ),
+    'Planning and Zoning': dict(
+        keywords=['zoning', 'planning', 'site plan', 'variance',
+                  'subdivision', 'comprehensive plan'],
+    ),
+    'Elections': dict(
+        keywords=['election', 'elections', 'ballot', 'voter', 'voters'],
+    ),
+    'Permits and Licenses': dict(
+        keywords=['permit', 'permits', 'license', 'licenses', 'licensing'],
+    ),
+}
+
+# The score a document needs for a category: a keyword in the name (3)
+# or link text (2) is enough, in the description it takes two.
+MIN_SCORE = 2
+
+
+def load_rules(path=None):
+    '''
+    Returns the rules of the JSON file at `path`, or `DEFAULT_RULES`.
+    '''
+    if not path:
+        return DEFAULT_RULES
+    with open(path) as f:
+        return json.load(f)
+
+
+class Classifier(object):
+    '''
+    Scores a document for each category by the weighted frequency of its
+    keywords in the indexed fields (weighted as for search, see
+    `civicdocs.search.FIELD_WEIGHTS`), plus the field weight of each
+    field a pattern matches, and assigns those scoring `min_score` or
+    more.  Single term keywords are looked up in the document's term
+    frequencies, so the cost of a document doesn't grow with the number
+    of those.
+    '''
+
+    def __init__(self, rules, min_score=MIN_SCORE):
+        self.min_score = min_score
+        # term -> categories
+        self.terms = defaultdict(list)
+        # (category, compiled pattern), phrases included.
+        self.patterns = []
+        for category, rule in rules.items():
+            for keyword in rule.get('keywords', ()):
+                words = TOKEN_RE.findall(keyword.lower())
+                if len(words) == 1:
+                    for term in tokenize(words[0]):
+                        self.terms[term].append(category)
+                elif words:
+                    # phrases keep their stop words.
+                    self.patterns.append((category, re.compile(
+                        r'\b' + r'\W+'.join(map(re.escape, words)) + r'\b',
+                        re.IGNORECASE | re.UNICODE,
+                    )))
+            for pattern in rule.get('patterns', ()):
+                self.patterns.append((category, re.compile(
+                    pattern,
+                    re.IGNORECASE | re.UNICODE,
+                )))
+
+    def classify(self, fields):
+        '''
+        Returns the sorted categories of a document, given a mapping of
+        its field names to their text.
+        '''
+        scores = defaultdict(int)
+        frequencies, _ = term_frequencies(fields)
+        for term, frequency in frequencies.items():
+            for category in self.terms.get(term, ()):
+                scores[category] += frequency
+        for category, pattern in self.patterns:
+            for field, weight in FIELD_WEIGHTS:
+                if fields.get(field) and pattern.search(fields[field]):
+                    scores[category] += weight
+        return sorted(
+            category for category, score in scores.items()
+            if score >= self.min_score
+        )
+
+
+# The classifier of a pool process, see `init_worker`.
+_classifier = None
+
+
+def init_worker(rules, min_score=MIN_SCORE):
+    '''
+    Builds the classifier of a pool process once, rather than sending it
+    with every batch.
+    '''
+    global _classifier
+    _classifier = Classifier(rules, min_score)
+
+
+def classify_batch(rows):
+    '''
+    Classifies `(id, name, link_text, source_url_title, description)`
+    rows in a pool process, returning `(id, categories)` pairs for the
+    documents that have any.
+    '''
+    results = []
+    for row in rows:
+        fields = dict(zip(
+            [field for field, _ in FIELD_WEIGHTS],
+            row[1:],
+        ))
+        categories = _classifier.classify(fields)
+        if categories:
+            results.append((row[0], categories))
+    return results
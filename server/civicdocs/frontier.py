@@ -0,0 +1,159 @@
+import logging
+import threading
+from collections import OrderedDict
+
+from .bloom import BloomFilter
+from .models import (
+    session_scope,
+    on_commit,
+    FrontierFilters,
+    FrontierUrls,
+)
+from .urls import url_hash
+
+
+log = logging.getLogger(__name__)
+
+
+class FilterEntry(object):
+
+    def __init__(self, bloom):
+        self.bloom = bloom
+        # the digests of the urls added since the last write.
+        self.added = []
+        # the filters replaced by a new one once over capacity, still
+        # answering for the urls seen by this process.
+        self.previous = []
+
+    def __contains__(self, digest):
+        if digest in self.bloom:
+            return True
+        return any(digest in bloom for bloom in self.previous)
+
+
+class Frontier(object):
+    '''
+    Queues the links workers discover for a job, skipping those already
+    seen by this or an earlier run of the job.  "Seen" is answered by a
+    per job `BloomFilter` kept in memory (for at most `maxsize` jobs), so
+    a push does not look its urls up in the database.  The filters are
+    loaded once, then written back by `write` (merged with the stored
+    filter, which other processes may have added to) and the merged bits
+    adopted; until then another process may queue a url twice, which
+    only costs a second fetch.  A filter holding more urls than its
+    capacity is replaced by a larger one (see `FrontierFilters.merge`).
+
+    A url is only added to the filter once its push commits, so a failed
+    push doesn't hide its urls from the next one.
+    '''
+
+    def __init__(self, capacity=100000, error_rate=0.001, maxsize=256):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._filters = OrderedDict()
+
+    def _entry(self, dbsession, job_id):
+        with self._lock:
+            entry = self._filters.get(job_id)
+            if entry is not None:
+                self._filters.move_to_end(job_id)
+                return entry
+        bloom = FrontierFilters.load(dbsession, job_id)
+        if bloom is None:
+            bloom = BloomFilter.for_capacity(self.capacity, self.error_rate)
+        with self._lock:
+            entry = self._filters.setdefault(job_id, FilterEntry(bloom))
+            self._evict()
+        return entry
+
+    def _evict(self):
+        # filters with unwritten urls are kept until they are written.
+        for job_id in list(self._filters):
+            if len(self._filters) <= self.maxsize:
+                break
+            if not self._filters[job_id].added:
+                del self._filters[job_id]
+
+    def push(self, dbsession, job_id, link_level, urls, depth):
+        '''
+        Queues the `urls` linked from a page at `depth - 1`, returning
+        how many were queued, already seen, and deeper than the job's
+        `link_level`.
+        '''
+        if depth > link_level:
+            return dict(queued=0, seen=0, too_deep=len(urls))
+        entry = self._entry(dbsession, job_id)
+        new = OrderedDict()
+        with self._lock:
+            for url in urls:
+                digest = url_hash(url)
+                if digest not in new and digest not in entry:
+                    new[digest] = url
+        FrontierUrls.add_many(dbsession, job_id, [
+            (url, digest, depth) for digest, url in new.items()
+        ])
+        on_commit(dbsession, self._seen, entry, list(new))
+        return dict(queued=len(new), seen=len(urls) - len(new), too_deep=0)
+
+    def _seen(self, entry, digests):
+        with self._lock:
+            for digest in digests:
+                entry.bloom.add(digest)
+            entry.added.extend(digests)
+
+    def write(self, dbsession):
+        '''
+        Merges the filters with unwritten urls into the stored ones.
+        '''
+        with self._lock:
+            pending = [
+                (job_id, entry, BloomFilter(
+                    entry.bloom.size,
+                    entry.bloom.hashes,
+                    entry.bloom.bits,
+                ), list(entry.added))
+                for job_id, entry in self._filters.items()
+                if entry.added
+            ]
+        merged = []
+        for job_id, entry, bloom, added in pending:
+            bloom = FrontierFilters.merge(
+                dbsession,
+                job_id,
+                bloom,
+                added,
+                self.error_rate,
+            )
+            merged.append((job_id, entry, bloom, added))
+        # until the merge commits the urls still count as unwritten.
+        on_commit(dbsession, self._adopt, merged)
+        return len(pending)
+
+    def _adopt(self, merged):
+        with self._lock:
+            for job_id, entry, bloom, added in merged:
+                del entry.added[:len(added)]
+                if (bloom.size, bloom.hashes) == \
+                        (entry.bloom.size, entry.bloom.hashes):
+                    entry.bloom.union(bloom.bits)
+                    continue
+                log.info('Replaced the frontier filter of job %s over '
+                         'capacity (now %s urls)', job_id, bloom.capacity)
+                entry.previous.append(entry.bloom)
+                # the urls added since the write go in the new filter.
+                for digest in entry.added:
+                    bloom.add(digest)
+                entry.bloom = bloom
+
+    def __len__(self):
+        with self._lock:
+            return len(self._filters)
+
+
+def flush_frontier(frontier, session_factory):
+    with session_scope(session_factory) as dbsession:
+        count = frontier.write(dbsession)
+    if count:
+        log.debug('Wrote %s frontier filters', count)
@@ -0,0 +1,156 @@
+import math
+
+
+EARTH_RADIUS_KM = 6371.0088
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+# The most cells a search area is covered with; fewer, larger cells take
+# in more candidates, more cells make for a longer query.
+MAX_CELLS = 16
+
+
+def encode(lat, lng, precision=12):
+    '''
+    The geohash of a point: a base32 string whose prefixes are ever
+    smaller cells containing it, so points in a cell share an index
+    range.
+    '''
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            interval, coordinate = lng_range, lng
+        else:
+            interval, coordinate = lat_range, lat
+        middle = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits = 0
+            value = 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    '''
+    The `(height, width)` in degrees of the cells of a precision.
+    '''
+    lng_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lng_bits
+
+
+def haversine(lat1, lng1, lat2, lng2):
+    '''
+    The great circle distance between two points in kilometers.
+    '''
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + \
+        math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_boxes(lat, lng, radius_km):
+    '''
+    The `(min_lat, max_lat, min_lng, max_lng)` boxes containing every
+    point within `radius_km`; two when the area crosses the
+    antimeridian.
+    '''
+    dlat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    min_lat = max(lat - dlat, -90.0)
+    max_lat = min(lat + dlat, 90.0)
+    cos_lat = math.cos(math.radians(max(abs(min_lat), abs(max_lat))))
+    if min_lat == -90.0 or max_lat == 90.0 or cos_lat <= 0:
+        return [(min_lat, max_lat, -180.0, 180.0)]
+    dlng = min(dlat / cos_lat, 180.0)
+    min_lng = lng - dlng
+    max_lng = lng + dlng
+    if min_lng < -180.0:
+        return [
+            (min_lat, max_lat, min_lng + 360.0, 180.0),
+            (min_lat, max_lat, -180.0, max_lng),
+        ]
+    if max_lng > 180.0:
+        return [
+            (min_lat, max_lat, min_lng, 180.0),
+            (min_lat, max_lat, -180.0, max_lng - 360.0),
+        ]
+    return [(min_lat, max_lat, min_lng, max_lng)]
+
+
+def _cell_range(low, high, size, origin):
+    first = int(math.floor((low - origin) / size))
+    last = int(math.floor((min(high, -origin) - origin) / size))
+    # the top edge belongs to the last cell.
+    last = min(last, int(round(-2 * origin / size)) - 1)
+    return first, last
+
+
+def covering_cells(boxes, max_cells=MAX_CELLS):
+    '''
+    The geohash prefixes of the cells covering `boxes`, at the finest
+    precision needing no more than `max_cells` of them.
+    '''
+    for precision in range(12, 0, -1):
+        height, width = cell_size(precision)
+        spans = []
+        for min_lat, max_lat, min_lng, max_lng in boxes:
+            rows = _cell_range(min_lat, max_lat, height, -90.0)
+            cols = _cell_range(min_lng, max_lng, width, -180.0)
+            spans.append((rows, cols))
+        count = sum((r[1] - r[0] + 1) * (c[1] - c[0] + 1)
+                    for r, c in spans)
+        if count <= max_cells or precision == 1:
+            break
+    cells = set()
+    for (first_row, last_row), (first_col, last_col) in spans:
+        for row in range(first_row, last_row + 1):
+            for col in range(first_col, last_col + 1):
+                cells.add(encode(
+                    -90.0 + (row + 0.5) * height,
+                    -180.0 + (col + 0.5) * width,
+                    precision,
+                ))
+    return sorted(cells)
+
+
+def prefix_range(prefix):
+    '''
+    The `[low, high)` range of the geohashes starting with `prefix`, as
+    plain comparisons (which any index and collation can use, unlike a
+    LIKE).  `high` is `None` for the last prefix.
+    '''
+    chars = prefix
+    while chars:
+        index = BASE32.index(chars[-1])
+        if index + 1 < len(BASE32):
+            return prefix, chars[:-1] + BASE32[index + 1]
+        chars = chars[:-1]
+    return prefix, None
+
+
+def prefix_ranges(prefixes):
+    '''
+    The `prefix_range`s of sorted `prefixes`, with adjacent ranges
+    joined so neighbouring cells are read with one index scan.
+    '''
+    ranges = []
+    for prefix in prefixes:
+        low, high = prefix_range(prefix)
+        if ranges and ranges[-1][1] == low:
+            ranges[-1] = (ranges[-1][0], high)
+        else:
+            ranges.append((low, high))
+    return ranges
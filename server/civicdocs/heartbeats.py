@@ -0,0 +1,76 @@
+import logging
+import datetime
+import threading
+
+from .models import session_scope
+
+
+log = logging.getLogger(__name__)
+
+
+class HeartbeatBuffer(object):
+    '''
+    Coalesces heartbeats in memory between flushes.  For each node only
+    the latest gauges (ex. `up_time`) are kept, while counters (ex.
+    `document_count`) are deltas that add up.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+
+    def beat(self, cls, id, gauges, counters):
+        with self._lock:
+            self._merge(cls, id, dict(
+                gauges,
+                last_callin_datetime=datetime.datetime.now(),
+            ), counters)
+
+    def _merge(self, cls, id, gauges, counters):
+        beats = self._pending.setdefault(cls, {})
+        beat = beats.get(id)
+        if beat is None:
+            beats[id] = (dict(gauges), dict(counters))
+            return
+        beat[0].update(gauges)
+        for key, value in counters.items():
+            beat[1][key] = beat[1].get(key, 0) + value
+
+    def drain(self):
+        '''
+        Returns and forgets the pending heartbeats, as a mapping of model
+        classes to `{id: (gauges, counters)}`.
+        '''
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return pending
+
+    def restore(self, pending):
+        '''
+        Puts back heartbeats that failed to flush, under any that came
+        in since.
+        '''
+        with self._lock:
+            newer, self._pending = self._pending, {}
+            for beats in (pending, newer):
+                for cls, by_id in beats.items():
+                    for id, (gauges, counters) in by_id.items():
+                        self._merge(cls, id, gauges, counters)
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(beats) for beats in self._pending.values())
+
+
+def flush_heartbeats(buffer, session_factory):
+    pending = buffer.drain()
+    if not pending:
+        return
+    try:
+        with session_scope(session_factory) as dbsession:
+            for cls, beats in pending.items():
+                cls.apply_heartbeats(dbsession, beats)
+    except Exception:
+        buffer.restore(pending)
+        raise
+    log.debug('Flushed %s heartbeats', sum(map(len, pending.values())))
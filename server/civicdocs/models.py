@@ -1,6 +1,17 @@
-from uuid import uuid4
+from uuid import (
+    UUID,
+    uuid4,
+)
+from collections import (
+    Counter,
+    OrderedDict,
+    defaultdict,
+)
+import heapq
+import random
 import hashlib
 import datetime
+import contextlib
 
 from sqlalchemy.sql import func
 from sqlalchemy_utils import UUIDType
@@ -8,103 +19,405 @@ from sqlalchemy import (
     Column,
     ForeignKey,
     Integer,
+    BigInteger,
+    String,
+    Unicode,
     UnicodeText,
     DateTime,
     Float,
     Index,
+    LargeBinary,
     Boolean,
+    engine_from_config,
+    event,
 )
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.exc import IntegrityError
 
 from sqlalchemy import(
     update,
-    desc,
+    select,
+    bindparam,
+    and_,
+    or_,
+    case,
 )
 
 from sqlalchemy.ext.declarative import declarative_base
 
 from sqlalchemy.orm import (
     relationship,
-    scoped_session,
     sessionmaker,
+    joinedload,
+    selectinload,
+    raiseload,
+    load_only,
 )
 
-from zope.sqlalchemy import ZopeTransactionExtension
+import zope.sqlalchemy
 import transaction
 
-DBSession = scoped_session(sessionmaker(
-    extension=ZopeTransactionExtension(keep_session=True),
-    expire_on_commit=False))
+from pyramid.settings import asbool
+
+from .pool import (
+    InstrumentedQueuePool,
+    instrument,
+)
+from .urls import (
+    url_hash,
+    host_key,
+)
+from .bloom import BloomFilter
+from .geo import (
+    encode as geohash_encode,
+    haversine,
+    bounding_boxes,
+    covering_cells,
+    prefix_ranges,
+)
+from .search import (
+    MAX_TERM_LENGTH,
+    term_frequencies,
+    parse_query,
+    idf,
+    bm25,
+)
+
 Base = declarative_base()
 
 
+def get_engine(settings, prefix='sqlalchemy.'):
+    '''
+    Creates the engine from the `sqlalchemy.*` settings, including the
+    pool settings (`pool_size`, `max_overflow`, `pool_timeout`,
+    `pool_recycle` and `pool_pre_ping`), and instruments its pool.
+    '''
+    kwargs = {}
+    key = prefix + 'pool_pre_ping'
+    if key in settings:
+        kwargs['pool_pre_ping'] = asbool(settings[key])
+    sqlite = make_url(settings[prefix + 'url']).get_backend_name() == \
+        'sqlite'
+    # sqlite keeps its own pool classes, which don't take a size.
+    if not sqlite:
+        kwargs['poolclass'] = InstrumentedQueuePool
+    engine = engine_from_config(settings, prefix, **kwargs)
+    if sqlite:
+        begin_sqlite_transactions(engine)
+    instrument(engine)
+    return engine
+
+
+def begin_sqlite_transactions(engine):
+    '''
+    pysqlite only begins a transaction before a data changing statement,
+    so one whose first statement is a SAVEPOINT commits as the savepoint
+    is released, and a rollback leaves its writes.  The transactions are
+    begun by SQLAlchemy instead, taking the write lock up front: a
+    transaction that read first would fail (rather than wait) to take it
+    while another holds it.
+    '''
+    @event.listens_for(engine, 'connect')
+    def connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, 'begin')
+    def begin(connection):
+        connection.execute('BEGIN IMMEDIATE')
+
+
+def get_session_factory(engine):
+    return sessionmaker(bind=engine, expire_on_commit=False)
+
+
+def get_tm_session(session_factory, transaction_manager):
+    '''
+    Returns a session joined to `transaction_manager`; it is flushed and
+    committed (or rolled back) with the transaction, and closed after.
+    '''
+    dbsession = session_factory()
+    dbsession.info['transaction_manager'] = transaction_manager
+    # many writes are bulk statements that bypass the unit of work, so
+    # the session is always committed rather than only after a flush.
+    zope.sqlalchemy.register(
+        dbsession,
+        initial_state=zope.sqlalchemy.datamanager.STATUS_CHANGED,
+        transaction_manager=transaction_manager,
+    )
+    return dbsession
+
+
+@contextlib.contextmanager
+def session_scope(session_factory):
+    '''
+    A session with its own transaction for work outside of a request
+    (scripts and background tasks), committed when the block exits.
+    '''
+    transaction_manager = transaction.TransactionManager(explicit=True)
+    with transaction_manager:
+        yield get_tm_session(session_factory, transaction_manager)
+
+
+def on_commit(dbsession, func, *args):
+    '''
+    Calls `func(*args)` after the transaction of `dbsession` commits.
+    '''
+    transaction_manager = dbsession.info.get('transaction_manager')
+    if transaction_manager is None:
+        func(*args)
+        return
+    transaction_manager.get().addAfterCommitHook(
+        lambda status, *args: status and func(*args),
+        args,
+    )
+
+
+def includeme(config):
+    '''
+    Gives every request a `request.dbsession` that is part of the request
+    transaction managed by pyramid_tm, so a request is a single unit of
+    work with a single commit.
+    '''
+    settings = config.get_settings()
+    settings['tm.manager_hook'] = 'pyramid_tm.explicit_manager'
+    # roll back requests that respond with an error status.
+    settings.setdefault('tm.commit_veto', 'pyramid_tm.default_commit_veto')
+    config.include('pyramid_tm')
+
+    engine = get_engine(settings)
+    session_factory = get_session_factory(engine)
+    config.registry['dbsession_factory'] = session_factory
+    config.registry['pool_stats'] = engine.pool.stats
+    config.add_request_method(
+        lambda request: get_tm_session(session_factory, request.tm),
+        'dbsession',
+        reify=True,
+    )
+
+
 class TimeStampMixin(object):
-    creation_datetime = Column(DateTime, server_default=func.now())
-    modified_datetime = Column(DateTime, server_default=func.now())
+    # The client side default keeps the value on the instance after a
+    # flush and round trips exactly, which keyset pagination relies on.
+    creation_datetime = Column(
+        DateTime,
+        default=datetime.datetime.now,
+        server_default=func.now(),
+    )
+    modified_datetime = Column(
+        DateTime,
+        default=datetime.datetime.now,
+        server_default=func.now(),
+    )
 
 
 class CreationMixin():
+    '''
+    Common queries.  These take the session of the caller (usually
+    `request.dbsession`) and leave committing to its transaction.
+    '''
 
     id = Column(UUIDType(binary=False), primary_key=True)
 
+    # a `civicdocs.cache.Cache` of instances by id, used by `get_cached`.
+    __cache__ = None
+
+    # Loader options for each loading profile a query site can ask for.
+    # Nothing is eagerly loaded by default; a profile loads what its
+    # callers use (ex. `to_dict`) and raises on anything else, so a
+    # missing relationship fails loudly instead of lazy loading per row.
+    __profiles__ = {
+        'detail': (raiseload('*'),),
+        'list': (raiseload('*'),),
+    }
+
+    # Columns set by the server that payloads may not provide, besides
+    # those in `civicdocs.schemas.SERVER_KEYS`.
+    __server_keys__ = ()
+
+    # Columns that are never returned by a field selection.
+    __private_keys__ = ()
+
+    # Columns whose payload values must be urls `civicdocs.urls` can
+    # normalize.
+    __url_keys__ = ()
+
+    @classmethod
+    def options(cls, profile=None):
+        if profile is None:
+            return ()
+        return cls.__profiles__[profile]
+
     @classmethod
-    def add(cls, **kwargs):
-        with transaction.manager:
-            thing = cls(**kwargs)
-            if thing.id is None:
-                thing.id = uuid4()
-            DBSession.add(thing)
-            transaction.commit()
+    def add(cls, dbsession, **kwargs):
+        thing = cls(**kwargs)
+        if thing.id is None:
+            thing.id = uuid4()
+        dbsession.add(thing)
+        dbsession.flush()
         return thing
 
     @classmethod
-    def get_all(cls):
-        with transaction.manager:
-            things = DBSession.query(
-                cls,
-            ).all()
+    def get_all(cls, dbsession, profile=None):
+        things = dbsession.query(
+            cls,
+        ).options(
+            *cls.options(profile)
+        ).all()
         return things
 
     @classmethod
-    def get_paged(cls, start=0, count=10):
-        with transaction.manager:
-            things = DBSession.query(
-                cls,
-            ).slice(
-                start,
-                start+count
-            ).all()
+    def get_paged(cls, dbsession, start=0, count=10, profile=None,
+                  criteria=()):
+        things = dbsession.query(
+            cls,
+        ).options(
+            *cls.options(profile)
+        ).filter(
+            *criteria
+        ).slice(
+            start,
+            start+count
+        ).all()
         return things
 
     @classmethod
-    def get_by_id(cls, id):
-        with transaction.manager:
-            thing = DBSession.query(
-                cls,
-            ).filter(
-                cls.id == id,
-            ).first()
+    def get_rows(cls, dbsession, fields, start=0, count=10, criteria=()):
+        '''
+        Like `get_paged`, but selects only the `fields` columns and
+        returns row tuples instead of instances.
+        '''
+        rows = dbsession.query(
+            *[cls.__table__.c[field] for field in fields]
+        ).filter(
+            *criteria
+        ).slice(
+            start,
+            start+count
+        ).all()
+        return rows
+
+    @classmethod
+    def public_fields(cls):
+        return [
+            column.name for column in cls.__table__.columns
+            if column.name not in cls.__private_keys__
+        ]
+
+    @classmethod
+    def get_keyset(cls, dbsession, after=None, count=10, criteria=(),
+                   profile=None):
+        '''
+        Returns a page ordered by `(creation_datetime, id)` that starts
+        after the `(creation_datetime, id)` pair `after`.  Unlike
+        `get_paged`, this seeks with the index rather than counting past
+        an OFFSET, so deep pages cost the same as the first one.
+        '''
+        q = dbsession.query(
+            cls,
+        ).options(
+            *cls.options(profile)
+        ).filter(
+            *criteria
+        )
+        if after is not None:
+            creation_datetime, id = after
+            q = q.filter(or_(
+                cls.creation_datetime > creation_datetime,
+                and_(
+                    cls.creation_datetime == creation_datetime,
+                    cls.id > id,
+                ),
+            ))
+        things = q.order_by(
+            cls.creation_datetime,
+            cls.id,
+        ).limit(count).all()
+        return things
+
+    @classmethod
+    def get_by_id(cls, dbsession, id, profile=None):
+        thing = dbsession.query(
+            cls,
+        ).options(
+            *cls.options(profile)
+        ).filter(
+            cls.id == id,
+        ).first()
         return thing
 
     @classmethod
-    def delete_by_id(cls, id):
-        with transaction.manager:
-            thing = cls.get_by_id(id)
-            if thing is not None:
-                DBSession.delete(thing)
-            transaction.commit()
+    def get_cached(cls, dbsession, id):
+        '''
+        Like `get_by_id`, but read through `__cache__` when one is
+        configured (see `civicdocs.main`).  The returned instance is
+        detached from the session and shared, so it must not be modified.
+        Returns `None` for an id that isn't a uuid.
+        '''
+        try:
+            id = UUID(str(id))
+        except ValueError:
+            return None
+        if cls.__cache__ is None:
+            return cls.get_by_id(dbsession, id)
+        return cls.__cache__.get(str(id), lambda: cls._load_detached(
+            dbsession,
+            cls.id == id,
+        ))
+
+    @classmethod
+    def _load_detached(cls, dbsession, *criteria):
+        '''
+        Loads an instance with every column populated (nothing expired,
+        which a detached instance could no longer load) and detaches it.
+        Relationships are not loaded and raise if used.
+        '''
+        thing = dbsession.query(
+            cls,
+        ).options(
+            raiseload('*'),
+        ).filter(
+            *criteria
+        ).populate_existing().first()
+        if thing is not None:
+            dbsession.expunge(thing)
         return thing
 
     @classmethod
-    def update_by_id(cls, id, **kwargs):
-        with transaction.manager:
-            keys = set(cls.__dict__)
-            thing = cls.get_by_id(id)
-            if thing is not None:
-                for k in kwargs:
-                    if k in keys:
-                        setattr(thing, k, kwargs[k])
-                DBSession.add(thing)
-                transaction.commit()
+    def cache_keys(cls, thing):
+        return [(cls.__cache__, str(thing.id))]
+
+    @classmethod
+    def invalidate(cls, dbsession, thing):
+        '''
+        Drops the cache entries of `thing` now, and again once the
+        transaction commits, so a concurrent read can't cache the old row
+        in between.
+        '''
+        for cache, key in cls.cache_keys(thing):
+            if cache is not None:
+                cache.invalidate(key)
+                on_commit(dbsession, cache.invalidate, key)
+
+    @classmethod
+    def delete_by_id(cls, dbsession, id):
+        thing = cls.get_by_id(dbsession, id)
+        if thing is not None:
+            dbsession.delete(thing)
+            cls.invalidate(dbsession, thing)
+        return thing
+
+    @classmethod
+    def update_by_id(cls, dbsession, id, **kwargs):
+        keys = set(cls.__dict__)
+        thing = cls.get_by_id(dbsession, id)
+        if thing is not None:
+            # also drops entries keyed on values that are changing.
+            cls.invalidate(dbsession, thing)
+            for k in kwargs:
+                if k in keys:
+                    setattr(thing, k, kwargs[k])
+            dbsession.flush()
+            cls.invalidate(dbsession, thing)
         return thing
 
     @classmethod
@@ -138,20 +451,24 @@ class Users(Base, CreationMixin, TimeStampMixin):
         nullable=True,
     )
 
-    scrapers = relationship('Scrapers', backref='owner', lazy='joined')
+    scrapers = relationship('Scrapers', backref='owner')
+
+    __server_keys__ = ('pass_salt', 'pass_hash')
+    __private_keys__ = ('pass_salt', 'pass_hash')
 
     @classmethod
-    def add(self, password, **kwargs):
-        user = super(Users, self).add(**kwargs)
-        with transaction.manager:
-            pass_salt = str(uuid4())
-            pass_hash = hashlib.sha256('{0}{1}'.format(
-                password,
-                pass_salt,
-            ).encode('utf-8')).hexdigest()
-            user.pass_salt = pass_salt
-            user.pass_hash = pass_hash
-            transaction.commit()
+    def add(self, dbsession, password, **kwargs):
+        pass_salt = str(uuid4())
+        pass_hash = hashlib.sha256('{0}{1}'.format(
+            password,
+            pass_salt,
+        ).encode('utf-8')).hexdigest()
+        user = super(Users, self).add(
+            dbsession,
+            pass_salt=pass_salt,
+            pass_hash=pass_hash,
+            **kwargs
+        )
         return user
 
     def to_dict(self):
@@ -171,14 +488,20 @@ class Municipalities(Base, CreationMixin, TimeStampMixin):
     description = Column(UnicodeText, nullable=False)
     url = Column(UnicodeText, nullable=False)
 
-    addresses = relationship(
-        "Addresses", backref="municipality", lazy="joined"
-    )
-    entities = relationship(
-         "Entities", backref="municipality", lazy="joined"
-    )
+    addresses = relationship("Addresses", backref="municipality")
+    entities = relationship("Entities", backref="municipality")
 
-    jobs = relationship("Jobs", backref="municipality", lazy="joined")
+    jobs = relationship("Jobs", backref="municipality")
+
+    __profiles__ = dict(
+        CreationMixin.__profiles__,
+        detail=(
+            selectinload('addresses'),
+            selectinload('entities').selectinload('addresses'),
+            raiseload('*'),
+        ),
+    )
+    __profiles__['list'] = __profiles__['detail']
 
     def to_dict(self):
         resp = super(Municipalities, self).to_dict()
@@ -209,7 +532,16 @@ class Entities(Base, CreationMixin, TimeStampMixin):
         nullable=False,
     )
 
-    addresses = relationship("Addresses", backref="entity", lazy="joined")
+    addresses = relationship("Addresses", backref="entity")
+
+    __profiles__ = dict(
+        CreationMixin.__profiles__,
+        detail=(
+            selectinload('addresses'),
+            raiseload('*'),
+        ),
+    )
+    __profiles__['list'] = __profiles__['detail']
 
     def to_dict(self):
         resp = super(Entities, self).to_dict()
@@ -253,6 +585,42 @@ class Addresses(Base, CreationMixin, TimeStampMixin):
         nullable=True,
     )
 
+    # The geohash of `lat`/`lng`, so addresses near a point are found by
+    # index ranges over the cells around it (see `near`).
+    geohash = Column(String(12), nullable=True)
+
+    __server_keys__ = ('geohash',)
+
+    @classmethod
+    def near(cls, dbsession, lat, lng, radius_km):
+        '''
+        Returns `(distance_km, address)` pairs for the addresses within
+        `radius_km` of `lat`/`lng`, nearest first.  Candidates are read
+        from the geohash index over the few cells covering the radius,
+        then only those are measured.
+        '''
+        boxes = bounding_boxes(lat, lng, radius_km)
+        ranges = []
+        for low, high in prefix_ranges(covering_cells(boxes)):
+            if high is None:
+                ranges.append(cls.geohash >= low)
+            else:
+                ranges.append(and_(cls.geohash >= low, cls.geohash < high))
+        addresses = dbsession.query(
+            cls,
+        ).options(
+            *cls.options('list')
+        ).filter(
+            or_(*ranges),
+        ).all()
+        nearby = []
+        for address in addresses:
+            distance = haversine(lat, lng, address.lat, address.lng)
+            if distance <= radius_km:
+                nearby.append((distance, address))
+        nearby.sort(key=lambda pair: pair[0])
+        return nearby
+
     def to_dict(self):
         resp = super(Addresses, self).to_dict()
         resp.update(
@@ -263,6 +631,8 @@ class Addresses(Base, CreationMixin, TimeStampMixin):
             city=self.city,
             state=self.state,
             zipcode=self.zipcode,
+            lat=self.lat,
+            lng=self.lng,
         )
         return resp
 
@@ -272,6 +642,16 @@ Index(
     'index_addresses_name',
     Addresses.name,
 )
+Index('index_addresses_geohash', Addresses.geohash)
+
+
+@event.listens_for(Addresses, 'before_insert')
+@event.listens_for(Addresses, 'before_update')
+def set_address_geohash(mapper, connection, address):
+    # rows written without the ORM are filled in by
+    # `geohash_civicdocs_addresses`.
+    if address.lat is not None and address.lng is not None:
+        address.geohash = geohash_encode(address.lat, address.lng)
 
 
 class DocumentTypes(Base, CreationMixin, TimeStampMixin):
@@ -284,17 +664,15 @@ class DocumentTypes(Base, CreationMixin, TimeStampMixin):
     documents = relationship(
         'Documents',
         backref='document_type',
-        lazy='joined',
     )
 
     @classmethod
-    def get_by_mine(self, mime_type):
-        with transaction.manager:
-            document_type = DBSession.query(
-                DocumentTypes,
-            ).filter(
-                DocumentTypes.mime_type == mime_type,
-            ).first()
+    def get_by_mine(self, dbsession, mime_type):
+        document_type = dbsession.query(
+            DocumentTypes,
+        ).filter(
+            DocumentTypes.mime_type == mime_type,
+        ).first()
         return document_type
 
     def to_dict(self):
@@ -346,6 +724,57 @@ Index(
 )
 
 
+class Hosts(Base, CreationMixin, TimeStampMixin):
+    '''
+    A web host that jobs crawl, see `civicdocs.urls.host_key`.  Claims
+    are limited per host, so no one server is crawled by too many
+    dispatchers at once or too often.
+    '''
+    __tablename__ = 'hosts'
+
+    name = Column(UnicodeText, nullable=False)
+    # Overrides of the configured limits, `None` for the defaults.
+    max_concurrent = Column(Integer, nullable=True)
+    min_delay_seconds = Column(Integer, nullable=True)
+    # No job of this host is claimed before then.
+    next_claim_at = Column(
+        DateTime,
+        nullable=False,
+        default=datetime.datetime.now,
+        server_default=func.now(),
+    )
+
+    __server_keys__ = ('next_claim_at',)
+
+    @classmethod
+    def get_or_add(cls, dbsession, name):
+        host = dbsession.query(cls).filter(cls.name == name).first()
+        if host is None:
+            try:
+                # a concurrent add of the same host only fails this
+                # savepoint, not the caller's transaction.
+                with dbsession.begin_nested():
+                    host = cls(id=uuid4(), name=name)
+                    dbsession.add(host)
+            except IntegrityError:
+                host = dbsession.query(cls).filter(cls.name == name).one()
+        return host
+
+    def to_dict(self):
+        resp = super(Hosts, self).to_dict()
+        resp.update(
+            name=self.name,
+            max_concurrent=self.max_concurrent,
+            min_delay_seconds=self.min_delay_seconds,
+            next_claim_at=str(self.next_claim_at),
+        )
+        return resp
+
+
+Index('index_hosts_id', Hosts.id, unique=True)
+Index('index_hosts_name', Hosts.name, unique=True)
+
+
 class Jobs(Base, CreationMixin, TimeStampMixin):
     __tablename__ = 'jobs'
 
@@ -356,6 +785,44 @@ class Jobs(Base, CreationMixin, TimeStampMixin):
     in_process = Column(Boolean, nullable=False)
     start_run_datetime = Column(DateTime)
     last_run_datetime = Column(DateTime)
+    lease_dispatcher_id = Column(
+        UUIDType(binary=False),
+        ForeignKey('dispatchers.id', use_alter=True),
+        nullable=True,
+    )
+    lease_expiration_datetime = Column(DateTime, nullable=True)
+
+    # When the job is due next; jobs are claimed by `priority` (highest
+    # first) among the due ones.
+    next_run_at = Column(
+        DateTime,
+        nullable=False,
+        default=datetime.datetime.now,
+        server_default=func.now(),
+    )
+    priority = Column(Integer, nullable=False, default=0, server_default='0')
+    # Seconds between successful runs, `None` for the configured default.
+    recrawl_interval = Column(Integer, nullable=True)
+    # Failures since the last successful run, for the retry backoff.
+    failure_count = Column(
+        Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    host_id = Column(
+        UUIDType(binary=False),
+        ForeignKey('hosts.id'),
+        nullable=True,
+    )
+
+    __server_keys__ = (
+        'lease_dispatcher_id',
+        'lease_expiration_datetime',
+        'failure_count',
+        'host_id',
+    )
 
     municipality_id = Column(
         UUIDType(binary=False),
@@ -363,44 +830,283 @@ class Jobs(Base, CreationMixin, TimeStampMixin):
         nullable=False,
     )
 
-    job_runs = relationship('JobRuns', backref='job', lazy='joined')
+    job_runs = relationship('JobRuns', backref='job')
 
     dispatcher = relationship(
         'Dispatchers',
         backref='current_job',
-        lazy='joined',
+        foreign_keys='Dispatchers.current_job_id',
     )
 
     @classmethod
-    def get_job(self):
+    def add(cls, dbsession, **kwargs):
+        if kwargs.get('host_id') is None and kwargs.get('url'):
+            host = host_key(kwargs['url'])
+            if host is not None:
+                kwargs['host_id'] = Hosts.get_or_add(dbsession, host).id
+        return super(Jobs, cls).add(dbsession, **kwargs)
+
+    @classmethod
+    def get_job(cls, dbsession, dispatcher_id=None, lease_seconds=300,
+                host_max_concurrent=2, host_min_delay_seconds=5):
+        jobs = cls.get_jobs(dbsession, 1, dispatcher_id, lease_seconds,
+                            host_max_concurrent, host_min_delay_seconds)
+        if jobs:
+            return jobs[0]
+        return None
+
+    @classmethod
+    def get_jobs(cls, dbsession, count=1, dispatcher_id=None,
+                 lease_seconds=300, host_max_concurrent=2,
+                 host_min_delay_seconds=5, scraper_id=None):
         '''
-        This get's the next oldest job.  This uses the `in_process` as a
-        semaphor against the row in the table.  We get the next oldest
-        job that isn't in process.  This results in a round robin of all
-        jobs being processed as fast as the available scraper clusters
-        can handle them.
+        This claims up to `count` of the due jobs, highest `priority`
+        first and then the longest overdue.  This uses the `in_process` as
+        a semaphor against the row in the table.  Only the jobs that
+        aren't in process and whose `next_run_at` has passed are read, a
+        range of `index_jobs_in_process_next_run_at_priority`, so the
+        cost depends on the backlog rather than the size of the table.
+
+        Jobs are also limited by host: a host has at most
+        `max_concurrent` (or `host_max_concurrent`) jobs in process, and
+        its claims are at least `min_delay_seconds` (or
+        `host_min_delay_seconds`) apart, so at most one job per host is
+        claimed per call.  Jobs of saturated or resting hosts are
+        filtered out by the candidate query itself, which also ranks each
+        host's jobs (with `row_number()`) and reads only the first, so
+        one busy host can't crowd the others out of the `count`
+        candidates; in process jobs are counted with
+        `index_jobs_host_id_in_process`.  A host's claim is
+        taken with an UPDATE of its `next_claim_at` that only succeeds
+        while the host is still below its limits.
+
+        On PostgreSQL the candidates are read `FOR UPDATE SKIP LOCKED`,
+        so concurrent dispatchers each see a different set of rows
+        rather than waiting on the same row lock.  Each candidate is then
+        claimed with an UPDATE that only succeeds while `in_process` is
+        still false.
+
+        Each claim is a lease held by `dispatcher_id` for `lease_seconds`;
+        unless it is extended with `extend_lease`, `reap_expired_leases`
+        returns the job to the queue once it expires.  A `JobRuns` row is
+        opened for each claim made on behalf of a dispatcher, and the
+        job's url is queued in its crawl frontier (`FrontierUrls.seed`).
         '''
-        with transaction.manager:
-            q = update(Jobs).values({
-                'in_process': True,
-                'start_run_datetime': datetime.datetime.now(),
-            }).where(
-                Jobs.in_process == False,
+        now = datetime.datetime.now()
+        values = {
+            'in_process': True,
+            'start_run_datetime': now,
+            'lease_dispatcher_id': dispatcher_id,
+            'lease_expiration_datetime':
+                now + datetime.timedelta(seconds=lease_seconds),
+        }
+        hosts = Hosts.__table__
+        in_process = Jobs.__table__.alias('in_process_jobs')
+        in_process_count = select([
+            func.count(),
+        ]).where(
+            in_process.c.host_id == hosts.c.id,
+        ).where(
+            in_process.c.in_process == True,
+        ).as_scalar()
+        below_limits = and_(
+            hosts.c.next_claim_at <= now,
+            in_process_count < func.coalesce(
+                hosts.c.max_concurrent,
+                host_max_concurrent,
+            ),
+        )
+        # jobs without a host are each ranked on their own.
+        ranked = select([
+            Jobs.id,
+            hosts.c.max_concurrent,
+            hosts.c.min_delay_seconds,
+            func.row_number().over(
+                partition_by=func.coalesce(Jobs.host_id, Jobs.id),
+                order_by=(Jobs.priority.desc(), Jobs.next_run_at),
+            ).label('host_rank'),
+        ]).select_from(
+            Jobs.__table__.outerjoin(hosts, Jobs.host_id == hosts.c.id),
+        ).where(
+            Jobs.in_process == False,
+        ).where(
+            Jobs.next_run_at <= now,
+        ).where(
+            or_(Jobs.host_id == None, below_limits),
+        ).alias('ranked_jobs')
+        # the rows are locked by the outer query, as window functions
+        # can't be read FOR UPDATE.
+        eligible = select([
+            Jobs.id,
+            Jobs.host_id,
+            ranked.c.max_concurrent,
+            ranked.c.min_delay_seconds,
+        ]).select_from(
+            Jobs.__table__.join(ranked, Jobs.id == ranked.c.id),
+        ).where(
+            ranked.c.host_rank == 1,
+        ).order_by(
+            Jobs.priority.desc(),
+            Jobs.next_run_at,
+        ).limit(count)
+        if dbsession.bind.dialect.name == 'postgresql':
+            eligible = eligible.with_for_update(
+                skip_locked=True,
+                of=Jobs.__table__,
+            )
+        ids = []
+        for row in dbsession.execute(eligible).fetchall():
+            if row.host_id is not None:
+                delay = row.min_delay_seconds
+                if delay is None:
+                    delay = host_min_delay_seconds
+                result = dbsession.execute(update(hosts).values({
+                    'next_claim_at': now + datetime.timedelta(seconds=delay),
+                }).where(
+                    hosts.c.id == row.host_id,
+                ).where(
+                    below_limits,
+                ))
+                if result.rowcount != 1:
+                    continue
+            result = dbsession.execute(update(Jobs).values(
+                values,
             ).where(
-                Jobs.id == DBSession.query(
-                    Jobs.id,
-                ).order_by(
-                    desc(Jobs.last_run_datetime),
-                ).limit(1).with_for_update().as_scalar()
-            ).returning(Jobs.id)
-            result = DBSession.execute(q)
-            job = None
-            for row in result:
-                print('Row ID: {0}'.format(row.id))
-                job = Jobs.get_by_id(row.id)
-                break
-            transaction.commit()
-        return job
+                Jobs.id == row.id,
+            ).where(
+                Jobs.in_process == False,
+            ))
+            if result.rowcount == 1:
+                ids.append(row.id)
+        jobs = []
+        if ids:
+            if dispatcher_id is not None:
+                JobRuns.open(dbsession, ids, dispatcher_id, scraper_id, now)
+            FrontierUrls.seed(dbsession, ids)
+            jobs = dbsession.query(
+                Jobs,
+            ).options(
+                *Jobs.options('detail')
+            ).filter(
+                Jobs.id.in_(ids),
+            ).order_by(
+                Jobs.priority.desc(),
+                Jobs.next_run_at,
+            ).populate_existing().all()
+        return jobs
+
+    @staticmethod
+    def backoff_seconds(failure_count, retry_seconds, max_seconds):
+        return min(retry_seconds * 2 ** (failure_count - 1), max_seconds)
+
+    @classmethod
+    def complete(cls, dbsession, id, dispatcher_id, succeeded,
+                 recrawl_seconds=86400, retry_seconds=60,
+                 max_backoff_seconds=86400):
+        '''
+        Ends the run of a job leased by `dispatcher_id` and schedules its
+        next run: after its `recrawl_interval` (or `recrawl_seconds`) when
+        it succeeded, else after a backoff that doubles with each failure
+        in a row, from `retry_seconds` up to `max_backoff_seconds`.
+        Returns the next run time, or `None` if the dispatcher no longer
+        holds the lease.
+        '''
+        job = dbsession.query(
+            Jobs.recrawl_interval,
+            Jobs.failure_count,
+        ).filter(
+            Jobs.id == id,
+            Jobs.in_process == True,
+            Jobs.lease_dispatcher_id == dispatcher_id,
+        ).first()
+        if job is None:
+            return None
+        now = datetime.datetime.now()
+        values = {
+            'in_process': False,
+            'lease_dispatcher_id': None,
+            'lease_expiration_datetime': None,
+        }
+        if succeeded:
+            interval = job.recrawl_interval
+            if interval is None:
+                interval = recrawl_seconds
+            values.update(
+                last_run_datetime=now,
+                failure_count=0,
+            )
+        else:
+            interval = cls.backoff_seconds(
+                job.failure_count + 1,
+                retry_seconds,
+                max_backoff_seconds,
+            )
+            values.update(
+                failure_count=Jobs.failure_count + 1,
+            )
+        values['next_run_at'] = now + datetime.timedelta(seconds=interval)
+        # the lease may have been reaped since it was read.
+        result = dbsession.execute(update(Jobs).values(values).where(
+            Jobs.id == id,
+        ).where(
+            Jobs.in_process == True,
+        ).where(
+            Jobs.lease_dispatcher_id == dispatcher_id,
+        ))
+        if result.rowcount == 1:
+            return values['next_run_at']
+        return None
+
+    @classmethod
+    def extend_lease(cls, dbsession, id, dispatcher_id, lease_seconds=300):
+        '''
+        Extends the lease `dispatcher_id` holds on a job, returning the
+        new expiration, or `None` if the dispatcher no longer holds it.
+        '''
+        expiration = datetime.datetime.now() + datetime.timedelta(
+            seconds=lease_seconds)
+        result = dbsession.execute(update(Jobs).values({
+            'lease_expiration_datetime': expiration,
+        }).where(
+            Jobs.id == id,
+        ).where(
+            Jobs.in_process == True,
+        ).where(
+            Jobs.lease_dispatcher_id == dispatcher_id,
+        ))
+        if result.rowcount == 1:
+            return expiration
+        return None
+
+    @classmethod
+    def reap_expired_leases(cls, dbsession):
+        '''
+        Returns every job whose lease has expired to the queue with one
+        UPDATE over `index_jobs_in_process_lease_expiration_datetime`.
+        '''
+        result = dbsession.execute(update(Jobs).values({
+            'in_process': False,
+            'lease_dispatcher_id': None,
+            'lease_expiration_datetime': None,
+        }).where(
+            Jobs.in_process == True,
+        ).where(
+            Jobs.lease_expiration_datetime < datetime.datetime.now(),
+        ))
+        return result.rowcount
+
+    @classmethod
+    def next_due(cls, dbsession):
+        '''
+        Returns when the next job not in process is due to run (possibly
+        already), read from the head of
+        `index_jobs_in_process_next_run_at_priority`.
+        '''
+        return dbsession.query(
+            func.min(Jobs.next_run_at),
+        ).filter(
+            Jobs.in_process == False,
+        ).scalar()
 
     def to_dict(self):
         resp = super(Jobs, self).to_dict()
@@ -412,6 +1118,11 @@ class Jobs(Base, CreationMixin, TimeStampMixin):
             start_run_datetime=str(self.start_run_datetime),
             in_process=self.in_process,
             last_run_datetime=str(self.last_run_datetime),
+            lease_expiration_datetime=str(self.lease_expiration_datetime),
+            next_run_at=str(self.next_run_at),
+            priority=self.priority,
+            recrawl_interval=self.recrawl_interval,
+            failure_count=self.failure_count,
         )
         return resp
 
@@ -419,6 +1130,22 @@ class Jobs(Base, CreationMixin, TimeStampMixin):
 Index('index_jobs_id', Jobs.id, unique=True)
 Index('index_jobs_name', Jobs.name)
 Index('index_jobs_url', Jobs.name)
+Index(
+    'index_jobs_in_process_next_run_at_priority',
+    Jobs.in_process,
+    Jobs.next_run_at,
+    Jobs.priority,
+)
+Index(
+    'index_jobs_host_id_in_process',
+    Jobs.host_id,
+    Jobs.in_process,
+)
+Index(
+    'index_jobs_in_process_lease_expiration_datetime',
+    Jobs.in_process,
+    Jobs.lease_expiration_datetime,
+)
 
 
 class Scrapers(Base, CreationMixin, TimeStampMixin):
@@ -431,20 +1158,55 @@ class Scrapers(Base, CreationMixin, TimeStampMixin):
         ForeignKey('users.id'),
         nullable=True,  # TODO: may want to rethink this ...
     )
-    dispatcher = relationship('Dispatchers', backref='scraper', lazy='joined')
-    workers = relationship('Workers', backref='scraper', lazy='joined')
+    token = Column(UnicodeText, nullable=True)
+    dispatcher = relationship('Dispatchers', backref='scraper')
+    workers = relationship('Workers', backref='scraper')
+
+    __server_keys__ = ('token',)
+    __private_keys__ = ('token',)
+
+    __profiles__ = dict(
+        CreationMixin.__profiles__,
+        detail=(
+            joinedload('owner'),
+            raiseload('*'),
+        ),
+    )
+    __profiles__['list'] = __profiles__['detail']
+
+    # a `civicdocs.cache.Cache` of instances by token.
+    __token_cache__ = None
 
     @classmethod
-    def get_by_token(self, token):
-        with transaction.manager:
-            scraper = DBSession.query(
-                Scrapers,
-            ).filter(
-                Scrapers.token == token,
-            ).first()
-            transaction.commit()
+    def add(cls, dbsession, **kwargs):
+        if kwargs.get('token') is None:
+            kwargs['token'] = uuid4().hex
+        return super(Scrapers, cls).add(dbsession, **kwargs)
+
+    @classmethod
+    def get_by_token(self, dbsession, token):
+        if Scrapers.__token_cache__ is not None:
+            return Scrapers.__token_cache__.get(
+                token,
+                lambda: Scrapers._load_detached(
+                    dbsession,
+                    Scrapers.token == token,
+                ),
+            )
+        scraper = dbsession.query(
+            Scrapers,
+        ).filter(
+            Scrapers.token == token,
+        ).first()
         return scraper
 
+    @classmethod
+    def cache_keys(cls, scraper):
+        keys = super(Scrapers, cls).cache_keys(scraper)
+        if scraper.token is not None:
+            keys.append((cls.__token_cache__, scraper.token))
+        return keys
+
     def to_dict(self):
         resp = super(Scrapers, self).to_dict()
         resp.update(
@@ -457,9 +1219,114 @@ class Scrapers(Base, CreationMixin, TimeStampMixin):
 
 Index('index_scrapers_id', Jobs.name, unique=True)
 Index('index_scrapers_name', Jobs.name)
+Index('index_scrapers_token', Scrapers.token, unique=True)
+
+
+class HeartbeatMixin(object):
+    ALIVE = u'alive'
+    STALE = u'stale'
 
+    # `ALIVE` until the sweep finds no heartbeat for a while, see
+    # `sweep_stale`.
+    status = Column(
+        Unicode(16),
+        nullable=False,
+        default=ALIVE,
+        server_default=ALIVE,
+    )
 
-class Workers(Base, CreationMixin, TimeStampMixin):
+    # Columns a heartbeat sets to its latest value, and columns it adds
+    # a delta to.
+    __heartbeat_gauges__ = ()
+    __heartbeat_counters__ = ()
+
+    @classmethod
+    def liveness(cls, alive, stale_seconds):
+        '''
+        Returns the criteria for nodes that are (or aren't) alive: they
+        called in within `stale_seconds`, and weren't swept since.
+        '''
+        cutoff = datetime.datetime.now() - datetime.timedelta(
+            seconds=stale_seconds)
+        if alive:
+            return [
+                cls.status == cls.ALIVE,
+                cls.last_callin_datetime >= cutoff,
+            ]
+        return [or_(
+            cls.status != cls.ALIVE,
+            cls.last_callin_datetime < cutoff,
+            cls.last_callin_datetime == None,
+        )]
+
+    @classmethod
+    def sweep_stale(cls, dbsession, stale_seconds):
+        '''
+        Marks the alive nodes that haven't called in for `stale_seconds`
+        as stale, with one UPDATE over the status index.  Returns the
+        ids of the nodes marked.
+        '''
+        cutoff = datetime.datetime.now() - datetime.timedelta(
+            seconds=stale_seconds)
+        ids = [row.id for row in dbsession.query(
+            cls.id,
+        ).filter(
+            cls.status == cls.ALIVE,
+            cls.last_callin_datetime < cutoff,
+        )]
+        if ids:
+            dbsession.execute(update(cls).values(
+                cls.stale_values(),
+            ).where(
+                cls.id.in_(ids),
+            ))
+            cache = getattr(cls, '__cache__', None)
+            if cache is not None:
+                for id in ids:
+                    cache.invalidate(str(id))
+                    on_commit(dbsession, cache.invalidate, str(id))
+        return ids
+
+    @classmethod
+    def stale_values(cls):
+        return {'status': cls.STALE}
+
+    @classmethod
+    def apply_heartbeats(cls, dbsession, beats):
+        '''
+        Writes `{id: (gauges, counters)}` heartbeats with one executemany
+        UPDATE; gauges a heartbeat didn't send keep their value.
+        '''
+        values = {
+            'last_callin_datetime': bindparam('last_callin_datetime'),
+            'status': cls.ALIVE,
+        }
+        columns = cls.__table__.c
+        for key in cls.__heartbeat_gauges__:
+            values[key] = func.coalesce(
+                bindparam('_' + key, type_=columns[key].type),
+                columns[key],
+            )
+        for key in cls.__heartbeat_counters__:
+            values[key] = columns[key] + bindparam('_' + key)
+        params = []
+        for id, (gauges, counters) in beats.items():
+            param = {
+                '_id': id,
+                'last_callin_datetime': gauges['last_callin_datetime'],
+            }
+            for key in cls.__heartbeat_gauges__:
+                param['_' + key] = gauges.get(key)
+            for key in cls.__heartbeat_counters__:
+                param['_' + key] = counters.get(key, 0)
+            params.append(param)
+        if params:
+            dbsession.execute(update(cls).where(
+                cls.id == bindparam('_id'),
+            ).values(values), params)
+
+
+class Workers(Base, CreationMixin, TimeStampMixin, HeartbeatMixin):
 
     __tablename__ = 'workers'
     scraper_id = Column(
@@ -477,6 +1344,9 @@ class Workers(Base, CreationMixin, TimeStampMixin):
     document_count = Column(Integer, nullable=False)
     bandwidth = Column(Integer, nullable=False)
 
+    __heartbeat_gauges__ = ('up_time', 'bandwidth')
+    __heartbeat_counters__ = ('document_count',)
+
     def to_dict(self):
         resp = super(Workers, self).to_dict()
         resp.update(
@@ -486,11 +1356,19 @@ class Workers(Base, CreationMixin, TimeStampMixin):
             up_time=self.up_time,
             document_count=self.document_count,
             bandwidth=self.bandwidth,
+            status=self.status,
         )
         return resp
 
 
-class Dispatchers(Base, CreationMixin, TimeStampMixin):
+Index(
+    'index_workers_status_last_callin_datetime',
+    Workers.status,
+    Workers.last_callin_datetime,
+)
+
+
+class Dispatchers(Base, CreationMixin, TimeStampMixin, HeartbeatMixin):
 
     __tablename__ = 'dispatchers'
     scraper_id = Column(
@@ -507,22 +1385,60 @@ class Dispatchers(Base, CreationMixin, TimeStampMixin):
     up_time = Column(Integer, nullable=False)
     idle = Column(Boolean, nullable=False)
     dispatch_count = Column(Integer, nullable=False)
-    workers = relationship('Workers', backref='dispatcher', lazy='joined')
+    workers = relationship('Workers', backref='dispatcher')
+
+    __heartbeat_gauges__ = ('up_time', 'idle')
+    __heartbeat_counters__ = ('dispatch_count',)
+
+    @classmethod
+    def stale_values(cls):
+        # a dead dispatcher isn't working its job any more.
+        return {'status': cls.STALE, 'current_job_id': None}
 
     @classmethod
-    def update_status(self, dispatcher_id, last_callin_datetime,
+    def sweep_stale(cls, dbsession, stale_seconds):
+        '''
+        Also returns the jobs leased by the dispatchers marked stale to
+        the queue.
+        '''
+        ids = super(Dispatchers, cls).sweep_stale(dbsession, stale_seconds)
+        if ids:
+            dbsession.execute(update(Jobs).values({
+                'in_process': False,
+                'lease_dispatcher_id': None,
+                'lease_expiration_datetime': None,
+            }).where(
+                Jobs.in_process == True,
+            ).where(
+                Jobs.lease_dispatcher_id.in_(ids),
+            ))
+        return ids
+
+    __profiles__ = dict(
+        CreationMixin.__profiles__,
+        detail=(
+            joinedload('scraper').joinedload('owner'),
+            selectinload('workers'),
+            joinedload('current_job'),
+            raiseload('*'),
+        ),
+    )
+    __profiles__['list'] = __profiles__['detail']
+
+    @classmethod
+    def update_status(self, dbsession, dispatcher_id, last_callin_datetime,
                       up_time, idle=True):
-        with transaction.manager:
-            dispatcher = DBSession.query(
-                Dispatchers,
-            ).filter(
-                Dispatchers.id == dispatcher_id,
-            ).first()
-            if dispatcher is not None:
-                dispatcher.last_callin_datetime = last_callin_datetime
-                dispatcher.up_time = up_time
-                dispatcher.idle = idle
-                transaction.commit()
+        dispatcher = dbsession.query(
+            Dispatchers,
+        ).filter(
+            Dispatchers.id == dispatcher_id,
+        ).first()
+        if dispatcher is not None:
+            dispatcher.last_callin_datetime = last_callin_datetime
+            dispatcher.up_time = up_time
+            dispatcher.idle = idle
+            dispatcher.status = Dispatchers.ALIVE
+            Dispatchers.invalidate(dbsession, dispatcher)
         return dispatcher
 
     def to_dict(self):
@@ -535,10 +1451,18 @@ class Dispatchers(Base, CreationMixin, TimeStampMixin):
             scraper=self.scraper.to_dict(),
             wrokers=[w.to_dict() for w in self.workers],
             current_job=current_job,
+            status=self.status,
         )
         return resp
 
 
+Index(
+    'index_dispatchers_status_last_callin_datetime',
+    Dispatchers.status,
+    Dispatchers.last_callin_datetime,
+)
+
+
 class JobRuns(Base, CreationMixin, TimeStampMixin):
     __tablename__ = 'job_runs'
 
@@ -552,21 +1476,445 @@ class JobRuns(Base, CreationMixin, TimeStampMixin):
         ForeignKey('scrapers.id'),
         nullable=False
     )
+    dispatcher_id = Column(
+        UUIDType(binary=False),
+        ForeignKey('dispatchers.id'),
+        nullable=True,
+    )
+    # copied from the job, so throughput can be rolled up by
+    # municipality without a join.
+    municipality_id = Column(
+        UUIDType(binary=False),
+        ForeignKey('municipalities.id'),
+        nullable=True,
+    )
     start_datetime = Column(DateTime, nullable=False)
     finished = Column(Boolean, nullable=False)
     finish_datetime = Column(DateTime, nullable=True)
+    # `None` until the run is finished.  Runs that were abandoned (their
+    # lease expired, or their dispatcher went stale) are closed as failed
+    # the next time their job is claimed.
+    succeeded = Column(Boolean, nullable=True)
+    document_count = Column(Integer, nullable=True)
+    bytes_fetched = Column(BigInteger, nullable=True)
+    pages_visited = Column(Integer, nullable=True)
+    duration_seconds = Column(Float, nullable=True)
+
+    METRICS = ('document_count', 'bytes_fetched', 'pages_visited')
+
+    BUCKETS = ('hour', 'day', 'week', 'month')
+
+    @classmethod
+    def open(cls, dbsession, job_ids, dispatcher_id, scraper_id=None,
+             start_datetime=None):
+        '''
+        Opens a run for each of the just claimed `job_ids`, after closing
+        any run of theirs that was abandoned.
+        '''
+        if start_datetime is None:
+            start_datetime = datetime.datetime.now()
+        if scraper_id is None:
+            scraper_id = dbsession.query(
+                Dispatchers.scraper_id,
+            ).filter(
+                Dispatchers.id == dispatcher_id,
+            ).scalar()
+            if scraper_id is None:
+                return
+        dbsession.execute(update(cls).values({
+            'finished': True,
+            'succeeded': False,
+            'finish_datetime': start_datetime,
+        }).where(
+            cls.job_id.in_(job_ids),
+        ).where(
+            cls.finished == False,
+        ))
+        municipality_ids = dict(dbsession.query(
+            Jobs.id,
+            Jobs.municipality_id,
+        ).filter(
+            Jobs.id.in_(job_ids),
+        ))
+        dbsession.execute(cls.__table__.insert(), [dict(
+            id=uuid4(),
+            job_id=job_id,
+            scraper_id=scraper_id,
+            dispatcher_id=dispatcher_id,
+            municipality_id=municipality_ids.get(job_id),
+            start_datetime=start_datetime,
+            finished=False,
+            creation_datetime=start_datetime,
+            modified_datetime=start_datetime,
+        ) for job_id in job_ids])
+
+    @classmethod
+    def close(cls, dbsession, job_id, dispatcher_id, succeeded, **metrics):
+        '''
+        Closes the open run of `job_id` by `dispatcher_id` with its
+        `METRICS`, returning it, or `None` if there is no such run.
+        '''
+        run = dbsession.query(
+            cls,
+        ).options(
+            *cls.options('detail')
+        ).filter(
+            cls.job_id == job_id,
+            cls.dispatcher_id == dispatcher_id,
+            cls.finished == False,
+        ).first()
+        if run is None:
+            return None
+        now = datetime.datetime.now()
+        run.finished = True
+        run.succeeded = succeeded
+        run.finish_datetime = now
+        run.duration_seconds = (now - run.start_datetime).total_seconds()
+        for key in cls.METRICS:
+            setattr(run, key, metrics.get(key))
+        dbsession.flush()
+        return run
+
+    @classmethod
+    def bucket(cls, dbsession, name):
+        '''
+        An expression truncating `start_datetime` to the `name` bucket.
+        '''
+        if dbsession.bind.dialect.name == 'postgresql':
+            return func.date_trunc(name, cls.start_datetime)
+        if name == 'week':
+            # the monday on or before the start.
+            return func.strftime(
+                '%Y-%m-%d 00:00:00',
+                cls.start_datetime,
+                'weekday 0',
+                '-6 days',
+            )
+        formats = dict(
+            hour='%Y-%m-%d %H:00:00',
+            day='%Y-%m-%d 00:00:00',
+            month='%Y-%m-01 00:00:00',
+        )
+        return func.strftime(formats[name], cls.start_datetime)
+
+    @classmethod
+    def throughput(cls, dbsession, criteria, bucket='day', since=None,
+                   until=None):
+        '''
+        Rolls up the finished runs matching `criteria` by `bucket` of
+        their start time: the number of runs and successes, the metric
+        totals, and documents and bytes per second of crawling.
+        '''
+        period = cls.bucket(dbsession, bucket).label('period')
+        q = dbsession.query(
+            period,
+            func.count().label('runs'),
+            func.sum(case([(cls.succeeded == True, 1)], else_=0)).label(
+                'succeeded'),
+            func.sum(cls.document_count).label('document_count'),
+            func.sum(cls.bytes_fetched).label('bytes_fetched'),
+            func.sum(cls.pages_visited).label('pages_visited'),
+            func.sum(cls.duration_seconds).label('duration_seconds'),
+            func.max(cls.duration_seconds).label('max_duration_seconds'),
+        ).filter(
+            cls.finished == True,
+            *criteria
+        )
+        if since is not None:
+            q = q.filter(cls.start_datetime >= since)
+        if until is not None:
+            q = q.filter(cls.start_datetime < until)
+        periods = []
+        for row in q.group_by(period).order_by(period):
+            # PostgreSQL sums integers as numerics, which come back as
+            # `Decimal`s.
+            resp = dict(
+                (key, int(getattr(row, key) or 0))
+                for key in ('runs', 'succeeded', 'document_count',
+                            'bytes_fetched', 'pages_visited')
+            )
+            duration = float(row.duration_seconds or 0)
+            resp.update(
+                period=str(row.period),
+                duration_seconds=duration,
+                max_duration_seconds=(
+                    float(row.max_duration_seconds)
+                    if row.max_duration_seconds is not None else None),
+                average_duration_seconds=duration / resp['runs'],
+                documents_per_second=(
+                    resp['document_count'] / duration
+                    if duration else None),
+                bytes_per_second=(
+                    resp['bytes_fetched'] / duration
+                    if duration else None),
+            )
+            periods.append(resp)
+        return periods
 
     def to_dict(self):
         resp = super(JobRuns, self).to_dict()
         resp.update(
-            job=self.job.to_dict(),
-            scraper=self.scraper.to_dict(),
-            status=self.status,
+            job_id=str(self.job_id),
+            scraper_id=str(self.scraper_id),
+            dispatcher_id=str(self.dispatcher_id),
+            start_datetime=str(self.start_datetime),
+            finished=self.finished,
             finish_datetime=str(self.finish_datetime),
+            succeeded=self.succeeded,
+            document_count=self.document_count,
+            bytes_fetched=self.bytes_fetched,
+            pages_visited=self.pages_visited,
+            duration_seconds=self.duration_seconds,
+        )
+        return resp
+
+
+Index(
+    'index_job_runs_job_id_finished',
+    JobRuns.job_id,
+    JobRuns.finished,
+)
+Index(
+    'index_job_runs_job_id_start_datetime',
+    JobRuns.job_id,
+    JobRuns.start_datetime,
+)
+Index(
+    'index_job_runs_municipality_id_start_datetime',
+    JobRuns.municipality_id,
+    JobRuns.start_datetime,
+)
+
+
+class FrontierFilters(Base):
+    '''
+    The seen url filter of the crawl frontier of a job (see
+    `civicdocs.frontier`), kept between runs so a recrawl only queues the
+    pages it has not seen before.
+    '''
+    __tablename__ = 'frontier_filters'
+
+    job_id = Column(
+        UUIDType(binary=False),
+        ForeignKey('jobs.id'),
+        primary_key=True,
+    )
+    size = Column(Integer, nullable=False)
+    hashes = Column(Integer, nullable=False)
+    bits = Column(LargeBinary, nullable=False)
+    # how many urls were added, to tell when the filter is over capacity.
+    url_count = Column(Integer, nullable=False)
+    modified_datetime = Column(DateTime, nullable=False)
+
+    @classmethod
+    def load(cls, dbsession, job_id):
+        row = dbsession.query(cls).filter(cls.job_id == job_id).first()
+        if row is None:
+            return None
+        return BloomFilter(row.size, row.hashes, row.bits)
+
+    @classmethod
+    def merge(cls, dbsession, job_id, bloom, digests, error_rate=0.001):
+        '''
+        Adds `bloom` (holding the new url `digests`) to the stored filter
+        of `job_id`, which other processes may have added to since it was
+        loaded, and returns the merged filter.  Once the stored filter
+        holds more urls than its capacity a new one, sized for twice as
+        many, is started with `digests`; the urls of the old one may then
+        be queued once more by a later run.  On PostgreSQL the row is
+        locked while it is merged.
+        '''
+        q = dbsession.query(cls).filter(cls.job_id == job_id)
+        if dbsession.bind.dialect.name == 'postgresql':
+            q = q.with_for_update()
+        row = q.first()
+        now = datetime.datetime.now()
+        if row is None:
+            try:
+                with dbsession.begin_nested():
+                    dbsession.add(cls(
+                        job_id=job_id,
+                        size=bloom.size,
+                        hashes=bloom.hashes,
+                        bits=bloom.to_bytes(),
+                        url_count=0,
+                        modified_datetime=now,
+                    ))
+            except IntegrityError:
+                pass
+            row = q.one()
+        if (row.size, row.hashes) != (bloom.size, bloom.hashes):
+            # another process started a new filter.
+            bloom = BloomFilter(row.size, row.hashes)
+            for digest in digests:
+                bloom.add(digest)
+        bloom.union(row.bits)
+        row.url_count += len(digests)
+        if row.url_count > bloom.capacity:
+            bloom = BloomFilter.for_capacity(2 * row.url_count, error_rate)
+            for digest in digests:
+                bloom.add(digest)
+            row.size = bloom.size
+            row.hashes = bloom.hashes
+            row.url_count = len(digests)
+        row.bits = bloom.to_bytes()
+        row.modified_datetime = now
+        dbsession.flush()
+        return bloom
+
+
+class FrontierUrls(Base, CreationMixin, TimeStampMixin):
+    '''
+    The urls queued to be crawled for a job, with their link depth from
+    the job's url.  Workers lease them in batches (as dispatchers lease
+    jobs) and delete them once fetched; an expired lease puts a url back
+    in the queue.
+    '''
+    __tablename__ = 'frontier_urls'
+
+    job_id = Column(
+        UUIDType(binary=False),
+        ForeignKey('jobs.id'),
+        nullable=False,
+    )
+    url = Column(UnicodeText, nullable=False)
+    url_hash = Column(String(64), nullable=False)
+    depth = Column(Integer, nullable=False)
+    lease_worker_id = Column(
+        UUIDType(binary=False),
+        ForeignKey('workers.id'),
+        nullable=True,
+    )
+    lease_expiration_datetime = Column(DateTime, nullable=True)
+
+    @classmethod
+    def add_many(cls, dbsession, job_id, urls):
+        '''
+        Queues `(url, url_hash, depth)` for `job_id` in one executemany.
+        '''
+        if not urls:
+            return
+        now = datetime.datetime.now()
+        dbsession.execute(cls.__table__.insert(), [dict(
+            id=uuid4(),
+            job_id=job_id,
+            url=url,
+            url_hash=hash_,
+            depth=depth,
+            creation_datetime=now,
+            modified_datetime=now,
+        ) for url, hash_, depth in urls])
+
+    @classmethod
+    def seed(cls, dbsession, job_ids):
+        '''
+        Queues the url of each of `job_ids` at depth 0, unless it is
+        still queued from an earlier run.  Seeds are queued on every run
+        whether or not they were seen, since that is where new pages are
+        linked from.
+        '''
+        jobs = dbsession.query(
+            Jobs.id,
+            Jobs.url,
+        ).filter(
+            Jobs.id.in_(job_ids),
+        ).all()
+        seeds = dict((job.id, url_hash(job.url)) for job in jobs)
+        queued = set(dbsession.query(
+            cls.job_id,
+            cls.url_hash,
+        ).filter(
+            cls.job_id.in_(job_ids),
+            cls.depth == 0,
+        ))
+        for job in jobs:
+            if (job.id, seeds[job.id]) not in queued:
+                cls.add_many(dbsession, job.id, [
+                    (job.url, seeds[job.id], 0),
+                ])
+
+    @classmethod
+    def lease(cls, dbsession, job_id, worker_id, count, lease_seconds=300):
+        '''
+        Leases up to `count` of the queued urls of `job_id` to
+        `worker_id`, shallowest first, and returns them.  The urls are
+        claimed with one UPDATE that only takes those still unleased (or
+        whose lease expired), then read back by their new lease.
+        '''
+        now = datetime.datetime.now()
+        expiration = now + datetime.timedelta(seconds=lease_seconds)
+        available = or_(
+            cls.lease_expiration_datetime == None,
+            cls.lease_expiration_datetime < now,
+        )
+        candidates = select([
+            cls.id,
+        ]).where(
+            cls.job_id == job_id,
+        ).where(
+            available,
+        ).order_by(
+            cls.depth,
+            cls.creation_datetime,
+        ).limit(count)
+        if dbsession.bind.dialect.name == 'postgresql':
+            candidates = candidates.with_for_update(skip_locked=True)
+        ids = [row.id for row in dbsession.execute(candidates)]
+        if not ids:
+            return []
+        dbsession.execute(update(cls).values({
+            'lease_worker_id': worker_id,
+            'lease_expiration_datetime': expiration,
+        }).where(
+            cls.id.in_(ids),
+        ).where(
+            available,
+        ))
+        return dbsession.query(
+            cls,
+        ).filter(
+            cls.id.in_(ids),
+            cls.lease_worker_id == worker_id,
+            cls.lease_expiration_datetime == expiration,
+        ).order_by(
+            cls.depth,
+            cls.creation_datetime,
+        ).all()
+
+    @classmethod
+    def finish(cls, dbsession, job_id, worker_id, ids):
+        '''
+        Removes the urls `worker_id` leased and fetched, returning how
+        many were removed.
+        '''
+        result = dbsession.execute(cls.__table__.delete().where(
+            cls.job_id == job_id,
+        ).where(
+            cls.lease_worker_id == worker_id,
+        ).where(
+            cls.id.in_(ids),
+        ))
+        return result.rowcount
+
+    def to_dict(self):
+        resp = super(FrontierUrls, self).to_dict()
+        resp.update(
+            job_id=str(self.job_id),
+            url=self.url,
+            depth=self.depth,
+            lease_expiration_datetime=str(self.lease_expiration_datetime),
         )
         return resp
 
 
+Index(
+    'index_frontier_urls_job_id_depth_creation_datetime',
+    FrontierUrls.job_id,
+    FrontierUrls.depth,
+    FrontierUrls.creation_datetime,
+)
+
+
 class DocumentCategoryAssignments(Base, CreationMixin, TimeStampMixin):
     __tablename__ = 'document_category_assignments'
 
@@ -581,6 +1929,55 @@ class DocumentCategoryAssignments(Base, CreationMixin, TimeStampMixin):
         nullable=False,
     )
 
+    @classmethod
+    def assign(cls, dbsession, pairs, batch_size=500):
+        '''
+        Assigns categories given `(document_id, document_category_id)`
+        pairs, skipping those already assigned, with one executemany.
+        Returns the number assigned.
+        '''
+        pairs = list(set(pairs))
+        existing = set()
+        document_ids = list(set(document_id for document_id, _ in pairs))
+        months = {}
+        for i in range(0, len(document_ids), batch_size):
+            batch = document_ids[i:i+batch_size]
+            existing.update(dbsession.query(
+                cls.document_id,
+                cls.document_category_id,
+            ).filter(
+                cls.document_id.in_(batch),
+            ))
+            months.update(dbsession.query(
+                Documents.id,
+                Documents.creation_datetime,
+            ).filter(
+                Documents.id.in_(batch),
+            ))
+        now = datetime.datetime.now()
+        new = [
+            dict(
+                id=uuid4(),
+                document_id=document_id,
+                document_category_id=category_id,
+                creation_datetime=now,
+                modified_datetime=now,
+            )
+            for document_id, category_id in pairs
+            if (document_id, category_id) not in existing and
+            document_id in months
+        ]
+        if new:
+            dbsession.execute(cls.__table__.insert(), new)
+            DocumentFacetCounts.increment(dbsession, Counter(
+                DocumentFacetCounts.category_key(
+                    assignment['document_category_id'],
+                    months[assignment['document_id']],
+                )
+                for assignment in new
+            ))
+        return len(new)
+
 
 Index(
     'index_document_category_assignments_id',
@@ -612,14 +2009,349 @@ class Documents(Base, CreationMixin, TimeStampMixin):
         ForeignKey('document_types.id'),
         nullable=True,
     )
+    municipality_id = Column(
+        UUIDType(binary=False),
+        ForeignKey('municipalities.id'),
+        nullable=True,
+    )
+    entity_id = Column(
+        UUIDType(binary=False),
+        ForeignKey('entities.id'),
+        nullable=True,
+    )
+    # sha256 of the normalized url, see `civicdocs.urls`.
+    url_hash = Column(String(64), nullable=True)
+    # the fetched content, kept in the blob store under its sha256 (see
+    # `civicdocs.blobs`); documents with the same content share it.
+    content_sha256 = Column(String(64), nullable=True)
+    content_length = Column(BigInteger, nullable=True)
+    content_type = Column(Unicode(255), nullable=True)
+
+    __server_keys__ = (
+        'url_hash',
+        'content_sha256',
+        'content_length',
+        'content_type',
+    )
+
+    __url_keys__ = ('url',)
 
     categories = relationship(
         'DocumentCategories',
         secondary=DocumentCategoryAssignments.__table__,
         backref='document',
-        lazy='joined',
     )
 
+    __profiles__ = dict(
+        CreationMixin.__profiles__,
+        detail=(
+            selectinload('categories'),
+            raiseload('*'),
+        ),
+        # only the columns `to_dict` and paging use.
+        list=(
+            load_only(
+                'id',
+                'creation_datetime',
+                'name',
+                'description',
+                'source_url',
+                'source_url_title',
+                'link_text',
+                'content_sha256',
+                'content_length',
+            ),
+            selectinload('categories'),
+            raiseload('*'),
+        ),
+    )
+
+    @classmethod
+    def add(cls, dbsession, **kwargs):
+        '''
+        Adds a document, unless one with the same normalized url already
+        exists; then that document's `modified_datetime` is touched and it
+        is returned instead.
+        '''
+        if kwargs.get('url') is not None:
+            kwargs['url_hash'] = url_hash(kwargs['url'])
+        document = cls._get_by_url_hash(dbsession, kwargs.get('url_hash'))
+        if document is None:
+            try:
+                # a concurrent add of the same url only fails this
+                # savepoint; the document it added is returned instead.
+                with dbsession.begin_nested():
+                    document = cls(**kwargs)
+                    if document.id is None:
+                        document.id = uuid4()
+                    dbsession.add(document)
+            except IntegrityError:
+                document = cls._get_by_url_hash(dbsession, kwargs['url_hash'])
+                if document is None:
+                    raise
+                return document
+            SearchPostings.index_documents(dbsession, [(document.id, kwargs)])
+            DocumentFacetCounts.increment(dbsession, Counter(
+                DocumentFacetCounts.document_keys(dict(
+                    (column, getattr(document, column))
+                    for column in DocumentFacetCounts.KEY_COLUMNS
+                )),
+            ))
+        return document
+
+    @classmethod
+    def _get_by_url_hash(cls, dbsession, hash):
+        # the document is touched, as a repeated add.
+        document = dbsession.query(
+            cls,
+        ).filter(
+            cls.url_hash == hash,
+        ).first()
+        if document is not None:
+            document.modified_datetime = datetime.datetime.now()
+        return document
+
+    @classmethod
+    def add_many(cls, dbsession, documents, worker_id=None, batch_size=500):
+        '''
+        Upserts a batch of document mappings by normalized url.  New urls
+        are inserted with one executemany, indexed, and credited to
+        `worker_id`; urls that already exist (or repeat within the batch)
+        only have `modified_datetime` touched.  Returns
+        `(id, created)` pairs in the order of `documents`.
+        '''
+        now = datetime.datetime.now()
+        for document in documents:
+            document['url_hash'] = url_hash(document['url'])
+        hashes = list(set(document['url_hash'] for document in documents))
+        while True:
+            existing = cls._ids_by_url_hash(dbsession, hashes, batch_size)
+            try:
+                with dbsession.begin_nested():
+                    results, new = cls._insert_new(
+                        dbsession,
+                        documents,
+                        dict(existing),
+                        now,
+                    )
+                break
+            except IntegrityError:
+                # a url added by a concurrent batch only fails this
+                # savepoint; the batch is then looked up again, and
+                # finds it existing.
+                if len(cls._ids_by_url_hash(dbsession, hashes,
+                                            batch_size)) == len(existing):
+                    raise
+        ids = list(existing.values())
+        for i in range(0, len(ids), batch_size):
+            dbsession.execute(update(cls).values({
+                'modified_datetime': now,
+            }).where(
+                cls.id.in_(ids[i:i+batch_size]),
+            ))
+        if new:
+            SearchPostings.index_documents(
+                dbsession,
+                ((document['id'], document) for document in new),
+            )
+            DocumentFacetCounts.increment(dbsession, Counter(
+                key for document in new
+                for key in DocumentFacetCounts.document_keys(document)
+            ))
+            if worker_id is not None:
+                dbsession.execute(update(Workers).values({
+                    'document_count': Workers.document_count + len(new),
+                }).where(
+                    Workers.id == worker_id,
+                ))
+        return results
+
+    @classmethod
+    def _ids_by_url_hash(cls, dbsession, hashes, batch_size=500):
+        ids = {}
+        for i in range(0, len(hashes), batch_size):
+            ids.update(dbsession.query(
+                cls.url_hash,
+                cls.id,
+            ).filter(
+                cls.url_hash.in_(hashes[i:i+batch_size]),
+            ))
+        return ids
+
+    @classmethod
+    def _insert_new(cls, dbsession, documents, existing, now):
+        results = []
+        new = []
+        for document in documents:
+            id = existing.get(document['url_hash'])
+            created = id is None
+            if created:
+                id = uuid4()
+                existing[document['url_hash']] = id
+                document.update(
+                    id=id,
+                    creation_datetime=now,
+                    modified_datetime=now,
+                )
+                new.append(document)
+            results.append((id, created))
+        if new:
+            dbsession.execute(cls.__table__.insert(), new)
+        return results, new
+
+    @classmethod
+    def set_content(cls, dbsession, id, sha256, length, content_type):
+        '''
+        Points the document to its content in the blob store.
+        '''
+        dbsession.execute(update(cls).values({
+            'content_sha256': sha256,
+            'content_length': length,
+            'content_type': content_type,
+            'modified_datetime': datetime.datetime.now(),
+        }).where(
+            cls.id == id,
+        ))
+
+    @classmethod
+    def filters(cls, municipality_id=None, document_type_id=None,
+                since=None, until=None, entity_id=None):
+        criteria = []
+        if municipality_id is not None:
+            criteria.append(cls.municipality_id == municipality_id)
+        if entity_id is not None:
+            criteria.append(cls.entity_id == entity_id)
+        if document_type_id is not None:
+            criteria.append(cls.document_type_id == document_type_id)
+        if since is not None:
+            criteria.append(cls.creation_datetime >= since)
+        if until is not None:
+            criteria.append(cls.creation_datetime < until)
+        return criteria
+
+    @classmethod
+    def iter_rows(cls, engine, criteria=(), batch_size=1000):
+        '''
+        Yields every matching row as a column tuple, in keyset order,
+        reading from a server side cursor `batch_size` rows at a time so
+        the whole table is never held in memory.  This uses a connection
+        of its own, so it can outlive the request's transaction while the
+        response is streamed.
+        '''
+        q = select([
+            cls.id,
+            cls.creation_datetime,
+            cls.name,
+            cls.description,
+            cls.url,
+            cls.source_url,
+            cls.source_url_title,
+            cls.link_text,
+            cls.doc_type,
+            cls.document_type_id,
+            cls.municipality_id,
+            cls.entity_id,
+        ]).order_by(
+            cls.creation_datetime,
+            cls.id,
+        )
+        for criterion in criteria:
+            q = q.where(criterion)
+        connection = engine.connect()
+        try:
+            cursor = connection.execution_options(stream_results=True)
+            with cursor.begin():
+                result = cursor.execute(q)
+                while True:
+                    rows = result.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    for row in rows:
+                        yield row
+        finally:
+            connection.close()
+
+    @classmethod
+    def uncategorized(cls, dbsession, columns, after=None, count=1000,
+                      before=None):
+        '''
+        Returns the `id`, `creation_datetime` and `columns` of the next
+        `count` documents without a category, in `(creation_datetime,
+        id)` order after the pair `after` and created before `before`,
+        as rows.  Documents added later sort after the last one read, so
+        a cursor kept between runs picks them up.
+        '''
+        q = dbsession.query(
+            cls.id,
+            cls.creation_datetime,
+            *columns
+        ).filter(
+            ~dbsession.query(
+                DocumentCategoryAssignments.id,
+            ).filter(
+                DocumentCategoryAssignments.document_id == cls.id,
+            ).exists(),
+        )
+        if after is not None:
+            creation_datetime, id = after
+            q = q.filter(or_(
+                cls.creation_datetime > creation_datetime,
+                and_(
+                    cls.creation_datetime == creation_datetime,
+                    cls.id > id,
+                ),
+            ))
+        if before is not None:
+            q = q.filter(cls.creation_datetime < before)
+        return q.order_by(
+            cls.creation_datetime,
+            cls.id,
+        ).limit(count).all()
+
+    @classmethod
+    def for_municipalities(cls, dbsession, municipality_ids, count=10):
+        '''
+        Returns up to `count` documents of `municipality_ids`, newest
+        first for each municipality in turn, so the municipalities'
+        order (ex. nearest first) carries over.
+        '''
+        documents = []
+        for municipality_id in municipality_ids:
+            if len(documents) >= count:
+                break
+            documents.extend(dbsession.query(
+                cls,
+            ).options(
+                *cls.options('list')
+            ).filter(
+                cls.municipality_id == municipality_id,
+            ).order_by(
+                cls.creation_datetime.desc(),
+            ).limit(count - len(documents)))
+        return documents
+
+    @classmethod
+    def search(cls, dbsession, query, start=0, count=10):
+        '''
+        Returns the total number of matching documents, and a page of
+        `(document, score)` pairs ranked by BM25.
+        '''
+        total, ranked = SearchPostings.search(dbsession, query, start, count)
+        documents = {}
+        if ranked:
+            documents = dict((d.id, d) for d in dbsession.query(
+                Documents,
+            ).options(
+                *Documents.options('list')
+            ).filter(
+                Documents.id.in_([d for d, _ in ranked]),
+            ))
+        return total, [
+            (documents[document_id], score)
+            for document_id, score in ranked
+            if document_id in documents
+        ]
+
     def to_dict(self):
         resp = super(Documents, self).to_dict()
         resp.update(
@@ -628,6 +2360,8 @@ class Documents(Base, CreationMixin, TimeStampMixin):
             source_url=self.source_url,
             source_url_title=self.source_url_title,
             link_text=self.link_text,
+            content_sha256=self.content_sha256,
+            content_length=self.content_length,
             categories=[c.to_dict() for c in self.categories],
         )
         return resp
@@ -642,6 +2376,273 @@ Index(
     'index_documents_description',
     Documents.description,
 )
+Index(
+    'index_documents_url_hash',
+    Documents.url_hash,
+    unique=True,
+)
+Index(
+    'index_documents_content_sha256',
+    Documents.content_sha256,
+)
+Index(
+    'index_documents_creation_datetime_id',
+    Documents.creation_datetime,
+    Documents.id,
+)
+Index(
+    'index_documents_municipality_id_creation_datetime',
+    Documents.municipality_id,
+    Documents.creation_datetime,
+)
+
+
+class SearchTerms(Base):
+    '''
+    The dictionary of the search index; the number of documents each
+    term appears in.
+    '''
+    __tablename__ = 'search_terms'
+
+    term = Column(Unicode(MAX_TERM_LENGTH), primary_key=True)
+    document_count = Column(Integer, nullable=False)
+
+    @classmethod
+    def increment(cls, dbsession, document_counts, batch_size=500):
+        '''
+        Adds `document_counts` by term.  Terms are written in order, so
+        concurrent increments don't deadlock.
+        '''
+        terms = sorted(t for t, count in document_counts.items() if count)
+        for i in range(0, len(terms), batch_size):
+            batch = terms[i:i+batch_size]
+            existing = set(row.term for row in dbsession.query(
+                cls.term,
+            ).filter(
+                cls.term.in_(batch),
+            ))
+            if existing:
+                dbsession.execute(update(cls).where(
+                    cls.term == bindparam('_term'),
+                ).values({
+                    'document_count':
+                        cls.document_count + bindparam('_count'),
+                }), [
+                    {'_term': t, '_count': document_counts[t]}
+                    for t in sorted(existing)
+                ])
+            new = [
+                {'term': t, 'document_count': document_counts[t]}
+                for t in batch if t not in existing
+            ]
+            if not new:
+                continue
+            try:
+                # a concurrent first add of the same term only fails this
+                # savepoint; the terms are then counted again.
+                with dbsession.begin_nested():
+                    dbsession.execute(cls.__table__.insert(), new)
+            except IntegrityError:
+                cls.increment(dbsession, dict(
+                    (row['term'], row['document_count']) for row in new
+                ))
+
+
+class SearchCorpus(Base):
+    '''
+    Corpus wide statistics needed for BM25 ranking, split over `SHARDS`
+    rows that are summed when read.  Each increment goes to a random
+    shard, so concurrent ingests rarely wait on each other's row lock.
+    '''
+    __tablename__ = 'search_corpus'
+
+    SHARDS = 16
+
+    id = Column(Integer, primary_key=True)
+    document_count = Column(Integer, nullable=False)
+    total_length = Column(Integer, nullable=False)
+
+    @classmethod
+    def increment(cls, dbsession, document_count, total_length):
+        shard = random.randrange(cls.SHARDS)
+        values = {
+            'document_count': cls.document_count + document_count,
+            'total_length': cls.total_length + total_length,
+        }
+        result = dbsession.execute(update(cls).where(
+            cls.id == shard,
+        ).values(values))
+        if result.rowcount == 0:
+            try:
+                with dbsession.begin_nested():
+                    dbsession.execute(cls.__table__.insert().values(
+                        id=shard,
+                        document_count=document_count,
+                        total_length=total_length,
+                    ))
+            except IntegrityError:
+                # added by a concurrent transaction in the meantime.
+                dbsession.execute(update(cls).where(
+                    cls.id == shard,
+                ).values(values))
+
+    @classmethod
+    def totals(cls, dbsession):
+        '''
+        Returns the `(document_count, total_length)` of the corpus.
+        '''
+        document_count, total_length = dbsession.query(
+            func.sum(cls.document_count),
+            func.sum(cls.total_length),
+        ).one()
+        return int(document_count or 0), int(total_length or 0)
+
+
+class SearchPostings(Base):
+    '''
+    The inverted index; one row per (term, document) with the weighted
+    frequency of the term and the length of the document, so a query can
+    be ranked from the postings of its terms alone.
+    '''
+    __tablename__ = 'search_postings'
+
+    term = Column(Unicode(MAX_TERM_LENGTH), primary_key=True)
+    document_id = Column(
+        UUIDType(binary=False),
+        ForeignKey('documents.id'),
+        primary_key=True,
+    )
+    frequency = Column(Integer, nullable=False)
+    document_length = Column(Integer, nullable=False)
+
+    MAX_PREFIX_EXPANSIONS = 50
+
+    @classmethod
+    def index_documents(cls, dbsession, documents):
+        '''
+        Adds `(document_id, fields)` pairs to the index.  This must be
+        called inside of the transaction that adds the documents.
+        '''
+        postings = []
+        document_counts = Counter()
+        indexed = 0
+        total_length = 0
+        for document_id, fields in documents:
+            frequencies, length = term_frequencies(fields)
+            if not frequencies:
+                continue
+            indexed += 1
+            total_length += length
+            for term, frequency in frequencies.items():
+                postings.append(dict(
+                    term=term,
+                    document_id=document_id,
+                    frequency=frequency,
+                    document_length=length,
+                ))
+                document_counts[term] += 1
+        if postings:
+            dbsession.execute(cls.__table__.insert(), postings)
+            SearchTerms.increment(dbsession, document_counts)
+            SearchCorpus.increment(dbsession, indexed, total_length)
+
+    @classmethod
+    def search(cls, dbsession, query, start=0, count=10):
+        '''
+        Returns the total number of matching documents and a page of
+        `(document_id, score)` pairs.  Only the postings of the query
+        terms are read, so this does not depend on the size of the
+        corpus.
+        '''
+        terms, prefixes = parse_query(query)
+        scores = defaultdict(float)
+        for prefix in prefixes:
+            terms.update(row.term for row in dbsession.query(
+                SearchTerms.term,
+            ).filter(
+                SearchTerms.term >= prefix,
+                SearchTerms.term < prefix + u'\uffff',
+            ).order_by(
+                SearchTerms.term,
+            ).limit(cls.MAX_PREFIX_EXPANSIONS))
+        document_count, total_length = SearchCorpus.totals(dbsession)
+        if not terms or not document_count:
+            return 0, []
+        document_frequencies = dict(dbsession.query(
+            SearchTerms.term,
+            SearchTerms.document_count,
+        ).filter(
+            SearchTerms.term.in_(terms),
+        ))
+        if not document_frequencies:
+            return 0, []
+        average_length = total_length / float(document_count)
+        idfs = dict(
+            (term, idf(document_count, document_frequency))
+            for term, document_frequency in document_frequencies.items()
+        )
+        postings = dbsession.query(
+            cls.term,
+            cls.document_id,
+            cls.frequency,
+            cls.document_length,
+        ).filter(
+            cls.term.in_(list(idfs)),
+        )
+        for term, document_id, frequency, document_length in postings:
+            scores[document_id] += bm25(
+                frequency,
+                document_length,
+                average_length,
+                idfs[term],
+            )
+        ranked = heapq.nlargest(
+            start + count,
+            scores.items(),
+            key=lambda item: item[1],
+        )
+        return len(scores), ranked[start:]
+
+    @classmethod
+    def unindex_documents(cls, dbsession, document_ids):
+        '''
+        Removes documents from the index, keeping the term and corpus
+        statistics in step.  This must be called inside of the
+        transaction that deletes the documents.
+        '''
+        document_counts = Counter()
+        lengths = {}
+        postings = dbsession.query(
+            cls.term,
+            cls.document_id,
+            cls.document_length,
+        ).filter(
+            cls.document_id.in_(document_ids),
+        )
+        for term, document_id, document_length in postings:
+            document_counts[term] -= 1
+            lengths[document_id] = document_length
+        if lengths:
+            dbsession.query(
+                cls,
+            ).filter(
+                cls.document_id.in_(document_ids),
+            ).delete(synchronize_session=False)
+            SearchTerms.increment(dbsession, document_counts)
+            SearchCorpus.increment(
+                dbsession,
+                -len(lengths),
+                -sum(lengths.values()),
+            )
+
+    @classmethod
+    def clear(cls, dbsession):
+        dbsession.query(cls).delete()
+        dbsession.query(SearchTerms).delete()
+        dbsession.query(SearchCorpus).delete()
+
+
+Index('index_search_postings_document_id', SearchPostings.document_id)
 
 
 class DocumentCategories(Base, CreationMixin, TimeStampMixin):
@@ -651,7 +2652,7 @@ class DocumentCategories(Base, CreationMixin, TimeStampMixin):
     description = Column(UnicodeText, nullable=False)
 
     def to_dict(self):
-        resp = super(Jobs, self).to_dict()
+        resp = super(DocumentCategories, self).to_dict()
         resp.update(
             name=self.name,
             description=self.description,
@@ -666,9 +2667,537 @@ Index(
 )
 
 
+class DocumentFacetCounts(Base):
+    '''
+    Rollup of the number of documents by municipality, entity, document
+    type and category, per month of `creation_datetime`, kept current as
+    documents and category assignments are added (and removed, see
+    `remove_documents`).  The `all` facet counts every document, so a
+    facet query reads one row per bucket and month whatever the size of
+    the corpus.  `rebuild` recounts them from the documents.
+    '''
+    __tablename__ = 'document_facet_counts'
+
+    FACETS = ('municipality', 'entity', 'document_type', 'category')
+    # the facets read off the documents table.
+    COLUMN_FACETS = (
+        ('municipality', 'municipality_id'),
+        ('entity', 'entity_id'),
+        ('document_type', 'document_type_id'),
+    )
+    KEY_COLUMNS = ('creation_datetime',) + tuple(
+        column for _, column in COLUMN_FACETS)
+
+    facet = Column(String(16), primary_key=True)
+    # the id of the bucket, '' for the `all` facet.
+    value = Column(String(36), primary_key=True)
+    # 'YYYY-MM'
+    month = Column(String(7), primary_key=True)
+    document_count = Column(Integer, nullable=False)
+
+    @classmethod
+    def document_keys(cls, document):
+        '''
+        The `(facet, value, month)` keys counting a document, given a
+        mapping of its `KEY_COLUMNS`.
+        '''
+        month = document['creation_datetime'].strftime('%Y-%m')
+        keys = [('all', '', month)]
+        for facet, column in cls.COLUMN_FACETS:
+            if document.get(column) is not None:
+                keys.append((facet, str(document[column]), month))
+        return keys
+
+    @classmethod
+    def category_key(cls, document_category_id, creation_datetime):
+        return (
+            'category',
+            str(document_category_id),
+            creation_datetime.strftime('%Y-%m'),
+        )
+
+    @classmethod
+    def increment(cls, dbsession, counts, batch_size=500):
+        '''
+        Adds the `counts` of `(facet, value, month)` keys.  Keys are
+        written in order, so concurrent increments don't deadlock.
+        '''
+        keys = sorted(key for key, count in counts.items() if count)
+        for i in range(0, len(keys), batch_size):
+            batch = keys[i:i+batch_size]
+            updated = cls._update(dbsession, counts, batch)
+            new = [
+                {
+                    'facet': facet,
+                    'value': value,
+                    'month': month,
+                    'document_count': counts[(facet, value, month)],
+                }
+                for facet, value, month in batch
+                if (facet, value, month) not in updated
+            ]
+            if not new:
+                continue
+            try:
+                # a concurrent first count of the same key only fails this
+                # savepoint; the batch is then counted again.
+                with dbsession.begin_nested():
+                    dbsession.execute(cls.__table__.insert(), new)
+            except IntegrityError:
+                cls.increment(dbsession, Counter(dict(
+                    (key, counts[key]) for key in (
+                        (row['facet'], row['value'], row['month'])
+                        for row in new
+                    )
+                )))
+
+    @classmethod
+    def _update(cls, dbsession, counts, keys):
+        existing = set(tuple(row) for row in dbsession.query(
+            cls.facet,
+            cls.value,
+            cls.month,
+        ).filter(
+            or_(*[
+                and_(cls.facet == f, cls.value == v, cls.month == m)
+                for f, v, m in keys
+            ]),
+        ))
+        if existing:
+            dbsession.execute(update(cls).where(and_(
+                cls.facet == bindparam('_facet'),
+                cls.value == bindparam('_value'),
+                cls.month == bindparam('_month'),
+            )).values({
+                'document_count': cls.document_count + bindparam('_count'),
+            }), [
+                {'_facet': f, '_value': v, '_month': m, '_count': counts[
+                    (f, v, m)]}
+                for f, v, m in sorted(existing)
+            ])
+        return existing
+
+    @classmethod
+    def remove_documents(cls, dbsession, document_ids):
+        '''
+        Uncounts documents (and their categories).  This must be called
+        inside of the transaction that deletes them, before it does.
+        '''
+        counts = Counter()
+        for row in dbsession.query(
+            *[getattr(Documents, column) for column in cls.KEY_COLUMNS]
+        ).filter(
+            Documents.id.in_(document_ids),
+        ):
+            for key in cls.document_keys(row._asdict()):
+                counts[key] -= 1
+        for category_id, creation_datetime in dbsession.query(
+            DocumentCategoryAssignments.document_category_id,
+            Documents.creation_datetime,
+        ).join(
+            Documents,
+            Documents.id == DocumentCategoryAssignments.document_id,
+        ).filter(
+            DocumentCategoryAssignments.document_id.in_(document_ids),
+        ):
+            counts[cls.category_key(category_id, creation_datetime)] -= 1
+        cls.increment(dbsession, counts)
+
+    @classmethod
+    def month_of(cls, dbsession, column):
+        if dbsession.bind.dialect.name == 'postgresql':
+            return func.to_char(column, 'YYYY-MM')
+        return func.strftime('%Y-%m', column)
+
+    @classmethod
+    def recount(cls, dbsession):
+        '''
+        Returns the counts of every key, grouped from the documents.
+        '''
+        counts = Counter()
+        month = cls.month_of(dbsession, Documents.creation_datetime)
+        for month_, count in dbsession.query(
+            month,
+            func.count(),
+        ).group_by(month):
+            counts[('all', '', month_)] = count
+        for facet, column in cls.COLUMN_FACETS:
+            column = getattr(Documents, column)
+            for value, month_, count in dbsession.query(
+                column,
+                month,
+                func.count(),
+            ).filter(
+                column != None,
+            ).group_by(column, month):
+                counts[(facet, str(value), month_)] = count
+        for value, month_, count in dbsession.query(
+            DocumentCategoryAssignments.document_category_id,
+            month,
+            func.count(),
+        ).join(
+            Documents,
+            Documents.id == DocumentCategoryAssignments.document_id,
+        ).group_by(
+            DocumentCategoryAssignments.document_category_id,
+            month,
+        ):
+            counts[('category', str(value), month_)] = count
+        return counts
+
+    @classmethod
+    def rebuild(cls, dbsession):
+        '''
+        Recounts every key and corrects the rows that drifted, returning
+        the `(key, stored, counted)` of those.
+        '''
+        if dbsession.bind.dialect.name == 'postgresql':
+            # waits for the transactions counting documents, and holds
+            # off new ones until the recount commits.
+            dbsession.execute(
+                'LOCK TABLE document_facet_counts IN EXCLUSIVE MODE')
+        counted = cls.recount(dbsession)
+        stored = dict(
+            ((row.facet, row.value, row.month), row.document_count)
+            for row in dbsession.query(cls)
+        )
+        drift = [
+            (key, stored.get(key, 0), counted.get(key, 0))
+            for key in sorted(set(counted) | set(stored))
+            if stored.get(key, 0) != counted.get(key, 0)
+        ]
+        cls.increment(dbsession, Counter(dict(
+            (key, count - before) for key, before, count in drift
+        )))
+        dbsession.query(cls).filter(cls.document_count == 0).delete()
+        return drift
+
+    @classmethod
+    def counts(cls, dbsession, facets, since=None, until=None):
+        '''
+        Returns the document counts of each of `facets` by value, and
+        `month` by month, over the months from `since` up to but not
+        including `until` ('YYYY-MM').
+        '''
+        criteria = []
+        if since is not None:
+            criteria.append(cls.month >= since)
+        if until is not None:
+            criteria.append(cls.month < until)
+        resp = {}
+        for facet in facets:
+            if facet == 'month':
+                rows = dbsession.query(
+                    cls.month,
+                    cls.document_count,
+                ).filter(
+                    cls.facet == 'all',
+                    *criteria
+                ).order_by(cls.month)
+            else:
+                rows = dbsession.query(
+                    cls.value,
+                    func.sum(cls.document_count),
+                ).filter(
+                    cls.facet == facet,
+                    *criteria
+                ).group_by(cls.value)
+            resp[facet] = [
+                dict(value=value, count=int(count))
+                for value, count in rows if count
+            ]
+            if facet != 'month':
+                resp[facet].sort(key=lambda bucket: -bucket['count'])
+        return resp
+
+
+class ClassifierCheckpoints(Base):
+    '''
+    How far classification (see `civicdocs.classify`) got through the
+    documents in `(creation_datetime, id)` order, advanced in the
+    transaction that assigns each batch's categories.  An interrupted run
+    resumes where it was stopped, and the next run goes on with the
+    documents added since.
+    '''
+    __tablename__ = 'classifier_checkpoints'
+
+    name = Column(Unicode(64), primary_key=True)
+    last_creation_datetime = Column(DateTime, nullable=True)
+    last_document_id = Column(UUIDType(binary=False), nullable=True)
+    document_count = Column(BigInteger, nullable=False)
+    assignment_count = Column(BigInteger, nullable=False)
+    modified_datetime = Column(
+        DateTime,
+        default=datetime.datetime.now,
+        server_default=func.now(),
+    )
+
+    @classmethod
+    def get(cls, dbsession, name):
+        return dbsession.query(cls).filter(cls.name == name).first()
+
+    @classmethod
+    def advance(cls, dbsession, name, last, documents, assignments):
+        '''
+        Moves the checkpoint to the `(creation_datetime, id)` pair `last`.
+        '''
+        last_creation_datetime, last_document_id = last
+        result = dbsession.execute(update(cls).where(
+            cls.name == name,
+        ).values({
+            'last_creation_datetime': last_creation_datetime,
+            'last_document_id': last_document_id,
+            'document_count': cls.document_count + documents,
+            'assignment_count': cls.assignment_count + assignments,
+            'modified_datetime': datetime.datetime.now(),
+        }))
+        if result.rowcount == 0:
+            dbsession.execute(cls.__table__.insert().values(
+                name=name,
+                last_creation_datetime=last_creation_datetime,
+                last_document_id=last_document_id,
+                document_count=documents,
+                assignment_count=assignments,
+                modified_datetime=datetime.datetime.now(),
+            ))
+
+    @classmethod
+    def reset(cls, dbsession, name):
+        dbsession.query(cls).filter(cls.name == name).delete()
+
+    @property
+    def last(self):
+        # checkpoints kept by id alone (before creation_datetime was)
+        # start over.
+        if self.last_creation_datetime is None or \
+                self.last_document_id is None:
+            return None
+        return self.last_creation_datetime, self.last_document_id
+
+
 class DocumentAudits(Base, CreationMixin, TimeStampMixin):
     __tablename__ = 'document_audits'
 
 
 class DocumentChangeAudits(Base, CreationMixin, TimeStampMixin):
+    '''
+    A change in the content fetched from a url, as reported through
+    `FetchStates.record`.
+    '''
     __tablename__ = 'document_change_audits'
+
+    url_hash = Column(String(64), nullable=False)
+    # the document of the url, if there is one yet.
+    document_id = Column(
+        UUIDType(binary=False),
+        ForeignKey('documents.id'),
+        nullable=True,
+    )
+    previous_content_sha256 = Column(String(64), nullable=True)
+    content_sha256 = Column(String(64), nullable=True)
+    previous_content_length = Column(BigInteger, nullable=True)
+    content_length = Column(BigInteger, nullable=True)
+
+    @classmethod
+    def for_document(cls, dbsession, document_id, start=0, count=10):
+        '''
+        The changes of a document, latest first.
+        '''
+        return dbsession.query(
+            cls,
+        ).filter(
+            cls.document_id == document_id,
+        ).order_by(
+            cls.creation_datetime.desc(),
+        ).slice(
+            start,
+            start+count
+        ).all()
+
+    def to_dict(self):
+        resp = super(DocumentChangeAudits, self).to_dict()
+        resp.update(
+            document_id=str(self.document_id),
+            previous_content_sha256=self.previous_content_sha256,
+            content_sha256=self.content_sha256,
+            previous_content_length=self.previous_content_length,
+            content_length=self.content_length,
+        )
+        return resp
+
+
+Index(
+    'index_document_change_audits_document_id_creation_datetime',
+    DocumentChangeAudits.document_id,
+    DocumentChangeAudits.creation_datetime,
+)
+
+
+class FetchStates(Base):
+    '''
+    What was last fetched from a url, keyed by its `url_hash`: the
+    validators to send a conditional request with (`If-None-Match` and
+    `If-Modified-Since`), and the sha256 of the content to tell a real
+    change from a refetch of the same bytes.
+    '''
+    __tablename__ = 'fetch_states'
+
+    url_hash = Column(String(64), primary_key=True)
+    url = Column(UnicodeText, nullable=False)
+    etag = Column(Unicode(255), nullable=True)
+    # the header as the server sent it, to be sent back as is.
+    last_modified = Column(Unicode(64), nullable=True)
+    content_sha256 = Column(String(64), nullable=True)
+    content_length = Column(BigInteger, nullable=True)
+    fetch_count = Column(Integer, nullable=False)
+    change_count = Column(Integer, nullable=False)
+    last_fetched_datetime = Column(DateTime, nullable=False)
+    last_changed_datetime = Column(DateTime, nullable=True)
+
+    @classmethod
+    def lookup(cls, dbsession, hashes, batch_size=500):
+        '''
+        Returns the states of the `hashes` that have one, by hash.
+        '''
+        hashes = list(set(hashes))
+        states = {}
+        for i in range(0, len(hashes), batch_size):
+            states.update((state.url_hash, state) for state in dbsession.query(
+                cls,
+            ).filter(
+                cls.url_hash.in_(hashes[i:i+batch_size]),
+            ))
+        return states
+
+    @classmethod
+    def record(cls, dbsession, fetches):
+        '''
+        Records a batch of fetches, dicts of `url`, `not_modified` (the
+        server answered 304) and the `etag`, `last_modified`,
+        `content_sha256` and `content_length` fetched.  A fetch whose
+        content hash differs from the last one is a change, and adds a
+        `DocumentChangeAudits` row.  Returns the number of new, unchanged
+        and changed urls.
+        '''
+        now = datetime.datetime.now()
+        by_hash = OrderedDict()
+        for fetch in fetches:
+            # the last report of a url wins.
+            by_hash[url_hash(fetch['url'])] = fetch
+        while True:
+            states = cls.lookup(dbsession, by_hash)
+            new, unchanged, changed, audits = cls._sort_fetches(
+                by_hash,
+                states,
+                now,
+            )
+            if not new:
+                break
+            try:
+                with dbsession.begin_nested():
+                    dbsession.execute(cls.__table__.insert(), new)
+                break
+            except IntegrityError:
+                # a url first reported by a concurrent batch only fails
+                # this savepoint; looked up again, its fetch is then
+                # unchanged or changed.
+                if len(cls.lookup(dbsession, by_hash)) == len(states):
+                    raise
+        if unchanged:
+            # validators may change while the content doesn't, and a 304
+            # need not repeat them.
+            dbsession.execute(update(cls).where(
+                cls.url_hash == bindparam('_url_hash'),
+            ).values({
+                'etag': func.coalesce(bindparam('etag'), cls.etag),
+                'last_modified': func.coalesce(
+                    bindparam('last_modified'), cls.last_modified),
+                'content_sha256': func.coalesce(
+                    bindparam('content_sha256'), cls.content_sha256),
+                'content_length': func.coalesce(
+                    bindparam('content_length'), cls.content_length),
+                'fetch_count': cls.fetch_count + 1,
+                'last_fetched_datetime': now,
+            }), unchanged)
+        if changed:
+            dbsession.execute(update(cls).where(
+                cls.url_hash == bindparam('_url_hash'),
+            ).values({
+                'etag': bindparam('etag'),
+                'last_modified': bindparam('last_modified'),
+                'content_sha256': bindparam('content_sha256'),
+                'content_length': bindparam('content_length'),
+                'fetch_count': cls.fetch_count + 1,
+                'change_count': cls.change_count + 1,
+                'last_fetched_datetime': now,
+                'last_changed_datetime': now,
+            }), changed)
+            documents = dict(dbsession.query(
+                Documents.url_hash,
+                Documents.id,
+            ).filter(
+                Documents.url_hash.in_([a['url_hash'] for a in audits]),
+            ))
+            for audit in audits:
+                audit['document_id'] = documents.get(audit['url_hash'])
+            dbsession.execute(DocumentChangeAudits.__table__.insert(), audits)
+        return dict(
+            new=len(new),
+            unchanged=len(unchanged),
+            changed=len(changed),
+        )
+
+    @classmethod
+    def _sort_fetches(cls, by_hash, states, now):
+        new = []
+        unchanged = []
+        changed = []
+        audits = []
+        for hash_, fetch in by_hash.items():
+            values = dict(
+                _url_hash=hash_,
+                etag=fetch.get('etag'),
+                last_modified=fetch.get('last_modified'),
+                content_sha256=fetch.get('content_sha256'),
+                content_length=fetch.get('content_length'),
+            )
+            state = states.get(hash_)
+            if state is None:
+                values.update(
+                    url=fetch['url'],
+                    url_hash=values.pop('_url_hash'),
+                    fetch_count=1,
+                    change_count=0,
+                    last_fetched_datetime=now,
+                    last_changed_datetime=None,
+                )
+                new.append(values)
+            elif fetch.get('not_modified') or \
+                    values['content_sha256'] is None or \
+                    state.content_sha256 is None or \
+                    values['content_sha256'] == state.content_sha256:
+                unchanged.append(values)
+            else:
+                changed.append(values)
+                audits.append(dict(
+                    id=uuid4(),
+                    url_hash=hash_,
+                    previous_content_sha256=state.content_sha256,
+                    content_sha256=values['content_sha256'],
+                    previous_content_length=state.content_length,
+                    content_length=values['content_length'],
+                    creation_datetime=now,
+                    modified_datetime=now,
+                ))
+        return new, unchanged, changed, audits
+
+    def to_dict(self):
+        return dict(
+            url=self.url,
+            etag=self.etag,
+            last_modified=self.last_modified,
+            content_sha256=self.content_sha256,
+            content_length=self.content_length,
+            last_fetched_datetime=str(self.last_fetched_datetime),
+            last_changed_datetime=str(self.last_changed_datetime),
+        )
@@ -0,0 +1,160 @@
+import time
+import select
+import logging
+import datetime
+import threading
+
+from sqlalchemy import text
+
+from .models import (
+    on_commit,
+    Jobs,
+    )
+
+
+log = logging.getLogger(__name__)
+
+
+class JobNotifier(object):
+    '''
+    Wakes the requests waiting for a job to become claimable (see the
+    `?wait=` of `GET /dispatchers/{id}/jobs`).  Each notification bumps
+    `generation`; a waiter reads it before it looks for jobs, so a
+    notification that comes in between is not lost.
+
+    Notifications only reach waiters in this process.  Other kinds of
+    waiters (ex. the event loop of `civicdocs.asgi`) can register a
+    listener, called with the new generation from the notifying thread.
+    '''
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self.generation = 0
+        self.listeners = []
+
+    def notify(self):
+        with self._condition:
+            self.generation += 1
+            generation = self.generation
+            self._condition.notify_all()
+        for listener in self.listeners:
+            listener(generation)
+
+    def wait(self, generation, timeout):
+        '''
+        Waits up to `timeout` seconds for a notification after
+        `generation`, returning whether one came.
+        '''
+        deadline = time.time() + timeout
+        with self._condition:
+            while self.generation == generation:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def publish(self, dbsession):
+        '''
+        Notifies waiters once the transaction of `dbsession` commits,
+        when the jobs it released can be seen by their claims.
+        '''
+        on_commit(dbsession, self.notify)
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+class PostgresJobNotifier(JobNotifier):
+    '''
+    Shares notifications between processes and hosts with PostgreSQL's
+    LISTEN/NOTIFY.  Publishing sends a NOTIFY within the transaction,
+    which PostgreSQL only delivers once it commits; a listener thread
+    relays what comes in on `CHANNEL` (including this process' own) to
+    the local waiters.  The listener holds a connection of its own, out
+    of the pool, and reconnects after `reconnect_seconds` if it is lost.
+    '''
+
+    CHANNEL = 'civicdocs_jobs'
+
+    def __init__(self, engine, reconnect_seconds=5):
+        super(PostgresJobNotifier, self).__init__()
+        self.engine = engine
+        self.reconnect_seconds = reconnect_seconds
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def publish(self, dbsession):
+        dbsession.execute(text('NOTIFY {0}'.format(self.CHANNEL)))
+
+    def start(self):
+        self._thread = threading.Thread(
+            name='job-notify-listener',
+            target=self._run,
+        )
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self._listen()
+            except Exception:
+                log.exception('Listening on %s failed', self.CHANNEL)
+            self._stopped.wait(self.reconnect_seconds)
+
+    def _listen(self):
+        connection = self.engine.raw_connection()
+        connection.detach()
+        dbapi_connection = connection.connection
+        try:
+            dbapi_connection.autocommit = True
+            cursor = dbapi_connection.cursor()
+            cursor.execute('LISTEN {0}'.format(self.CHANNEL))
+            # jobs may have been released while not listening.
+            self.notify()
+            while not self._stopped.is_set():
+                readable, _, _ = select.select([dbapi_connection], [], [],
+                                               self.reconnect_seconds)
+                if not readable:
+                    continue
+                dbapi_connection.poll()
+                if dbapi_connection.notifies:
+                    del dbapi_connection.notifies[:]
+                    self.notify()
+        finally:
+            connection.close()
+
+
+def wait_timeout(dbsession, remaining, recheck_seconds):
+    '''
+    Returns how long a dispatcher that found nothing to claim should
+    wait for a notification: up to `remaining` seconds, but looking
+    again at least every `recheck_seconds` and when the next job comes
+    due, as time passing releases no notification.
+    '''
+    timeout = min(remaining, recheck_seconds)
+    next_due = Jobs.next_due(dbsession)
+    if next_due is not None:
+        due = (next_due - datetime.datetime.now()).total_seconds()
+        if due > 0:
+            timeout = min(timeout, due)
+    return timeout
+
+
+def notifier_from_settings(settings, engine):
+    backend = settings.get('civicdocs.job_notify', 'local')
+    if backend == 'local':
+        return JobNotifier()
+    if backend == 'postgresql':
+        if engine.dialect.name != 'postgresql':
+            raise ValueError('civicdocs.job_notify = postgresql needs a '
+                             'PostgreSQL database')
+        return PostgresJobNotifier(engine)
+    raise ValueError('unsupported civicdocs.job_notify: {0}'.format(backend))
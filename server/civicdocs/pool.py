@@ -0,0 +1,164 @@
+import os
+import time
+import threading
+
+from sqlalchemy import (
+    event,
+    exc,
+)
+from sqlalchemy.pool import QueuePool
+
+
+class PoolStats(object):
+    '''
+    Counters for the connection pool of an engine, for this process.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.invalidations = 0
+        self.fork_resets = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.max_checked_out = 0
+        self.max_overflow_used = 0
+        self.closed = 0
+        self.lifetime_seconds = 0.0
+        self.max_lifetime_seconds = 0.0
+        self._checked_out = 0
+
+    def increment(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def checked_out(self, pool):
+        with self._lock:
+            self.checkouts += 1
+            self._checked_out += 1
+            self.max_checked_out = max(self.max_checked_out,
+                                       self._checked_out)
+            if isinstance(pool, QueuePool):
+                self.max_overflow_used = max(self.max_overflow_used,
+                                             pool.overflow())
+
+    def checked_in(self):
+        with self._lock:
+            self.checkins += 1
+            self._checked_out = max(self._checked_out - 1, 0)
+
+    def waited(self, seconds):
+        with self._lock:
+            self.waits += 1
+            self.wait_seconds += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+
+    def closed_connection(self, lifetime):
+        with self._lock:
+            self.closed += 1
+            self.lifetime_seconds += lifetime
+            self.max_lifetime_seconds = max(self.max_lifetime_seconds,
+                                            lifetime)
+
+    def to_dict(self, pool):
+        with self._lock:
+            resp = dict(
+                pid=os.getpid(),
+                pool=type(pool).__name__,
+                connects=self.connects,
+                checkouts=self.checkouts,
+                checkins=self.checkins,
+                checked_out=self._checked_out,
+                max_checked_out=self.max_checked_out,
+                invalidations=self.invalidations,
+                fork_resets=self.fork_resets,
+                waits=self.waits,
+                wait_seconds=self.wait_seconds,
+                average_wait_seconds=(
+                    self.wait_seconds / self.waits if self.waits else 0.0),
+                max_wait_seconds=self.max_wait_seconds,
+                closed=self.closed,
+                average_lifetime_seconds=(
+                    self.lifetime_seconds / self.closed
+                    if self.closed else 0.0),
+                max_lifetime_seconds=self.max_lifetime_seconds,
+            )
+        if isinstance(pool, QueuePool):
+            resp.update(
+                size=pool.size(),
+                checked_in=pool.checkedin(),
+                overflow=pool.overflow(),
+                max_overflow=pool._max_overflow,
+                max_overflow_used=self.max_overflow_used,
+                timeout=pool.timeout(),
+            )
+        return resp
+
+
+class InstrumentedQueuePool(QueuePool):
+    '''
+    A `QueuePool` that times how long checkouts wait for a connection,
+    which includes opening overflow connections.
+    '''
+
+    stats = None
+
+    def _do_get(self):
+        start = time.time()
+        try:
+            return super(InstrumentedQueuePool, self)._do_get()
+        finally:
+            if self.stats is not None:
+                self.stats.waited(time.time() - start)
+
+    def recreate(self):
+        pool = super(InstrumentedQueuePool, self).recreate()
+        pool.stats = self.stats
+        return pool
+
+
+def instrument(engine):
+    '''
+    Collects `PoolStats` for the pool of `engine`, and makes sure a
+    connection opened before a fork is never used by the child process
+    (ex. after a multi-process server forks its workers).  Returns the
+    stats, which are also kept as `engine.pool.stats`.
+    '''
+    stats = PoolStats()
+    engine.pool.stats = stats
+
+    @event.listens_for(engine, 'connect')
+    def connect(dbapi_connection, connection_record):
+        connection_record.info['pid'] = os.getpid()
+        stats.increment('connects')
+
+    @event.listens_for(engine, 'checkout')
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        pid = os.getpid()
+        if connection_record.info.get('pid', pid) != pid:
+            # the parent process owns this connection; leave it alone and
+            # have the pool open a new one.
+            connection_record.connection = connection_proxy.connection = None
+            stats.increment('fork_resets')
+            raise exc.DisconnectionError(
+                'connection record belongs to pid {0}, '
+                'attempting to check out in pid {1}'.format(
+                    connection_record.info['pid'], pid))
+        stats.checked_out(engine.pool)
+
+    @event.listens_for(engine, 'checkin')
+    def checkin(dbapi_connection, connection_record):
+        stats.checked_in()
+
+    @event.listens_for(engine, 'invalidate')
+    def invalidate(dbapi_connection, connection_record, exception):
+        stats.increment('invalidations')
+
+    @event.listens_for(engine, 'close')
+    def close(dbapi_connection, connection_record):
+        stats.closed_connection(time.time() - connection_record.starttime)
+
+    return stats
@@ -0,0 +1,194 @@
+import uuid
+import datetime
+
+from sqlalchemy import (
+    Boolean,
+    DateTime,
+    Float,
+    Integer,
+    String,
+)
+from sqlalchemy_utils import UUIDType
+
+from .urls import normalize_url
+
+
+# Columns that are never taken from a payload.
+SERVER_KEYS = frozenset([
+    'id',
+    'creation_datetime',
+    'modified_datetime',
+    'last_callin_datetime',
+    'status',
+])
+
+DATETIME_FORMATS = (
+    '%Y-%m-%dT%H:%M:%S.%f',
+    '%Y-%m-%dT%H:%M:%S',
+    '%Y-%m-%d %H:%M:%S.%f',
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%d',
+)
+
+
+def parse_datetime(value):
+    for fmt in DATETIME_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, fmt)
+        except (TypeError, ValueError):
+            pass
+    raise ValueError('invalid datetime: {0}'.format(value))
+
+
+def coerce_uuid(value):
+    if isinstance(value, uuid.UUID):
+        return value
+    if not isinstance(value, str):
+        raise ValueError('expected a uuid')
+    try:
+        return uuid.UUID(value)
+    except ValueError:
+        raise ValueError('expected a uuid')
+
+
+def coerce_datetime(value):
+    if isinstance(value, datetime.datetime):
+        return value
+    return parse_datetime(value)
+
+
+def coerce_float(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError('expected a number')
+    return float(value)
+
+
+def coerce_integer(value):
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError('expected an integer')
+    return value
+
+
+def coerce_boolean(value):
+    if not isinstance(value, bool):
+        raise ValueError('expected true or false')
+    return value
+
+
+def coerce_string(value):
+    if not isinstance(value, str):
+        raise ValueError('expected a string')
+    return value
+
+
+def coerce_url(value):
+    value = coerce_string(value)
+    normalize_url(value)
+    return value
+
+
+# Checked in order, so subclasses come before their bases.
+COERCERS = (
+    (UUIDType, coerce_uuid),
+    (DateTime, coerce_datetime),
+    (Float, coerce_float),
+    (Boolean, coerce_boolean),
+    (Integer, coerce_integer),
+    (String, coerce_string),
+)
+
+
+def coercer(column):
+    for type_, coerce in COERCERS:
+        if isinstance(column.type, type_):
+            return coerce
+    return lambda value: value
+
+
+class ValidationError(ValueError):
+    '''
+    Raised with a mapping of field names to what is wrong with them.
+    '''
+
+    def __init__(self, errors):
+        super(ValidationError, self).__init__(', '.join(
+            '{0}: {1}'.format(key, errors[key]) for key in sorted(errors)
+        ))
+        self.errors = errors
+
+
+class Schema(object):
+    '''
+    Validates payloads for a model, from what its columns declare: the
+    non nullable columns are required, the others optional, and values
+    are coerced to the column type.  Unknown keys are ignored.
+    '''
+
+    def __init__(self, cls):
+        self.name = cls.__tablename__
+        self.fields = {}
+        self.required = set()
+        self.optional = set()
+        server_keys = SERVER_KEYS.union(getattr(cls, '__server_keys__', ()))
+        url_keys = getattr(cls, '__url_keys__', ())
+        for column in cls.__table__.columns:
+            if column.name in server_keys:
+                continue
+            if column.name in url_keys:
+                self.fields[column.name] = coerce_url
+            else:
+                self.fields[column.name] = coercer(column)
+            if column.nullable:
+                self.optional.add(column.name)
+            else:
+                self.required.add(column.name)
+
+    def validate(self, payload, update=False):
+        '''
+        Returns the coerced values of `payload`, or raises
+        `ValidationError`.  An update replaces the whole row, so it needs
+        the optional fields too (they may be null).
+        '''
+        if not isinstance(payload, dict):
+            raise ValidationError({self.name: 'expected an object'})
+        values = {}
+        errors = {}
+        for key, coerce in self.fields.items():
+            if key not in payload:
+                if key in self.required or update:
+                    errors[key] = 'required'
+                continue
+            value = payload[key]
+            if value is None:
+                if key in self.required:
+                    errors[key] = 'may not be null'
+                else:
+                    values[key] = None
+                continue
+            try:
+                values[key] = coerce(value)
+            except ValueError as e:
+                errors[key] = str(e)
+        if errors:
+            raise ValidationError(errors)
+        return values
+
+
+SCHEMAS = {}
+
+
+def build_schemas(base):
+    '''
+    Builds the schema of every model mapped on `base`; called once at
+    startup.
+    '''
+    for cls in base._decl_class_registry.values():
+        if hasattr(cls, '__table__'):
+            SCHEMAS[cls] = Schema(cls)
+
+
+def get_schema(cls):
+    schema = SCHEMAS.get(cls)
+    if schema is None:
+        schema = SCHEMAS[cls] = Schema(cls)
+    return schema
@@ -0,0 +1,215 @@
+import os
+import sys
+import time
+import datetime
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from pyramid.paster import (
+    get_appsettings,
+    setup_logging,
+    )
+
+from pyramid.scripts.common import parse_vars
+from pyramid.settings import asbool
+
+from ..models import (
+    get_engine,
+    get_session_factory,
+    session_scope,
+    Base,
+    Documents,
+    DocumentCategories,
+    DocumentCategoryAssignments,
+    ClassifierCheckpoints,
+    )
+
+from ..classify import (
+    MIN_SCORE,
+    load_rules,
+    init_worker,
+    classify_batch,
+    )
+
+from ..search import FIELD_WEIGHTS
+
+
+def usage(argv):
+    cmd = os.path.basename(argv[0])
+    print('usage: %s <config_uri> [batch_size=2000] [workers=N] '
+          '[rules=rules.json] [min_score=2] [name=default] [restart=false] '
+          '[var=value]\n'
+          '(example: "%s development.ini")' % (cmd, cmd))
+    sys.exit(1)
+
+
+def get_category_ids(session_factory, rules):
+    '''
+    Returns the ids of the rules' categories by name, adding those that
+    don't exist yet.
+    '''
+    with session_scope(session_factory) as dbsession:
+        ids = dict(dbsession.query(
+            DocumentCategories.name,
+            DocumentCategories.id,
+        ).filter(
+            DocumentCategories.name.in_(list(rules)),
+        ))
+        for name, rule in rules.items():
+            if name not in ids:
+                ids[name] = DocumentCategories.add(
+                    dbsession,
+                    name=name,
+                    description=rule.get('description', ''),
+                ).id
+    return ids
+
+
+# Documents are only read once they are this old, so one whose
+# transaction commits after a later document was read isn't passed over.
+SETTLE_SECONDS = 60
+
+
+def read_batches(session_factory, after, batch_size, before=None):
+    '''
+    Yields the `(creation_datetime, id)` of the last document and the
+    `(id, fields...)` rows of each batch of uncategorized documents
+    after `after`.
+    '''
+    columns = [getattr(Documents, field) for field, _ in FIELD_WEIGHTS]
+    while True:
+        with session_scope(session_factory) as dbsession:
+            rows = Documents.uncategorized(
+                dbsession,
+                columns,
+                after,
+                batch_size,
+                before,
+            )
+        if not rows:
+            return
+        after = (rows[-1].creation_datetime, rows[-1].id)
+        yield after, [(row[0],) + tuple(row[2:]) for row in rows]
+
+
+def write_batch(session_factory, name, category_ids, last, count,
+                results):
+    with session_scope(session_factory) as dbsession:
+        assigned = DocumentCategoryAssignments.assign(dbsession, [
+            (document_id, category_ids[category])
+            for document_id, categories in results
+            for category in categories
+        ])
+        ClassifierCheckpoints.advance(
+            dbsession,
+            name,
+            last,
+            count,
+            assigned,
+        )
+    return assigned
+
+
+def classify_documents(session_factory, rules, name='default',
+                       batch_size=2000, workers=1, min_score=MIN_SCORE,
+                       restart=False, settle_seconds=SETTLE_SECONDS,
+                       progress=None):
+    '''
+    Classifies the documents added since the checkpoint `name`,
+    returning how many were read and how many categories assigned.
+    Batches are classified on a pool of `workers` processes while the
+    next ones are read; each batch's assignments are written, in order,
+    with the checkpoint, so an interrupted run picks up where it
+    stopped.  `progress(documents, assigned)` is called after each
+    batch.
+    '''
+    category_ids = get_category_ids(session_factory, rules)
+    with session_scope(session_factory) as dbsession:
+        if restart:
+            ClassifierCheckpoints.reset(dbsession, name)
+        checkpoint = ClassifierCheckpoints.get(dbsession, name)
+        after = checkpoint.last if checkpoint else None
+    before = datetime.datetime.now() - \
+        datetime.timedelta(seconds=settle_seconds)
+
+    documents = 0
+    assigned = 0
+    with ProcessPoolExecutor(
+        workers,
+        initializer=init_worker,
+        initargs=(rules, min_score),
+    ) as executor:
+        # a couple of batches per process are kept in flight, so the
+        # pool isn't left waiting on the reads or the writes.
+        pending = deque()
+        batches = read_batches(session_factory, after, batch_size, before)
+        while True:
+            for last, rows in batches:
+                pending.append((
+                    last,
+                    len(rows),
+                    executor.submit(classify_batch, rows),
+                ))
+                if len(pending) >= workers * 2:
+                    break
+            if not pending:
+                break
+            last, count, future = pending.popleft()
+            assigned += write_batch(
+                session_factory,
+                name,
+                category_ids,
+                last,
+                count,
+                future.result(),
+            )
+            documents += count
+            if progress is not None:
+                progress(documents, assigned)
+    return documents, assigned
+
+
+def main(argv=sys.argv):
+    '''
+    Assigns categories to the documents that have none, by the keyword
+    rules of `civicdocs.classify`, going on from where the last run
+    with the same `name` stopped.  `restart=true` starts over (ex. after
+    the rules changed).
+    '''
+    if len(argv) < 2:
+        usage(argv)
+    config_uri = argv[1]
+    options = parse_vars(argv[2:])
+    batch_size = int(options.pop('batch_size', 2000))
+    workers = int(options.pop('workers', os.cpu_count() or 1))
+    rules_path = options.pop('rules', None)
+    min_score = float(options.pop('min_score', MIN_SCORE))
+    name = options.pop('name', 'default')
+    restart = asbool(options.pop('restart', False))
+    setup_logging(config_uri)
+    settings = get_appsettings(config_uri, options=options)
+    engine = get_engine(settings)
+    Base.metadata.create_all(engine)
+    session_factory = get_session_factory(engine)
+
+    rules = load_rules(rules_path or settings.get('civicdocs.classify.rules'))
+    started = time.time()
+
+    def progress(documents, assigned):
+        print('Classified {0} documents, assigned {1} categories '
+              '({2:.0f} documents/s)'.format(
+                  documents,
+                  assigned,
+                  documents / max(time.time() - started, 1e-6),
+              ))
+
+    classify_documents(
+        session_factory,
+        rules,
+        name,
+        batch_size,
+        workers,
+        min_score,
+        restart,
+        progress=progress,
+    )
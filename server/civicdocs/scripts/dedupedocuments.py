@@ -0,0 +1,126 @@
+import os
+import sys
+
+from sqlalchemy import (
+    inspect,
+    update,
+    bindparam,
+    )
+
+from pyramid.paster import (
+    get_appsettings,
+    setup_logging,
+    )
+
+from pyramid.scripts.common import parse_vars
+
+from ..models import (
+    get_engine,
+    get_session_factory,
+    session_scope,
+    Base,
+    Documents,
+    DocumentCategoryAssignments,
+    DocumentFacetCounts,
+    SearchPostings,
+    )
+
+from ..urls import url_hash
+
+
+def usage(argv):
+    cmd = os.path.basename(argv[0])
+    print('usage: %s <config_uri> [batch_size=1000] [var=value]\n'
+          '(example: "%s development.ini")' % (cmd, cmd))
+    sys.exit(1)
+
+
+def add_url_hash_column(engine):
+    columns = [c['name'] for c in inspect(engine).get_columns('documents')]
+    if 'url_hash' not in columns:
+        with engine.begin() as connection:
+            connection.execute(
+                'ALTER TABLE documents ADD COLUMN url_hash VARCHAR(64)')
+
+
+def add_url_hash_index(engine):
+    indexes = [i['name'] for i in inspect(engine).get_indexes('documents')]
+    for index in Documents.__table__.indexes:
+        if index.name == 'index_documents_url_hash' and \
+                index.name not in indexes:
+            index.create(engine)
+
+
+def dedupe_batch(session_factory, batch_size):
+    '''
+    Hashes the urls of the next `batch_size` oldest documents that don't
+    have a `url_hash` yet, and deletes the ones whose url is already
+    held by an older document.  Returns the number of rows processed.
+    '''
+    with session_scope(session_factory) as dbsession:
+        rows = dbsession.query(
+            Documents.id,
+            Documents.url,
+        ).filter(
+            Documents.url_hash == None,
+        ).order_by(
+            Documents.creation_datetime,
+            Documents.id,
+        ).limit(batch_size).all()
+        if not rows:
+            return 0
+        hashes = dict((row.id, url_hash(row.url)) for row in rows)
+        seen = set(row.url_hash for row in dbsession.query(
+            Documents.url_hash,
+        ).filter(
+            Documents.url_hash.in_(set(hashes.values())),
+        ))
+        keep = []
+        duplicates = []
+        for row in rows:
+            if hashes[row.id] in seen:
+                duplicates.append(row.id)
+            else:
+                seen.add(hashes[row.id])
+                keep.append({'_id': row.id, 'url_hash': hashes[row.id]})
+        if duplicates:
+            SearchPostings.unindex_documents(dbsession, duplicates)
+            DocumentFacetCounts.remove_documents(dbsession, duplicates)
+            dbsession.query(
+                DocumentCategoryAssignments,
+            ).filter(
+                DocumentCategoryAssignments.document_id.in_(duplicates),
+            ).delete(synchronize_session=False)
+            dbsession.query(
+                Documents,
+            ).filter(
+                Documents.id.in_(duplicates),
+            ).delete(synchronize_session=False)
+        if keep:
+            dbsession.execute(update(Documents).where(
+                Documents.id == bindparam('_id'),
+            ).values({
+                'url_hash': bindparam('url_hash'),
+            }), keep)
+    print('Hashed {0} documents, deleted {1} duplicates'.format(
+        len(keep), len(duplicates)))
+    return len(rows)
+
+
+def main(argv=sys.argv):
+    if len(argv) < 2:
+        usage(argv)
+    config_uri = argv[1]
+    options = parse_vars(argv[2:])
+    batch_size = int(options.pop('batch_size', 1000))
+    setup_logging(config_uri)
+    settings = get_appsettings(config_uri, options=options)
+    engine = get_engine(settings)
+    add_url_hash_column(engine)
+    Base.metadata.create_all(engine)
+    session_factory = get_session_factory(engine)
+
+    while dedupe_batch(session_factory, batch_size):
+        pass
+
+    add_url_hash_index(engine)
@@ -0,0 +1,76 @@
+import os
+import sys
+
+from pyramid.paster import (
+    get_appsettings,
+    setup_logging,
+    )
+
+from pyramid.scripts.common import parse_vars
+
+from sqlalchemy import (
+    update,
+    bindparam,
+    )
+
+from ..models import (
+    get_engine,
+    get_session_factory,
+    session_scope,
+    Base,
+    Addresses,
+    )
+
+from ..geo import encode
+
+
+def usage(argv):
+    cmd = os.path.basename(argv[0])
+    print('usage: %s <config_uri> [batch_size=1000] [var=value]\n'
+          '(example: "%s development.ini")' % (cmd, cmd))
+    sys.exit(1)
+
+
+def main(argv=sys.argv):
+    '''
+    Sets the geohash of the addresses that have none (ex. those loaded
+    before the column existed, or without the ORM).
+    '''
+    if len(argv) < 2:
+        usage(argv)
+    config_uri = argv[1]
+    options = parse_vars(argv[2:])
+    batch_size = int(options.pop('batch_size', 1000))
+    setup_logging(config_uri)
+    settings = get_appsettings(config_uri, options=options)
+    engine = get_engine(settings)
+    Base.metadata.create_all(engine)
+    session_factory = get_session_factory(engine)
+
+    table = Addresses.__table__
+    statement = update(table).where(
+        table.c.id == bindparam('_id'),
+    ).values(geohash=bindparam('_geohash'))
+    last_id = None
+    updated = 0
+    while True:
+        with session_scope(session_factory) as dbsession:
+            q = dbsession.query(
+                Addresses.id,
+                Addresses.lat,
+                Addresses.lng,
+            ).filter(
+                Addresses.geohash.is_(None),
+            )
+            if last_id is not None:
+                q = q.filter(Addresses.id > last_id)
+            rows = q.order_by(Addresses.id).limit(batch_size).all()
+            if not rows:
+                break
+            dbsession.execute(statement, [
+                dict(_id=row.id, _geohash=encode(row.lat, row.lng))
+                for row in rows
+            ])
+        last_id = rows[-1].id
+        updated += len(rows)
+        print('Updated {0} addresses'.format(updated))
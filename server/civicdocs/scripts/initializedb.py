@@ -1,10 +1,6 @@
 import os
 import sys
 import uuid
-import transaction
-
-
-from sqlalchemy import engine_from_config
 
 from pyramid.paster import (
     get_appsettings,
@@ -14,7 +10,9 @@ from pyramid.paster import (
 from pyramid.scripts.common import parse_vars
 
 from ..models import (
-    DBSession,
+    get_engine,
+    get_session_factory,
+    session_scope,
     Base,
     DocumentTypes,
     Users,
@@ -36,27 +34,31 @@ def main(argv=sys.argv):
     options = parse_vars(argv[2:])
     setup_logging(config_uri)
     settings = get_appsettings(config_uri, options=options)
-    engine = engine_from_config(settings, 'sqlalchemy.')
-    DBSession.configure(bind=engine)
+    engine = get_engine(settings)
     Base.metadata.create_all(engine)
 
-    application_pdf_doc_type = DocumentTypes.add(
-        name="Adobe PDF",
-        description="Adobe PDF file",
-        mime_type="application/pdf",
-    )
+    with session_scope(get_session_factory(engine)) as dbsession:
+        application_pdf_doc_type = DocumentTypes.add(
+            dbsession,
+            name="Adobe PDF",
+            description="Adobe PDF file",
+            mime_type="application/pdf",
+        )
 
-    system_owner = Users.add(
-        first="SYSTEM",
-        last="USERS",
-        email="system@localhost",
-        password="password",
-    )
+        system_owner = Users.add(
+            dbsession,
+            first="SYSTEM",
+            last="USERS",
+            email="system@localhost",
+            password="password",
+        )
 
-    default_scraper = Scrapers.add(
-        name="Default Scraper",
-        description="CivicDocs.IO loads with a single, defualt scraper.",
-        owner_id=system_owner.id,
-    )
+        default_scraper = Scrapers.add(
+            dbsession,
+            name="Default Scraper",
+            description="CivicDocs.IO loads with a single, defualt scraper.",
+            owner_id=system_owner.id,
+        )
 
     print("DEFAULT SCRAPER ID:\r\n{0}\r\n".format(default_scraper.id))
+    print("DEFAULT SCRAPER TOKEN:\r\n{0}\r\n".format(default_scraper.token))
@@ -0,0 +1,47 @@
+import os
+import sys
+
+from pyramid.paster import (
+    get_appsettings,
+    setup_logging,
+    )
+
+from pyramid.scripts.common import parse_vars
+
+from ..models import (
+    get_engine,
+    get_session_factory,
+    session_scope,
+    Base,
+    DocumentFacetCounts,
+    )
+
+
+def usage(argv):
+    cmd = os.path.basename(argv[0])
+    print('usage: %s <config_uri> [var=value]\n'
+          '(example: "%s development.ini")' % (cmd, cmd))
+    sys.exit(1)
+
+
+def main(argv=sys.argv):
+    '''
+    Recounts the document facet rollup from the documents, correcting
+    (and reporting) any drift.
+    '''
+    if len(argv) < 2:
+        usage(argv)
+    config_uri = argv[1]
+    options = parse_vars(argv[2:])
+    setup_logging(config_uri)
+    settings = get_appsettings(config_uri, options=options)
+    engine = get_engine(settings)
+    Base.metadata.create_all(engine)
+    session_factory = get_session_factory(engine)
+
+    with session_scope(session_factory) as dbsession:
+        drift = DocumentFacetCounts.rebuild(dbsession)
+    for (facet, value, month), stored, counted in drift:
+        print('{0} {1} {2}: {3} -> {4}'.format(
+            facet, value or '-', month, stored, counted))
+    print('Corrected {0} facet counts'.format(len(drift)))
@@ -0,0 +1,62 @@
+import os
+import sys
+
+from pyramid.paster import (
+    get_appsettings,
+    setup_logging,
+    )
+
+from pyramid.scripts.common import parse_vars
+
+from ..models import (
+    get_engine,
+    get_session_factory,
+    session_scope,
+    Base,
+    Documents,
+    SearchPostings,
+    )
+
+from ..search import FIELD_WEIGHTS
+
+
+def usage(argv):
+    cmd = os.path.basename(argv[0])
+    print('usage: %s <config_uri> [batch_size=1000] [var=value]\n'
+          '(example: "%s development.ini")' % (cmd, cmd))
+    sys.exit(1)
+
+
+def main(argv=sys.argv):
+    if len(argv) < 2:
+        usage(argv)
+    config_uri = argv[1]
+    options = parse_vars(argv[2:])
+    batch_size = int(options.pop('batch_size', 1000))
+    setup_logging(config_uri)
+    settings = get_appsettings(config_uri, options=options)
+    engine = get_engine(settings)
+    Base.metadata.create_all(engine)
+    session_factory = get_session_factory(engine)
+
+    with session_scope(session_factory) as dbsession:
+        SearchPostings.clear(dbsession)
+
+    columns = [getattr(Documents, field) for field, _ in FIELD_WEIGHTS]
+    last_id = None
+    indexed = 0
+    while True:
+        with session_scope(session_factory) as dbsession:
+            q = dbsession.query(Documents.id, *columns)
+            if last_id is not None:
+                q = q.filter(Documents.id > last_id)
+            rows = q.order_by(Documents.id).limit(batch_size).all()
+            if not rows:
+                break
+            SearchPostings.index_documents(
+                dbsession,
+                [(row.id, row._asdict()) for row in rows],
+            )
+        last_id = rows[-1].id
+        indexed += len(rows)
+        print('Indexed {0} documents'.format(indexed))
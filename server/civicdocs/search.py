@@ -0,0 +1,76 @@
+import re
+import math
+from collections import Counter
+
+
+# Fields of `Documents` that are indexed, and how many times a term found
+# in each field counts towards the term frequency of the document.
+FIELD_WEIGHTS = (
+    ('name', 3),
+    ('link_text', 2),
+    ('source_url_title', 1),
+    ('description', 1),
+)
+
+STOP_WORDS = frozenset([
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'in',
+    'is', 'it', 'of', 'on', 'or', 'that', 'the', 'to', 'was', 'with',
+])
+
+MAX_TERM_LENGTH = 64
+
+# BM25 tuning parameters.
+K1 = 1.2
+B = 0.75
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    if not text:
+        return []
+    return [
+        token for token in TOKEN_RE.findall(text.lower())
+        if token not in STOP_WORDS and len(token) <= MAX_TERM_LENGTH
+    ]
+
+
+def term_frequencies(fields):
+    '''
+    Returns the weighted term frequencies and the weighted length of a
+    document, given a mapping of its field names to their text.
+    '''
+    frequencies = Counter()
+    for field, weight in FIELD_WEIGHTS:
+        for token in tokenize(fields.get(field)):
+            frequencies[token] += weight
+    return frequencies, sum(frequencies.values())
+
+
+def parse_query(query):
+    '''
+    Splits a search query into exact terms and prefixes.  A token ending
+    in `*` (ex. `budg*`) matches every term starting with it.
+    '''
+    terms = set()
+    prefixes = set()
+    for word in query.lower().split():
+        prefix = word.endswith('*')
+        for token in tokenize(word):
+            if prefix:
+                prefixes.add(token)
+            else:
+                terms.add(token)
+    return terms, prefixes
+
+
+def idf(document_count, document_frequency):
+    return math.log(1.0 + (
+        (document_count - document_frequency + 0.5) /
+        (document_frequency + 0.5)
+    ))
+
+
+def bm25(frequency, document_length, average_length, term_idf):
+    norm = K1 * (1.0 - B + B * document_length / average_length)
+    return term_idf * frequency * (K1 + 1.0) / (frequency + norm)
@@ -0,0 +1,30 @@
+import logging
+import threading
+
+
+log = logging.getLogger(__name__)
+
+
+class PeriodicTask(threading.Thread):
+    '''
+    Calls `func(*args)` every `interval` seconds on a daemon thread until
+    `stop` is called.  Exceptions are logged and do not stop the task.
+    '''
+
+    def __init__(self, name, interval, func, *args):
+        super(PeriodicTask, self).__init__(name=name)
+        self.daemon = True
+        self.interval = interval
+        self.func = func
+        self.args = args
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.func(*self.args)
+            except Exception:
+                log.exception('%s failed', self.name)
+
+    def stop(self):
+        self._stopped.set()
@@ -0,0 +1,127 @@
+import datetime
+
+import pytest
+
+from ..models import (
+    get_engine,
+    get_session_factory,
+    session_scope,
+    Base,
+    Users,
+    Scrapers,
+    Dispatchers,
+    Workers,
+    Municipalities,
+    Documents,
+    Jobs,
+)
+
+
+@pytest.fixture
+def settings(tmp_path):
+    return {
+        'sqlalchemy.url': 'sqlite:///{0}'.format(tmp_path / 'civicdocs.db'),
+        'pyramid.includes': 'pyramid_tm',
+        'civicdocs.background_tasks': 'false',
+    }
+
+
+@pytest.fixture
+def session_factory(settings):
+    engine = get_engine(settings)
+    Base.metadata.create_all(engine)
+    yield get_session_factory(engine)
+    engine.dispose()
+
+
+@pytest.fixture
+def scope(session_factory):
+    '''
+    Opens a session with a transaction of its own, committed when the
+    block exits.
+    '''
+    return lambda: session_scope(session_factory)
+
+
+@pytest.fixture
+def dbsession(scope):
+    with scope() as dbsession:
+        yield dbsession
+
+
+@pytest.fixture
+def testapp(settings):
+    from webtest import TestApp
+    from .. import main
+    app = main({}, **settings)
+    Base.metadata.create_all(app.registry['dbsession_factory'].kw['bind'])
+    return TestApp(app)
+
+
+@pytest.fixture
+def app_scope(testapp):
+    factory = testapp.app.registry['dbsession_factory']
+    return lambda: session_scope(factory)
+
+
+def add_municipality(dbsession, name='Town'):
+    return Municipalities.add(
+        dbsession,
+        name=name,
+        description='',
+        url='http://{0}.example/'.format(name.lower()),
+    )
+
+
+def add_document(dbsession, url, name='Document', **kwargs):
+    values = dict(
+        name=name,
+        description='',
+        url=url,
+        source_url='http://town.example/',
+        source_url_title='',
+        link_text='',
+        doc_type='pdf',
+    )
+    values.update(kwargs)
+    return Documents.add(dbsession, **values)
+
+
+def add_nodes(dbsession):
+    '''
+    Adds a scraper with a dispatcher and a worker, returning the three.
+    '''
+    user = Users.add(dbsession, first='a', last='b', email='a@b',
+                     password='p')
+    scraper = Scrapers.add(dbsession, name='scraper', description='',
+                           owner_id=user.id)
+    dispatcher = Dispatchers.add(
+        dbsession,
+        scraper_id=scraper.id,
+        up_time=0,
+        idle=True,
+        dispatch_count=0,
+        last_callin_datetime=datetime.datetime.now(),
+    )
+    worker = Workers.add(
+        dbsession,
+        scraper_id=scraper.id,
+        dispatcher_id=dispatcher.id,
+        up_time=0,
+        document_count=0,
+        bandwidth=0,
+    )
+    return scraper, dispatcher, worker
+
+
+def add_job(dbsession, municipality, url='http://town.example/', **kwargs):
+    values = dict(
+        name=url,
+        description='',
+        url=url,
+        link_level=1,
+        in_process=False,
+        municipality_id=municipality.id,
+    )
+    values.update(kwargs)
+    return Jobs.add(dbsession, **values)
@@ -0,0 +1,157 @@
+import asyncio
+import datetime
+import json
+import time
+
+import pytest
+
+from ..asgi import ASGIApplication
+from ..models import Municipalities, Workers
+from .conftest import add_job, add_municipality, add_nodes
+
+
+@pytest.fixture
+def settings(settings):
+    settings['civicdocs.job_max_wait_seconds'] = '10'
+    settings['civicdocs.job_wait_recheck_seconds'] = '30'
+    return settings
+
+
+@pytest.fixture
+def asgi(testapp):
+    asgi = ASGIApplication(testapp.app, threads=2)
+    yield asgi
+    if asgi.waiter is not None:
+        asgi.waiter.close()
+    asgi.executor.shutdown(wait=True)
+
+
+async def request(asgi, method, path, query='', body=b'',
+                  disconnect_after=None):
+    '''
+    Sends a request to `asgi`, returning its status and JSON body, or
+    `None` if it sent no response.
+    '''
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    sent = []
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        if disconnect_after is None:
+            await asyncio.Event().wait()
+        await asyncio.sleep(disconnect_after)
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        sent.append(message)
+
+    await asgi({
+        'type': 'http',
+        'method': method,
+        'path': path,
+        'query_string': query.encode('latin-1'),
+        'headers': [(b'content-type', b'application/json')],
+        'client': ('127.0.0.1', 1234),
+        'server': ('localhost', 80),
+        'root_path': '',
+        'http_version': '1.1',
+        'scheme': 'http',
+    }, receive, send)
+    if not sent:
+        return None
+    body = b''.join(message.get('body', b'') for message in sent[1:])
+    return sent[0]['status'], json.loads(body) if body else None
+
+
+def past(seconds=60):
+    return datetime.datetime.now() - datetime.timedelta(seconds=seconds)
+
+
+def test_respond(asgi, app_scope):
+    with app_scope() as dbsession:
+        _, dispatcher, worker = add_nodes(dbsession)
+        dispatcher_id, worker_id = str(dispatcher.id), worker.id
+
+    async def main():
+        status, body = await request(asgi, 'GET', '/dispatchers')
+        assert status == 200
+        assert [d['id'] for d in body['dispatchers']] == [dispatcher_id]
+        assert await request(
+            asgi, 'POST', '/workers/{0}/heartbeat'.format(worker_id),
+            body=json.dumps({'document_count': 2}).encode('utf-8'),
+        ) == (204, None)
+        status, _ = await request(
+            asgi, 'GET', '/dispatchers/{0}/jobs'.format(dispatcher_id),
+            query='wait=soon')
+        assert status == 400
+
+    asyncio.run(main())
+    with app_scope() as dbsession:
+        assert dbsession.query(Workers).get(worker_id).document_count == 2
+
+
+def test_long_poll_wait():
+    asgi = ASGIApplication.__new__(ASGIApplication)
+    asgi.settings = {'civicdocs.job_max_wait_seconds': 10}
+
+    def wait(method, path, query):
+        return asgi.long_poll_wait(dict(
+            method=method,
+            path=path,
+            query_string=query.encode('latin-1'),
+        ))
+
+    assert wait('GET', '/dispatchers/x/jobs', 'wait=2') == 2
+    assert wait('GET', '/dispatchers/x/jobs', 'wait=60') == 10
+    assert wait('GET', '/dispatchers/x/jobs', 'wait=soon') == 0
+    assert wait('GET', '/dispatchers/x/jobs', '') == 0
+    assert wait('POST', '/dispatchers/x/jobs', 'wait=2') == 0
+    assert wait('GET', '/dispatchers/x', 'wait=2') == 0
+
+
+def test_long_poll_times_out(asgi, app_scope):
+    with app_scope() as dbsession:
+        _, dispatcher, _ = add_nodes(dbsession)
+        path = '/dispatchers/{0}/jobs'.format(dispatcher.id)
+    start = time.time()
+    status, body = asyncio.run(request(asgi, 'GET', path, 'wait=0.3'))
+    assert (status, body) == (200, dict(job=None, jobs=[]))
+    assert 0.3 <= time.time() - start < 5
+
+
+def test_long_poll_wakes_on_publish(asgi, app_scope):
+    with app_scope() as dbsession:
+        _, dispatcher, _ = add_nodes(dbsession)
+        municipality = add_municipality(dbsession)
+        path = '/dispatchers/{0}/jobs'.format(dispatcher.id)
+        municipality_id = municipality.id
+
+    def release():
+        with app_scope() as dbsession:
+            municipality = dbsession.query(Municipalities).get(
+                municipality_id)
+            add_job(dbsession, municipality, next_run_at=past())
+            asgi.notifier.publish(dbsession)
+
+    async def main():
+        poll = asyncio.ensure_future(request(asgi, 'GET', path, 'wait=10'))
+        await asyncio.sleep(0.3)
+        await asyncio.get_running_loop().run_in_executor(None, release)
+        return await poll
+
+    start = time.time()
+    status, body = asyncio.run(main())
+    assert status == 200
+    assert body['job']['url'] == 'http://town.example/'
+    assert time.time() - start < 5
+
+
+def test_long_poll_ends_on_disconnect(asgi, app_scope):
+    with app_scope() as dbsession:
+        _, dispatcher, _ = add_nodes(dbsession)
+        path = '/dispatchers/{0}/jobs'.format(dispatcher.id)
+    start = time.time()
+    assert asyncio.run(request(asgi, 'GET', path, 'wait=10',
+                               disconnect_after=0.3)) is None
+    assert time.time() - start < 5
@@ -0,0 +1,91 @@
+import hashlib
+import os
+
+import pytest
+
+from .conftest import (
+    add_document,
+    add_nodes,
+)
+
+
+@pytest.fixture
+def settings(settings, tmp_path):
+    settings.update({
+        'civicdocs.blobs.url': 'file://{0}'.format(tmp_path / 'blobs'),
+        'civicdocs.blobs.max_bytes': '16',
+    })
+    return settings
+
+
+@pytest.fixture
+def urls(app_scope):
+    with app_scope() as dbsession:
+        _, _, worker = add_nodes(dbsession)
+        documents = [
+            add_document(dbsession, 'http://x/%d' % i) for i in range(2)
+        ]
+        return [
+            (
+                '/workers/{0}/documents/{1}/content'.format(
+                    worker.id, document.id),
+                '/documents/{0}/content'.format(document.id),
+            )
+            for document in documents
+        ]
+
+
+def sha256(body):
+    return hashlib.sha256(body).hexdigest()
+
+
+def test_upload_and_download(testapp, urls):
+    put, get = urls[0]
+    resp = testapp.put(put, b'0123456789', content_type='text/plain',
+                       status=200).json
+    assert resp['content_sha256'] == sha256(b'0123456789')
+    assert resp['content_length'] == 10
+    resp = testapp.get(get, status=200)
+    assert resp.body == b'0123456789'
+    assert resp.content_type == 'text/plain'
+    assert resp.headers['Accept-Ranges'] == 'bytes'
+    resp = testapp.get(get, headers={'Range': 'bytes=2-4'}, status=206)
+    assert resp.body == b'234'
+    assert resp.headers['Content-Range'] == 'bytes 2-4/10'
+
+
+def test_upload_is_checked_against_its_hash(testapp, urls):
+    put, get = urls[0]
+    resp = testapp.put(put, b'abc', headers={
+        'X-Content-SHA256': sha256(b'abd'),
+    }, status=400).json
+    assert list(resp['errors']) == ['X-Content-SHA256']
+    testapp.put(put, b'abc', headers={'X-Content-SHA256': 'nope'},
+                status=400)
+    testapp.get(get, status=404)
+
+
+def test_empty_body_links_existing_content(testapp, urls):
+    (first_put, _), (second_put, second_get) = urls
+    testapp.put(first_put, b'shared', status=200)
+    resp = testapp.put(second_put, b'', headers={
+        'X-Content-SHA256': sha256(b'shared'),
+    }, status=200).json
+    assert resp['content_length'] == 6
+    assert testapp.get(second_get, status=200).body == b'shared'
+
+
+def test_upload_larger_than_max_bytes(testapp, urls):
+    put, get = urls[0]
+    testapp.put(put, b'x' * 17, status=413)
+    testapp.get(get, status=404)
+
+
+def test_missing_blob_file_is_not_found(testapp, urls, settings):
+    put, get = urls[0]
+    testapp.put(put, b'lost', status=200)
+    root = settings['civicdocs.blobs.url'][len('file://'):]
+    digest = sha256(b'lost')
+    os.remove(os.path.join(root, digest[:2], digest[2:4], digest))
+    testapp.get(get, status=404)
+    testapp.get(get, headers={'Range': 'bytes=0-1'}, status=404)
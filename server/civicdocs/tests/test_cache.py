@@ -0,0 +1,82 @@
+import time
+
+import pytest
+
+from ..cache import Cache
+from ..models import Workers
+from .conftest import add_nodes
+
+
+def test_cache_hits_and_misses():
+    cache = Cache('things')
+    loads = []
+
+    def load():
+        loads.append(1)
+        return 'value'
+
+    assert cache.get('a', load) == 'value'
+    assert cache.get('a', load) == 'value'
+    assert (cache.hits, cache.misses, len(loads)) == (1, 1, 1)
+    # None is never cached.
+    assert cache.get('b', lambda: None) is None
+    assert cache.get('b', lambda: None) is None
+    assert cache.misses == 3
+
+
+def test_cache_entries_expire():
+    cache = Cache('things', ttl=0.01)
+    cache.set('a', 'old')
+    time.sleep(0.02)
+    assert cache.get('a', lambda: 'new') == 'new'
+
+
+def test_cache_evicts_least_recently_used():
+    cache = Cache('things', maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a', lambda: None) == 1
+    cache.set('c', 3)
+    assert cache.get('a', lambda: None) == 1
+    assert cache.get('c', lambda: None) == 3
+    assert cache.get('b', lambda: 'loaded') == 'loaded'
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = Cache('workers')
+    monkeypatch.setattr(Workers, '__cache__', cache)
+    return cache
+
+
+def test_get_cached_rejects_invalid_ids(dbsession, cache):
+    assert Workers.get_cached(dbsession, 'zzz') is None
+    assert cache.misses == 0
+
+
+def test_update_and_delete_invalidate_after_commit(scope, cache):
+    with scope() as dbsession:
+        worker_id = add_nodes(dbsession)[2].id
+    with scope() as dbsession:
+        stale = Workers.get_cached(dbsession, worker_id)
+        assert Workers.get_cached(dbsession, str(worker_id)) is stale
+    assert cache.hits == 1
+    with scope() as dbsession:
+        Workers.update_by_id(dbsession, worker_id, bandwidth=5)
+        # a concurrent read caches the old row before the commit.
+        cache.set(str(worker_id), stale)
+    with scope() as dbsession:
+        assert Workers.get_cached(dbsession, worker_id).bandwidth == 5
+    with scope() as dbsession:
+        Workers.delete_by_id(dbsession, worker_id)
+    with scope() as dbsession:
+        assert Workers.get_cached(dbsession, worker_id) is None
+
+
+def test_invalid_node_ids_are_not_found(testapp):
+    testapp.post_json('/workers/zzz/document', {}, status=404)
+    testapp.post_json('/workers/zzz/documents', [], status=404)
+    testapp.post_json('/workers/zzz/fetch_states', dict(fetches=[]),
+                      status=404)
+    testapp.put('/workers/zzz/documents/x/content', b'', status=404)
+    testapp.get('/dispatchers/zzz/jobs', status=404)
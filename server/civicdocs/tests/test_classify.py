@@ -0,0 +1,119 @@
+import datetime
+
+import pytest
+
+from ..classify import (
+    DEFAULT_RULES,
+    Classifier,
+)
+from ..models import (
+    Documents,
+    DocumentCategoryAssignments,
+    ClassifierCheckpoints,
+)
+from ..scripts import classifydocuments
+from .conftest import add_document
+
+
+def fields(name, description='', link_text='', source_url_title=''):
+    return dict(
+        name=name,
+        description=description,
+        link_text=link_text,
+        source_url_title=source_url_title,
+    )
+
+
+def test_classifier_keywords_phrases_and_patterns():
+    classifier = Classifier(DEFAULT_RULES)
+    assert classifier.classify(fields('Town Board Agenda')) == ['Agendas']
+    assert classifier.classify(fields('Request for Proposals: paving')) == \
+        ['Bids and Proposals']
+    assert classifier.classify(fields('FY 2024 plan')) == ['Budgets']
+    assert classifier.classify(fields('Photo gallery')) == []
+
+
+def test_classifier_min_score():
+    classifier = Classifier(DEFAULT_RULES)
+    # one mention in the description isn't enough, two are.
+    assert classifier.classify(fields('x', 'the budget')) == []
+    assert classifier.classify(fields('x', 'budget and budget')) == \
+        ['Budgets']
+
+
+def add_documents(scope, start, count):
+    with scope() as dbsession:
+        for i in range(start, start + count):
+            name = 'Agenda %d' % i if i % 2 else 'Photo %d' % i
+            add_document(dbsession, 'http://x/%d' % i, name=name)
+
+
+def uncategorized(scope):
+    with scope() as dbsession:
+        return len(Documents.uncategorized(dbsession, [], count=10000))
+
+
+def classify(session_factory, **kwargs):
+    kwargs.setdefault('settle_seconds', 0)
+    return classifydocuments.classify_documents(
+        session_factory,
+        DEFAULT_RULES,
+        batch_size=50,
+        **kwargs
+    )
+
+
+def test_rerun_classifies_documents_added_since(session_factory, scope):
+    add_documents(scope, 0, 200)
+    assert classify(session_factory) == (200, 100)
+    add_documents(scope, 200, 200)
+    # only the new documents are read.
+    assert classify(session_factory) == (200, 100)
+    assert uncategorized(scope) == 200
+    with scope() as dbsession:
+        assert dbsession.query(DocumentCategoryAssignments).count() == 200
+        checkpoint = ClassifierCheckpoints.get(dbsession, 'default')
+        assert checkpoint.document_count == 400
+    assert classify(session_factory) == (0, 0)
+
+
+def test_interrupted_run_resumes(session_factory, scope, monkeypatch):
+    add_documents(scope, 0, 200)
+    write_batch = classifydocuments.write_batch
+    calls = []
+
+    def interrupted(*args):
+        calls.append(args)
+        if len(calls) == 3:
+            raise KeyboardInterrupt
+        return write_batch(*args)
+
+    monkeypatch.setattr(classifydocuments, 'write_batch', interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        classify(session_factory)
+    monkeypatch.undo()
+    assert classify(session_factory) == (100, 50)
+    assert uncategorized(scope) == 100
+
+
+def test_recent_documents_wait_for_the_next_run(session_factory, scope):
+    add_documents(scope, 0, 10)
+    assert classify(session_factory, settle_seconds=3600) == (0, 0)
+    assert classify(session_factory) == (10, 5)
+
+
+def test_restart(session_factory, scope):
+    add_documents(scope, 0, 10)
+    classify(session_factory)
+    assert classify(session_factory, restart=True) == (5, 0)
+
+
+def test_uncategorized_cursor_orders_by_creation(dbsession):
+    now = datetime.datetime.now()
+    first = add_document(dbsession, 'http://x/1')
+    second = add_document(dbsession, 'http://x/2')
+    first.creation_datetime = now
+    second.creation_datetime = now + datetime.timedelta(seconds=1)
+    dbsession.flush()
+    rows = Documents.uncategorized(dbsession, [], after=(now, first.id))
+    assert [row.id for row in rows] == [second.id]
@@ -0,0 +1,225 @@
+import json
+import uuid
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from .. import views
+from ..models import Documents
+from ..urls import url_hash
+from .conftest import (
+    add_document,
+    add_municipality,
+    add_nodes,
+)
+
+
+def test_keyset_pages_cover_every_document_once(dbsession):
+    ids = set(
+        add_document(dbsession, 'http://x/%d' % i).id for i in range(25)
+    )
+    seen = []
+    after = None
+    while True:
+        page = Documents.get_keyset(dbsession, after, 10)
+        if not page:
+            break
+        seen.extend(d.id for d in page)
+        after = (page[-1].creation_datetime, page[-1].id)
+    assert len(seen) == 25
+    assert set(seen) == ids
+
+
+def test_documents_filters_and_cursor(testapp, app_scope):
+    with app_scope() as dbsession:
+        municipality = add_municipality(dbsession)
+        for i in range(3):
+            add_document(dbsession, 'http://x/%d' % i,
+                         municipality_id=municipality.id)
+        add_document(dbsession, 'http://x/other')
+        municipality_id = str(municipality.id)
+    first = testapp.get('/documents', params=dict(
+        municipality_id=municipality_id, count=2)).json
+    assert len(first['documents']) == 2
+    second = testapp.get('/documents', params=dict(
+        municipality_id=municipality_id, count=2,
+        cursor=first['cursor'])).json
+    assert len(second['documents']) == 1
+
+
+def test_documents_rejects_invalid_ids(testapp):
+    for key in ('municipality_id', 'entity_id', 'document_type_id'):
+        resp = testapp.get('/documents', params={key: 'notauuid'},
+                           status=400)
+        assert resp.json['error'] == '{0} must be a uuid'.format(key)
+    testapp.get('/documents', params=dict(cursor='???'), status=400)
+    testapp.get('/documents', params=dict(
+        municipality_id=str(uuid.uuid4())), status=200)
+
+
+def document_values(url):
+    return dict(
+        name='Document',
+        description='',
+        url=url,
+        source_url='http://town.example/',
+        source_url_title='',
+        link_text='',
+        doc_type='pdf',
+    )
+
+
+def test_add_many_dedupes_urls(dbsession):
+    existing = add_document(dbsession, 'http://x/a')
+    results = Documents.add_many(dbsession, [
+        document_values(url)
+        for url in ('http://x/a', 'http://x/b', 'http://x/b')
+    ])
+    assert results[0] == (existing.id, False)
+    assert results[1][1] is True
+    assert results[2] == (results[1][0], False)
+    assert dbsession.query(Documents).count() == 2
+
+
+def test_add_returns_document_added_concurrently(dbsession, monkeypatch):
+    existing = add_document(dbsession, 'http://x/a')
+    get = Documents._get_by_url_hash
+    calls = []
+
+    def stale_get(dbsession, hash):
+        # the first lookup misses the row, as if it was added after it.
+        calls.append(hash)
+        if len(calls) == 1:
+            return None
+        return get(dbsession, hash)
+
+    monkeypatch.setattr(Documents, '_get_by_url_hash', stale_get)
+    document = add_document(dbsession, 'http://x/a')
+    monkeypatch.undo()
+    assert document.id == existing.id
+    assert dbsession.query(Documents).count() == 1
+
+
+def test_add_many_retries_urls_added_concurrently(dbsession, monkeypatch):
+    existing = add_document(dbsession, 'http://x/a')
+    ids_by_url_hash = Documents._ids_by_url_hash
+    calls = []
+
+    def stale_ids(*args):
+        calls.append(args)
+        if len(calls) == 1:
+            return {}
+        return ids_by_url_hash(*args)
+
+    monkeypatch.setattr(Documents, '_ids_by_url_hash', stale_ids)
+    results = Documents.add_many(dbsession, [
+        document_values('http://x/a'),
+        document_values('http://x/b'),
+    ])
+    monkeypatch.undo()
+    assert results[0] == (existing.id, False)
+    assert results[1][1] is True
+    assert dbsession.query(Documents).count() == 2
+
+
+def test_url_hash_rejects_invalid_port():
+    assert url_hash('http://x:80/a') == url_hash('HTTP://x/a')
+    with pytest.raises(ValueError):
+        url_hash('http://y:abc/')
+
+
+def add_worker(app_scope):
+    with app_scope() as dbsession:
+        _, _, worker = add_nodes(dbsession)
+        return str(worker.id)
+
+
+def test_document_with_invalid_url_is_rejected(testapp, app_scope):
+    worker_id = add_worker(app_scope)
+    resp = testapp.post_json(
+        '/workers/{0}/document'.format(worker_id),
+        document_values('http://y:abc/'),
+        status=400,
+    )
+    assert list(resp.json['errors']) == ['url']
+
+
+def test_batch_reports_invalid_url_per_item(testapp, app_scope):
+    worker_id = add_worker(app_scope)
+    resp = testapp.post_json(
+        '/workers/{0}/documents'.format(worker_id),
+        [document_values('http://y:abc/'), document_values('http://y/')],
+        status=200,
+    ).json
+    assert (resp['created'], resp['failed']) == (1, 1)
+    assert list(resp['results'][0]['errors']) == ['url']
+    assert resp['results'][1]['status'] == 'created'
+
+
+def test_batch_json_array(testapp, app_scope):
+    worker_id = add_worker(app_scope)
+    url = '/workers/{0}/documents'.format(worker_id)
+    resp = testapp.post_json(url, [
+        document_values('http://y/a'),
+        document_values('http://y/b'),
+        document_values('http://Y/a'),
+        dict(url='http://y/c'),
+    ], status=200).json
+    assert (resp['created'], resp['existing'], resp['failed']) == (2, 1, 1)
+    statuses = [result.get('status') for result in resp['results']]
+    assert statuses == ['created', 'created', 'existing', None]
+    assert resp['results'][0]['id'] == resp['results'][2]['id']
+    assert 'name' in resp['results'][3]['errors']
+    testapp.post_json(url, dict(url='http://y/'), status=400)
+
+
+def test_batch_ndjson(testapp, app_scope):
+    worker_id = add_worker(app_scope)
+    body = '\n'.join([
+        json.dumps(document_values('http://y/a')),
+        '{not json',
+        '',
+        json.dumps(document_values('http://y/b')),
+    ]).encode('utf-8')
+    resp = testapp.post(
+        '/workers/{0}/documents'.format(worker_id),
+        body,
+        content_type='application/x-ndjson',
+        status=200,
+    ).json
+    assert (resp['created'], resp['failed']) == (2, 1)
+    assert [result['index'] for result in resp['results']] == [0, 1, 2]
+    assert 'error' in resp['results'][1]
+
+
+def test_batch_size_is_limited(testapp, app_scope, monkeypatch):
+    worker_id = add_worker(app_scope)
+    monkeypatch.setattr(views, 'MAX_DOCUMENTS_BATCH', 2)
+    testapp.post_json('/workers/{0}/documents'.format(worker_id), [
+        document_values('http://y/%d' % i) for i in range(3)
+    ], status=413)
+
+
+def test_batch_reports_documents_the_database_rejects(testapp, app_scope,
+                                                      monkeypatch):
+    worker_id = add_worker(app_scope)
+    add_many = Documents.add_many.__func__
+
+    def rejecting_add_many(cls, dbsession, documents, *args, **kwargs):
+        if any(document['name'] == 'bad' for document in documents):
+            raise IntegrityError('INSERT', {}, Exception('rejected'))
+        return add_many(cls, dbsession, documents, *args, **kwargs)
+
+    monkeypatch.setattr(Documents, 'add_many',
+                        classmethod(rejecting_add_many))
+    bad = document_values('http://y/bad')
+    bad['name'] = 'bad'
+    resp = testapp.post_json('/workers/{0}/documents'.format(worker_id), [
+        document_values('http://y/a'),
+        bad,
+        document_values('http://y/b'),
+    ], status=200).json
+    assert (resp['created'], resp['failed']) == (2, 1)
+    assert resp['results'][1]['error'] == 'the document could not be added'
+    with app_scope() as dbsession:
+        assert dbsession.query(Documents).count() == 2
@@ -0,0 +1,68 @@
+from ..models import (
+    DocumentCategories,
+    DocumentCategoryAssignments,
+    DocumentFacetCounts,
+    Documents,
+)
+from .conftest import (
+    add_document,
+    add_municipality,
+)
+
+
+def buckets(counts, facet):
+    return dict((bucket['value'], bucket['count']) for bucket in counts[facet])
+
+
+def test_counts_follow_documents_and_categories(dbsession):
+    municipality = add_municipality(dbsession)
+    category = DocumentCategories.add(dbsession, name='Agendas',
+                                      description='')
+    documents = [
+        add_document(dbsession, 'http://x/%d' % i,
+                     municipality_id=municipality.id)
+        for i in range(3)
+    ]
+    Documents.add_many(dbsession, [dict(
+        name='Document',
+        description='',
+        url='http://x/other',
+        source_url='http://town.example/',
+        source_url_title='',
+        link_text='',
+        doc_type='pdf',
+    )])
+    assert DocumentCategoryAssignments.assign(dbsession, [
+        (documents[0].id, category.id),
+        (documents[1].id, category.id),
+    ]) == 2
+    counts = DocumentFacetCounts.counts(
+        dbsession, ['municipality', 'category', 'month'])
+    assert buckets(counts, 'municipality') == {str(municipality.id): 3}
+    assert buckets(counts, 'category') == {str(category.id): 2}
+    assert sum(buckets(counts, 'month').values()) == 4
+    assert DocumentFacetCounts.rebuild(dbsession) == []
+
+    DocumentFacetCounts.remove_documents(dbsession, [documents[0].id])
+    counts = DocumentFacetCounts.counts(
+        dbsession, ['municipality', 'category'])
+    assert buckets(counts, 'municipality') == {str(municipality.id): 2}
+    assert buckets(counts, 'category') == {str(category.id): 1}
+
+
+def test_rebuild_corrects_drift(dbsession):
+    add_document(dbsession, 'http://x/a')
+    month = dbsession.query(DocumentFacetCounts.month).first()[0]
+    DocumentFacetCounts.increment(dbsession, {('all', '', month): 5})
+    drift = DocumentFacetCounts.rebuild(dbsession)
+    assert drift == [(('all', '', month), 6, 1)]
+    assert DocumentFacetCounts.rebuild(dbsession) == []
+
+
+def test_facets_view_validates(testapp):
+    testapp.get('/documents/facets', params=dict(facet='nope'), status=400)
+    testapp.get('/documents/facets', params=dict(since='2020-13'),
+                status=400)
+    resp = testapp.get('/documents/facets', params=dict(
+        facet='month', since='2020-01')).json
+    assert resp == dict(facets=dict(month=[]))
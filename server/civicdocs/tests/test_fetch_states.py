@@ -0,0 +1,121 @@
+from ..models import (
+    DocumentChangeAudits,
+    FetchStates,
+)
+from ..urls import url_hash
+from .conftest import (
+    add_document,
+    add_nodes,
+)
+
+
+SHA_A = 'a' * 64
+SHA_B = 'b' * 64
+
+
+def fetch(url='http://x/a', **kwargs):
+    values = dict(
+        url=url,
+        not_modified=False,
+        etag=None,
+        last_modified=None,
+        content_sha256=None,
+        content_length=None,
+    )
+    values.update(kwargs)
+    return values
+
+
+def state(dbsession, url='http://x/a'):
+    return FetchStates.lookup(dbsession, [url_hash(url)])[url_hash(url)]
+
+
+def test_new_unchanged_and_changed(dbsession):
+    document = add_document(dbsession, 'http://x/a')
+    assert FetchStates.record(dbsession, [
+        fetch(etag='"1"', content_sha256=SHA_A, content_length=1),
+    ]) == dict(new=1, unchanged=0, changed=0)
+    assert FetchStates.record(dbsession, [
+        fetch(etag='"2"', content_sha256=SHA_A, content_length=1),
+    ]) == dict(new=0, unchanged=1, changed=0)
+    assert state(dbsession).etag == '"2"'
+    assert FetchStates.record(dbsession, [
+        fetch(etag='"3"', content_sha256=SHA_B, content_length=2),
+    ]) == dict(new=0, unchanged=0, changed=1)
+    dbsession.expire_all()
+    current = state(dbsession)
+    assert (current.fetch_count, current.change_count) == (3, 1)
+    assert current.content_sha256 == SHA_B
+    audit, = DocumentChangeAudits.for_document(dbsession, document.id)
+    assert (audit.previous_content_sha256, audit.content_sha256) == \
+        (SHA_A, SHA_B)
+    assert (audit.previous_content_length, audit.content_length) == (1, 2)
+
+
+def test_not_modified_keeps_validators(dbsession):
+    FetchStates.record(dbsession, [
+        fetch(etag='"1"', last_modified='Mon', content_sha256=SHA_A),
+    ])
+    assert FetchStates.record(dbsession, [
+        fetch(not_modified=True),
+    ]) == dict(new=0, unchanged=1, changed=0)
+    dbsession.expire_all()
+    current = state(dbsession)
+    assert (current.etag, current.last_modified, current.content_sha256) \
+        == ('"1"', 'Mon', SHA_A)
+    assert current.fetch_count == 2
+
+
+def test_last_report_of_a_url_wins(dbsession):
+    assert FetchStates.record(dbsession, [
+        fetch(etag='"1"'),
+        fetch('HTTP://x:80/a', etag='"2"'),
+    ]) == dict(new=1, unchanged=0, changed=0)
+    assert state(dbsession).etag == '"2"'
+
+
+def test_url_reported_concurrently(dbsession, monkeypatch):
+    FetchStates.record(dbsession, [fetch(content_sha256=SHA_A)])
+    lookup = FetchStates.lookup
+    calls = []
+
+    def stale_lookup(*args):
+        # the first lookup misses the row, as if it was added after it.
+        calls.append(args)
+        if len(calls) == 1:
+            return {}
+        return lookup(*args)
+
+    monkeypatch.setattr(FetchStates, 'lookup', stale_lookup)
+    resp = FetchStates.record(dbsession, [
+        fetch(content_sha256=SHA_B),
+        fetch('http://x/b'),
+    ])
+    monkeypatch.undo()
+    assert resp == dict(new=1, unchanged=0, changed=1)
+    assert dbsession.query(FetchStates).count() == 2
+
+
+def test_invalid_fetches_are_reported_by_index(testapp, app_scope):
+    with app_scope() as dbsession:
+        _, _, worker = add_nodes(dbsession)
+        worker_id = str(worker.id)
+    resp = testapp.post_json(
+        '/workers/{0}/fetch_states'.format(worker_id),
+        dict(fetches=[fetch('http://y:abc/'), fetch('http://y/')]),
+        status=200,
+    ).json
+    assert resp['new'] == 1
+    assert resp['failed'] == [dict(index=0, errors=dict(url='expected a url'))]
+    testapp.post_json(
+        '/workers/{0}/fetch_states/lookup'.format(worker_id),
+        dict(urls=['http://y:abc/']),
+        status=400,
+    )
+    resp = testapp.post_json(
+        '/workers/{0}/fetch_states/lookup'.format(worker_id),
+        dict(urls=['http://y/', 'http://z/']),
+        status=200,
+    ).json
+    assert resp['states'][0]['url'] == 'http://y/'
+    assert resp['states'][1] is None
@@ -0,0 +1,36 @@
+import uuid
+
+from ..models import Scrapers
+from ..renderers import json_default
+from .conftest import add_nodes
+
+
+def test_fields_project_list_rows(testapp, app_scope):
+    with app_scope() as dbsession:
+        _, dispatcher, _ = add_nodes(dbsession)
+        dispatcher_id = str(dispatcher.id)
+    resp = testapp.get('/dispatchers', params=dict(
+        fields='id, up_time,creation_datetime')).json
+    dispatcher, = resp['dispatchers']
+    assert sorted(dispatcher) == ['creation_datetime', 'id', 'up_time']
+    assert dispatcher['id'] == dispatcher_id
+    assert dispatcher['up_time'] == 0
+    # rendered as to_dict renders them.
+    full = testapp.get('/dispatchers').json['dispatchers'][0]
+    assert dispatcher['creation_datetime'] == full['creation_datetime']
+
+
+def test_unknown_fields_are_rejected(testapp):
+    resp = testapp.get('/workers', params=dict(fields='id,nope,zzz'),
+                       status=400).json
+    assert resp == dict(error='unknown fields: nope, zzz')
+
+
+def test_private_fields_are_not_selectable():
+    assert 'token' not in Scrapers.public_fields()
+    assert 'name' in Scrapers.public_fields()
+
+
+def test_json_default():
+    id = uuid.uuid4()
+    assert json_default(id) == str(id)
@@ -0,0 +1,84 @@
+from ..bloom import BloomFilter
+from ..frontier import Frontier
+from ..models import FrontierFilters, FrontierUrls
+from ..urls import url_hash
+from .conftest import (
+    add_job,
+    add_municipality,
+)
+
+
+def urls(start, stop):
+    return ['http://town.example/%d' % i for i in range(start, stop)]
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter.for_capacity(1000, 0.01)
+    digests = [url_hash(url) for url in urls(0, 1000)]
+    for digest in digests:
+        bloom.add(digest)
+    assert all(digest in bloom for digest in digests)
+    assert 900 <= bloom.capacity <= 1100
+    others = [url_hash(url) for url in urls(1000, 11000)]
+    false_positives = sum(digest in bloom for digest in others)
+    assert false_positives < 10000 * 0.02
+
+
+def test_bloom_filter_union():
+    a = BloomFilter.for_capacity(100)
+    b = BloomFilter(a.size, a.hashes)
+    a.add(url_hash('http://a/'))
+    b.add(url_hash('http://b/'))
+    a.union(b.bits)
+    assert url_hash('http://a/') in a
+    assert url_hash('http://b/') in a
+
+
+def setup_job(scope):
+    with scope() as dbsession:
+        return add_job(dbsession, add_municipality(dbsession)).id
+
+
+def push(scope, frontier, job_id, pushed):
+    with scope() as dbsession:
+        resp = frontier.push(dbsession, job_id, 5, pushed, 1)
+    with scope() as dbsession:
+        frontier.write(dbsession)
+    return resp
+
+
+def test_push_skips_seen_urls_across_processes(scope):
+    job_id = setup_job(scope)
+    frontier = Frontier(capacity=100)
+    assert push(scope, frontier, job_id, urls(0, 10))['queued'] == 10
+    assert push(scope, frontier, job_id, urls(5, 15))['queued'] == 5
+    # a new process loads the stored filter.
+    resp = push(scope, Frontier(capacity=100), job_id, urls(0, 20))
+    assert resp == dict(queued=5, seen=15, too_deep=0)
+    with scope() as dbsession:
+        assert dbsession.query(FrontierUrls).count() == 20
+        assert FrontierFilters.load(dbsession, job_id) is not None
+
+
+def test_filter_over_capacity_is_replaced(scope):
+    job_id = setup_job(scope)
+    frontier = Frontier(capacity=50)
+    stale = Frontier(capacity=50)
+    push(scope, stale, job_id, urls(0, 10))
+    push(scope, frontier, job_id, urls(10, 40))
+    push(scope, frontier, job_id, urls(40, 70))
+    with scope() as dbsession:
+        row = dbsession.query(FrontierFilters).one()
+        bloom = FrontierFilters.load(dbsession, job_id)
+        assert row.url_count == 30
+        assert bloom.capacity >= 2 * 70 - 5
+    # urls of the old filter are still seen by the process that had it.
+    resp = push(scope, frontier, job_id, urls(0, 70))
+    assert resp['queued'] == 0
+    # a process with the old filter adopts the new one on its write.
+    push(scope, stale, job_id, urls(70, 75))
+    with scope() as dbsession:
+        row = dbsession.query(FrontierFilters).one()
+        assert row.url_count == 35
+        assert FrontierFilters.load(dbsession, job_id).size == row.size
+    assert push(scope, stale, job_id, urls(40, 75))['queued'] == 0
@@ -0,0 +1,62 @@
+from ..geo import (
+    bounding_boxes,
+    covering_cells,
+    encode,
+    haversine,
+    prefix_range,
+    MAX_CELLS,
+)
+from ..models import Addresses
+
+
+def add_address(dbsession, name, lat, lng):
+    return Addresses.add(
+        dbsession,
+        name=name,
+        description='',
+        address_0='',
+        address_1='',
+        city='',
+        state='',
+        zipcode='',
+        lat=lat,
+        lng=lng,
+    )
+
+
+def test_encode():
+    assert encode(57.64911, 10.40744, 11) == 'u4pruydqqvj'
+    assert encode(42.6, -5.6, 5) == 'ezs42'
+
+
+def test_covering_cells_contain_the_area():
+    for lat, lng, radius in ((42.0, -71.0, 5), (0.0, 179.99, 50),
+                             (89.9, 0.0, 20)):
+        cells = covering_cells(bounding_boxes(lat, lng, radius))
+        assert len(cells) <= MAX_CELLS
+        # points at the edges of the radius fall in one of the cells.
+        for dlat, dlng in ((0, 0), (0.04, 0), (-0.04, 0), (0, 0.04)):
+            geohash = encode(max(min(lat + dlat, 90.0), -90.0),
+                             (lng + dlng + 180.0) % 360.0 - 180.0)
+            assert any(geohash.startswith(cell) for cell in cells)
+
+
+def test_prefix_range():
+    assert prefix_range('dr5') == ('dr5', 'dr6')
+    assert prefix_range('dz') == ('dz', 'e')
+    assert prefix_range('zz') == ('zz', None)
+
+
+def test_near_returns_addresses_within_radius(dbsession):
+    add_address(dbsession, 'here', 42.3601, -71.0589)
+    add_address(dbsession, 'close', 42.3736, -71.1097)
+    add_address(dbsession, 'far', 40.7128, -74.0060)
+    add_address(dbsession, 'east', 42.3601, 179.999)
+    add_address(dbsession, 'west', 42.3601, -179.999)
+    nearby = Addresses.near(dbsession, 42.3601, -71.0589, 10)
+    assert [address.name for _, address in nearby] == ['here', 'close']
+    assert abs(nearby[1][0] - haversine(
+        42.3601, -71.0589, 42.3736, -71.1097)) < 1e-9
+    # the search area wraps around the antimeridian.
+    nearby = Addresses.near(dbsession, 42.3601, 179.99, 5)
+    assert sorted(address.name for _, address in nearby) == ['east', 'west']
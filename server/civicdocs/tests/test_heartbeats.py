@@ -0,0 +1,101 @@
+import datetime
+import uuid
+
+import pytest
+
+from ..heartbeats import HeartbeatBuffer, flush_heartbeats
+from ..models import Dispatchers, Workers
+from .conftest import add_nodes
+
+
+def test_buffer_keeps_latest_gauges_and_adds_counters():
+    buffer = HeartbeatBuffer()
+    buffer.beat(Workers, 1, {'up_time': 5, 'bandwidth': 10},
+                {'document_count': 2})
+    buffer.beat(Workers, 1, {'up_time': 7}, {'document_count': 3})
+    buffer.beat(Dispatchers, 2, {'idle': True}, {})
+    assert len(buffer) == 2
+    pending = buffer.drain()
+    assert len(buffer) == 0
+    gauges, counters = pending[Workers][1]
+    assert gauges['up_time'] == 7
+    assert gauges['bandwidth'] == 10
+    assert counters == {'document_count': 5}
+    assert pending[Dispatchers][2][0]['idle'] is True
+
+
+def test_buffer_restores_under_newer_beats():
+    buffer = HeartbeatBuffer()
+    buffer.beat(Workers, 1, {'up_time': 5}, {'document_count': 2})
+    pending = buffer.drain()
+    buffer.beat(Workers, 1, {'up_time': 9}, {'document_count': 1})
+    buffer.restore(pending)
+    gauges, counters = buffer.drain()[Workers][1]
+    assert gauges['up_time'] == 9
+    assert counters == {'document_count': 3}
+
+
+def test_flush_writes_buffered_beats(scope, session_factory):
+    with scope() as dbsession:
+        _, _, worker = add_nodes(dbsession)
+        id = worker.id
+    buffer = HeartbeatBuffer()
+    buffer.beat(Workers, id, {'up_time': 5}, {'document_count': 2})
+    buffer.beat(Workers, id, {'bandwidth': 10}, {'document_count': 3})
+    flush_heartbeats(buffer, session_factory)
+    assert len(buffer) == 0
+    with scope() as dbsession:
+        worker = dbsession.query(Workers).get(id)
+        assert worker.up_time == 5
+        assert worker.bandwidth == 10
+        assert worker.document_count == 5
+        assert worker.last_callin_datetime is not None
+        assert worker.status == Workers.ALIVE
+
+
+def test_failed_flush_keeps_the_beats(session_factory, monkeypatch):
+    def fail(cls, dbsession, beats):
+        raise RuntimeError('down')
+    monkeypatch.setattr(Workers, 'apply_heartbeats', classmethod(fail))
+    buffer = HeartbeatBuffer()
+    buffer.beat(Workers, 1, {'up_time': 5}, {'document_count': 2})
+    with pytest.raises(RuntimeError):
+        flush_heartbeats(buffer, session_factory)
+    assert buffer.drain()[Workers][1][1] == {'document_count': 2}
+
+
+def test_heartbeat_updates_the_node(testapp, app_scope):
+    with app_scope() as dbsession:
+        _, dispatcher, worker = add_nodes(dbsession)
+        dispatcher_id, worker_id = dispatcher.id, worker.id
+        dispatcher.last_callin_datetime = datetime.datetime(2000, 1, 1)
+    testapp.post_json('/workers/%s/heartbeat' % worker_id,
+                      {'up_time': 5, 'document_count': 2}, status=204)
+    testapp.post_json('/workers/%s/heartbeat' % worker_id,
+                      {'document_count': 3}, status=204)
+    testapp.post('/dispatchers/%s/heartbeat' % dispatcher_id, status=204)
+    with app_scope() as dbsession:
+        worker = dbsession.query(Workers).get(worker_id)
+        assert worker.up_time == 5
+        assert worker.document_count == 5
+        assert worker.last_callin_datetime is not None
+        dispatcher = dbsession.query(Dispatchers).get(dispatcher_id)
+        assert dispatcher.last_callin_datetime.year > 2000
+
+
+def test_heartbeat_rejects_bad_fields(testapp, app_scope):
+    with app_scope() as dbsession:
+        _, _, worker = add_nodes(dbsession)
+        id = worker.id
+    resp = testapp.post_json('/workers/%s/heartbeat' % id,
+                             {'up_time': 'soon'}, status=400)
+    assert 'up_time' in resp.json['errors']
+    testapp.post_json('/workers/%s/heartbeat' % id, [1], status=400)
+    with app_scope() as dbsession:
+        assert dbsession.query(Workers).get(id).up_time == 0
+
+
+def test_heartbeat_for_unknown_node(testapp):
+    testapp.post_json('/workers/nope/heartbeat', {}, status=404)
+    testapp.post_json('/workers/%s/heartbeat' % uuid.uuid4(), {},
+                      status=404)
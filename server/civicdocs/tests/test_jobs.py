@@ -0,0 +1,174 @@
+import datetime
+
+from ..models import Hosts, JobRuns, Jobs
+from .conftest import (
+    add_job,
+    add_municipality,
+    add_nodes,
+)
+
+
+def past(seconds=60):
+    return datetime.datetime.now() - datetime.timedelta(seconds=seconds)
+
+
+def test_busy_host_does_not_crowd_out_others(scope):
+    with scope() as dbsession:
+        municipality = add_municipality(dbsession)
+        for i in range(20):
+            add_job(dbsession, municipality, 'http://busy.example/%d' % i,
+                    priority=10, next_run_at=past())
+        add_job(dbsession, municipality, 'http://quiet.example/',
+                next_run_at=past())
+        add_job(dbsession, municipality, 'http://other.example/',
+                next_run_at=past())
+    with scope() as dbsession:
+        jobs = Jobs.get_jobs(dbsession, 3)
+        urls = [job.url for job in jobs]
+    assert len(urls) == 3
+    assert urls[0].startswith('http://busy.example/')
+    assert sorted(urls[1:]) == [
+        'http://other.example/',
+        'http://quiet.example/',
+    ]
+
+
+def test_claims_follow_host_limits(scope):
+    with scope() as dbsession:
+        municipality = add_municipality(dbsession)
+        for i in range(3):
+            add_job(dbsession, municipality, 'http://town.example/%d' % i,
+                    next_run_at=past())
+    with scope() as dbsession:
+        assert len(Jobs.get_jobs(dbsession, 3)) == 1
+    # the host rests for its min delay after a claim.
+    with scope() as dbsession:
+        assert Jobs.get_jobs(dbsession, 3) == []
+    with scope() as dbsession:
+        host = dbsession.query(Hosts).one()
+        host.min_delay_seconds = 0
+        host.next_claim_at = past()
+    with scope() as dbsession:
+        assert len(Jobs.get_jobs(dbsession, 3)) == 1
+    # at most `host_max_concurrent` of its jobs are in process.
+    with scope() as dbsession:
+        assert Jobs.get_jobs(dbsession, 3, host_max_concurrent=2) == []
+    with scope() as dbsession:
+        assert len(Jobs.get_jobs(dbsession, 3, host_max_concurrent=3)) == 1
+
+
+def test_expired_leases_are_reaped(scope):
+    with scope() as dbsession:
+        _, dispatcher, _ = add_nodes(dbsession)
+        municipality = add_municipality(dbsession)
+        add_job(dbsession, municipality, next_run_at=past())
+        dispatcher_id = dispatcher.id
+    with scope() as dbsession:
+        job_id = Jobs.get_job(dbsession, dispatcher_id, lease_seconds=-1,
+                              host_min_delay_seconds=0).id
+    with scope() as dbsession:
+        assert Jobs.get_job(dbsession, dispatcher_id) is None
+        assert Jobs.extend_lease(dbsession, job_id, dispatcher_id) \
+            is not None
+        assert Jobs.reap_expired_leases(dbsession) == 0
+    with scope() as dbsession:
+        assert Jobs.extend_lease(dbsession, job_id, dispatcher_id,
+                                 lease_seconds=-1) is not None
+    with scope() as dbsession:
+        assert Jobs.reap_expired_leases(dbsession) == 1
+    with scope() as dbsession:
+        job = Jobs.get_job(dbsession, dispatcher_id)
+        assert job.id == job_id
+        assert job.lease_dispatcher_id == dispatcher_id
+
+
+def test_dispatcher_claims_several_jobs(testapp, app_scope):
+    with app_scope() as dbsession:
+        _, dispatcher, _ = add_nodes(dbsession)
+        municipality = add_municipality(dbsession)
+        for i in range(4):
+            add_job(dbsession, municipality, 'http://host%d.example/' % i,
+                    next_run_at=past())
+        dispatcher_id = str(dispatcher.id)
+    url = '/dispatchers/{0}/jobs'.format(dispatcher_id)
+    resp = testapp.get(url, params=dict(count=3), status=200).json
+    assert len(resp['jobs']) == 3
+    assert resp['job'] == resp['jobs'][0]
+    claimed = set(job['id'] for job in resp['jobs'])
+    resp = testapp.get(url, params=dict(count=3), status=200).json
+    assert len(resp['jobs']) == 1
+    assert resp['jobs'][0]['id'] not in claimed
+    assert testapp.get(url, status=200).json == dict(job=None, jobs=[])
+    with app_scope() as dbsession:
+        assert dbsession.query(Jobs).filter(Jobs.in_process == True) \
+            .count() == 4
+        assert dbsession.query(JobRuns).filter(JobRuns.finished == False) \
+            .count() == 4
+
+
+def test_only_the_lease_holder_extends_or_completes(testapp, app_scope):
+    with app_scope() as dbsession:
+        _, holder, _ = add_nodes(dbsession)
+        other = add_nodes(dbsession)[1]
+        municipality = add_municipality(dbsession)
+        add_job(dbsession, municipality, next_run_at=past())
+        holder_id, other_id = str(holder.id), str(other.id)
+    job_id = testapp.get('/dispatchers/{0}/jobs'.format(holder_id)) \
+        .json['job']['id']
+    lease = '/dispatchers/{0}/jobs/{1}/lease'
+    complete = '/dispatchers/{0}/jobs/{1}/complete'
+    testapp.put(lease.format(other_id, job_id), status=409)
+    testapp.post_json(complete.format(other_id, job_id),
+                      dict(succeeded=True), status=409)
+    testapp.put(lease.format('zzz', job_id), status=400)
+    resp = testapp.put(lease.format(holder_id, job_id), status=200).json
+    assert resp['job_id'] == job_id
+    # once reaped, the former holder can't extend or complete it either.
+    with app_scope() as dbsession:
+        Jobs.extend_lease(dbsession, job_id, holder_id, lease_seconds=-1)
+    with app_scope() as dbsession:
+        assert Jobs.reap_expired_leases(dbsession) == 1
+    testapp.put(lease.format(holder_id, job_id), status=409)
+    testapp.post_json(complete.format(holder_id, job_id),
+                      dict(succeeded=True), status=409)
+    with app_scope() as dbsession:
+        job = Jobs.get_by_id(dbsession, job_id)
+        assert (job.in_process, job.lease_dispatcher_id) == (False, None)
+
+
+def test_backoff_doubles_up_to_the_cap():
+    assert [Jobs.backoff_seconds(n, 60, 300) for n in range(1, 6)] == \
+        [60, 120, 240, 300, 300]
+
+
+def test_failures_back_off_until_a_success(scope):
+    with scope() as dbsession:
+        _, dispatcher, _ = add_nodes(dbsession)
+        municipality = add_municipality(dbsession)
+        job = add_job(dbsession, municipality, recrawl_interval=3600)
+        dispatcher_id, job_id = dispatcher.id, job.id
+
+    def run(succeeded):
+        with scope() as dbsession:
+            job = dbsession.query(Jobs).get(job_id)
+            job.in_process = True
+            job.lease_dispatcher_id = dispatcher_id
+        with scope() as dbsession:
+            before = datetime.datetime.now()
+            next_run_at = Jobs.complete(
+                dbsession, job_id, dispatcher_id, succeeded,
+                retry_seconds=60, max_backoff_seconds=200)
+            delay = (next_run_at - before).total_seconds()
+        with scope() as dbsession:
+            job = dbsession.query(Jobs).get(job_id)
+            assert not job.in_process
+            assert job.lease_dispatcher_id is None
+            return round(delay), job.failure_count
+
+    assert run(False) == (60, 1)
+    assert run(False) == (120, 2)
+    assert run(False) == (200, 3)
+    assert run(True) == (3600, 0)
+    assert run(False) == (60, 1)
+    with scope() as dbsession:
+        assert Jobs.complete(dbsession, job_id, dispatcher_id, True) is None
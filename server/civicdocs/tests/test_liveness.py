@@ -0,0 +1,78 @@
+import datetime
+
+from ..models import Dispatchers, Jobs, Workers
+from .conftest import add_job, add_municipality, add_nodes
+
+
+def past(seconds):
+    return datetime.datetime.now() - datetime.timedelta(seconds=seconds)
+
+
+def test_sweep_marks_silent_nodes_stale(scope):
+    with scope() as dbsession:
+        _, dispatcher, worker = add_nodes(dbsession)
+        dispatcher_id, worker_id = dispatcher.id, worker.id
+        worker.last_callin_datetime = past(600)
+    with scope() as dbsession:
+        assert Workers.sweep_stale(dbsession, 120) == [worker_id]
+        assert Dispatchers.sweep_stale(dbsession, 120) == []
+    with scope() as dbsession:
+        assert dbsession.query(Workers).get(worker_id).status == \
+            Workers.STALE
+        assert dbsession.query(Dispatchers).get(dispatcher_id).status == \
+            Dispatchers.ALIVE
+        # already stale, so not swept again.
+        assert Workers.sweep_stale(dbsession, 120) == []
+
+
+def test_sweep_releases_the_jobs_of_stale_dispatchers(scope):
+    with scope() as dbsession:
+        _, dispatcher, _ = add_nodes(dbsession)
+        municipality = add_municipality(dbsession)
+        job = add_job(
+            dbsession,
+            municipality,
+            in_process=True,
+            lease_dispatcher_id=dispatcher.id,
+            lease_expiration_datetime=datetime.datetime.now() +
+            datetime.timedelta(hours=1),
+        )
+        dispatcher.current_job_id = job.id
+        dispatcher.last_callin_datetime = past(600)
+        dispatcher_id, job_id = dispatcher.id, job.id
+    with scope() as dbsession:
+        assert Dispatchers.sweep_stale(dbsession, 120) == [dispatcher_id]
+    with scope() as dbsession:
+        dispatcher = dbsession.query(Dispatchers).get(dispatcher_id)
+        assert dispatcher.status == Dispatchers.STALE
+        assert dispatcher.current_job_id is None
+        job = dbsession.query(Jobs).get(job_id)
+        assert not job.in_process
+        assert job.lease_dispatcher_id is None
+
+
+def test_heartbeat_revives_a_stale_node(testapp, app_scope):
+    with app_scope() as dbsession:
+        _, _, worker = add_nodes(dbsession)
+        worker.status = Workers.STALE
+        id = worker.id
+    testapp.post_json('/workers/%s/heartbeat' % id, {}, status=204)
+    with app_scope() as dbsession:
+        assert dbsession.query(Workers).get(id).status == Workers.ALIVE
+
+
+def test_list_filters_on_liveness(testapp, app_scope):
+    with app_scope() as dbsession:
+        _, alive, _ = add_nodes(dbsession)
+        _, silent, _ = add_nodes(dbsession)
+        silent.last_callin_datetime = past(600)
+        _, swept, _ = add_nodes(dbsession)
+        swept.status = Dispatchers.STALE
+        ids = str(alive.id), str(silent.id), str(swept.id)
+    resp = testapp.get('/dispatchers?alive=true')
+    assert [d['id'] for d in resp.json['dispatchers']] == [ids[0]]
+    resp = testapp.get('/dispatchers?alive=false')
+    assert sorted(d['id'] for d in resp.json['dispatchers']) == \
+        sorted(ids[1:])
+    testapp.get('/dispatchers?alive=maybe', status=400)
+    testapp.get('/workers?alive=maybe', status=400)
@@ -0,0 +1,82 @@
+import datetime
+import threading
+import time
+
+import pytest
+
+from ..models import Municipalities, session_scope
+from ..notify import JobNotifier
+from .conftest import add_job, add_municipality, add_nodes
+
+
+@pytest.fixture
+def settings(settings):
+    # only a notification (or the wait running out) ends a wait.
+    settings['civicdocs.job_max_wait_seconds'] = '10'
+    settings['civicdocs.job_wait_recheck_seconds'] = '30'
+    return settings
+
+
+def past(seconds=60):
+    return datetime.datetime.now() - datetime.timedelta(seconds=seconds)
+
+
+def test_notifier_wait_times_out():
+    notifier = JobNotifier()
+    start = time.time()
+    assert not notifier.wait(notifier.generation, 0.2)
+    assert time.time() - start >= 0.2
+
+
+def test_notifier_does_not_miss_an_earlier_notification():
+    notifier = JobNotifier()
+    generation = notifier.generation
+    notifier.notify()
+    assert notifier.wait(generation, 0)
+
+
+def test_publish_waits_for_the_commit(session_factory):
+    notifier = JobNotifier()
+    generation = notifier.generation
+    with session_scope(session_factory) as dbsession:
+        notifier.publish(dbsession)
+        assert notifier.generation == generation
+    assert notifier.generation == generation + 1
+
+
+def test_wait_times_out_without_jobs(testapp, app_scope):
+    with app_scope() as dbsession:
+        _, dispatcher, _ = add_nodes(dbsession)
+        url = '/dispatchers/{0}/jobs'.format(dispatcher.id)
+    start = time.time()
+    resp = testapp.get(url, params=dict(wait=0.3), status=200).json
+    assert resp == dict(job=None, jobs=[])
+    assert 0.3 <= time.time() - start < 5
+    testapp.get(url, params=dict(wait='soon'), status=400)
+    testapp.get(url, params=dict(wait=-1), status=400)
+
+
+def test_wait_wakes_on_publish(testapp, app_scope):
+    with app_scope() as dbsession:
+        _, dispatcher, _ = add_nodes(dbsession)
+        municipality = add_municipality(dbsession)
+        url = '/dispatchers/{0}/jobs'.format(dispatcher.id)
+        municipality_id = municipality.id
+    notifier = testapp.app.registry['job_notifier']
+
+    def release():
+        with app_scope() as dbsession:
+            municipality = dbsession.query(Municipalities).get(
+                municipality_id)
+            add_job(dbsession, municipality, next_run_at=past())
+            notifier.publish(dbsession)
+
+    timer = threading.Timer(0.3, release)
+    start = time.time()
+    timer.start()
+    try:
+        resp = testapp.get(url, params=dict(wait=10), status=200).json
+    finally:
+        timer.join()
+    assert resp['job']['url'] == 'http://town.example/'
+    assert time.time() - start < 5
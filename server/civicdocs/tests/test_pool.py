@@ -0,0 +1,36 @@
+from sqlalchemy import create_engine
+
+from ..pool import (
+    InstrumentedQueuePool,
+    instrument,
+)
+
+
+def test_pool_stats(tmp_path):
+    engine = create_engine(
+        'sqlite:///{0}'.format(tmp_path / 'pool.db'),
+        poolclass=InstrumentedQueuePool,
+        pool_size=2,
+        max_overflow=1,
+    )
+    stats = instrument(engine)
+    connections = [engine.connect() for _ in range(3)]
+    for connection in connections:
+        connection.close()
+    resp = stats.to_dict(engine.pool)
+    assert (resp['connects'], resp['checkouts'], resp['checkins']) == \
+        (3, 3, 3)
+    assert (resp['max_checked_out'], resp['max_overflow_used']) == (3, 1)
+    assert resp['checked_out'] == 0
+    assert resp['waits'] == 3
+    assert (resp['size'], resp['max_overflow']) == (2, 1)
+    engine.dispose()
+
+
+def test_pool_stats_are_only_served_to_allowed_hosts(testapp):
+    testapp.get('/stats/pool', extra_environ=dict(REMOTE_ADDR='10.0.0.1'),
+                status=403)
+    resp = testapp.get('/stats/pool',
+                       extra_environ=dict(REMOTE_ADDR='127.0.0.1'),
+                       status=200).json
+    assert resp['pool']['checkouts'] >= 1
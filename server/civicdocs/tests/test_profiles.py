@@ -0,0 +1,75 @@
+import pytest
+from sqlalchemy import event
+from sqlalchemy.exc import InvalidRequestError
+
+from ..models import (
+    Addresses,
+    Entities,
+    Municipalities,
+)
+from .conftest import add_municipality
+
+
+def add_address(dbsession, name, **kwargs):
+    return Addresses.add(
+        dbsession,
+        name=name,
+        description='',
+        address_0='1 Main St',
+        address_1='',
+        city='Town',
+        state='NY',
+        zipcode='12345',
+        lat=42.0,
+        lng=-73.0,
+        **kwargs
+    )
+
+
+def add_municipalities(dbsession, count):
+    for i in range(count):
+        municipality = add_municipality(dbsession, 'Town%d' % i)
+        add_address(dbsession, 'Hall%d' % i,
+                    municipality_id=municipality.id)
+        entity = Entities.add(
+            dbsession,
+            name='Board',
+            description='',
+            municipality_id=municipality.id,
+        )
+        add_address(dbsession, 'Office%d' % i, entity_id=entity.id)
+
+
+def count_queries(dbsession):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        if statement.startswith('SELECT'):
+            statements.append(statement)
+
+    event.listen(dbsession.bind, 'before_cursor_execute',
+                 before_cursor_execute)
+    return statements
+
+
+def test_list_profile_loads_a_page_in_a_fixed_number_of_queries(scope):
+    with scope() as dbsession:
+        add_municipalities(dbsession, 5)
+    with scope() as dbsession:
+        statements = count_queries(dbsession)
+        municipalities = Municipalities.get_paged(
+            dbsession, 0, 10, profile='list')
+        resp = [m.to_dict() for m in municipalities]
+    assert len(resp) == 5
+    assert all(len(m['entities'][0]['addresses']) == 1 for m in resp)
+    # municipalities, their addresses, entities and entity addresses.
+    assert len(statements) == 4
+
+
+def test_relationships_outside_a_profile_raise(dbsession):
+    add_municipalities(dbsession, 1)
+    dbsession.expire_all()
+    entity = Entities.get_paged(dbsession, profile='detail')[0]
+    assert len(entity.to_dict()['addresses']) == 1
+    with pytest.raises(InvalidRequestError):
+        entity.municipality
@@ -0,0 +1,51 @@
+import datetime
+
+from ..models import JobRuns
+from .conftest import (
+    add_municipality,
+    add_job,
+    add_nodes,
+)
+
+
+def test_throughput_rolls_up_runs(dbsession):
+    municipality = add_municipality(dbsession)
+    _, dispatcher, _ = add_nodes(dbsession)
+    jobs = [
+        add_job(dbsession, municipality, 'http://town%d.example/' % i)
+        for i in range(2)
+    ]
+    start = datetime.datetime(2024, 3, 5, 10, 30)
+    JobRuns.open(dbsession, [j.id for j in jobs], dispatcher.id,
+                 start_datetime=start)
+    for job, succeeded in zip(jobs, (True, False)):
+        run = JobRuns.close(dbsession, job.id, dispatcher.id, succeeded,
+                            document_count=5, bytes_fetched=1000,
+                            pages_visited=7)
+        run.duration_seconds = 10
+    dbsession.flush()
+    periods = JobRuns.throughput(
+        dbsession,
+        [JobRuns.municipality_id == municipality.id],
+        bucket='day',
+    )
+    assert len(periods) == 1
+    period = periods[0]
+    assert period['period'].startswith('2024-03-05')
+    assert (period['runs'], period['succeeded']) == (2, 1)
+    assert period['bytes_fetched'] == 2000
+    assert period['documents_per_second'] == 0.5
+    assert period['bytes_per_second'] == 100.0
+    assert period['average_duration_seconds'] == 10.0
+    # plain numbers, which every renderer can serialize.
+    for key in ('runs', 'succeeded', 'document_count', 'bytes_fetched',
+                'pages_visited'):
+        assert type(period[key]) is int
+    assert type(period['duration_seconds']) is float
+
+
+def test_close_without_open_run(dbsession):
+    municipality = add_municipality(dbsession)
+    _, dispatcher, _ = add_nodes(dbsession)
+    job = add_job(dbsession, municipality)
+    assert JobRuns.close(dbsession, job.id, dispatcher.id, True) is None
@@ -0,0 +1,89 @@
+import uuid
+import datetime
+
+import pytest
+
+from ..models import Dispatchers
+from ..schemas import (
+    Schema,
+    ValidationError,
+    coerce_datetime,
+)
+
+
+def dispatcher(**kwargs):
+    values = dict(
+        scraper_id=str(uuid.uuid4()),
+        up_time=10,
+        idle=True,
+        dispatch_count=0,
+    )
+    values.update(kwargs)
+    return values
+
+
+def errors(schema, payload, update=False):
+    with pytest.raises(ValidationError) as e:
+        schema.validate(payload, update=update)
+    return e.value.errors
+
+
+def test_values_are_coerced():
+    schema = Schema(Dispatchers)
+    scraper_id = uuid.uuid4()
+    values = schema.validate(dispatcher(
+        scraper_id=str(scraper_id),
+        current_job_id=None,
+        # server keys and unknown keys are dropped.
+        id=str(uuid.uuid4()),
+        last_callin_datetime='2020-01-01',
+        status='dead',
+        unknown=1,
+    ))
+    assert values == dict(
+        scraper_id=scraper_id,
+        current_job_id=None,
+        up_time=10,
+        idle=True,
+        dispatch_count=0,
+    )
+    assert coerce_datetime('2020-01-02T03:04:05') == \
+        datetime.datetime(2020, 1, 2, 3, 4, 5)
+    with pytest.raises(ValueError):
+        coerce_datetime('yesterday')
+
+
+def test_coercion_errors():
+    schema = Schema(Dispatchers)
+    assert errors(schema, dispatcher(
+        scraper_id='nope',
+        up_time='10',
+        idle=1,
+        dispatch_count=True,
+    )) == dict(
+        scraper_id='expected a uuid',
+        up_time='expected an integer',
+        idle='expected true or false',
+        dispatch_count='expected an integer',
+    )
+    assert errors(schema, dict(up_time=None)) == dict(
+        scraper_id='required',
+        up_time='may not be null',
+        idle='required',
+        dispatch_count='required',
+    )
+    # an update replaces the row, so the optional fields are needed too.
+    assert errors(schema, dispatcher(), update=True) == dict(
+        current_job_id='required')
+    assert errors(schema, []) == dict(dispatchers='expected an object')
+    error = ValidationError(dict(b='x', a='y'))
+    assert str(error) == 'a: y, b: x'
+
+
+def test_invalid_payloads_are_answered_400(testapp):
+    resp = testapp.post_json('/dispatchers', dispatcher(up_time='x'),
+                             status=400).json
+    assert resp == dict(errors=dict(up_time='expected an integer'))
+    resp = testapp.post('/dispatchers', b'{not json',
+                        content_type='application/json', status=400).json
+    assert resp == dict(errors=dict(body='expected a JSON object'))
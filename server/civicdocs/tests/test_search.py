@@ -0,0 +1,90 @@
+from sqlalchemy import false
+
+from .. import views
+from ..models import (
+    SearchTerms,
+    SearchCorpus,
+    SearchPostings,
+    Documents,
+)
+from ..search import (
+    tokenize,
+    parse_query,
+)
+from .conftest import add_document
+
+
+def test_tokenize_drops_stop_words():
+    assert tokenize('The Budget of the Town') == ['budget', 'town']
+
+
+def test_parse_query_prefixes():
+    assert parse_query('budg* minutes') == ({'minutes'}, {'budg'})
+
+
+def test_search_ranks_by_bm25(dbsession):
+    add_document(dbsession, 'http://x/1', name='Minutes',
+                 description='budget mentioned once')
+    best = add_document(dbsession, 'http://x/2', name='Budget 2015',
+                        link_text='budget')
+    add_document(dbsession, 'http://x/3', name='Agenda')
+    total, results = Documents.search(dbsession, 'budget')
+    assert total == 2
+    assert results[0][0].id == best.id
+    assert results[0][1] > results[1][1]
+
+
+def test_search_prefix_and_paging(dbsession):
+    for i in range(3):
+        add_document(dbsession, 'http://x/%d' % i, name='budgetary %d' % i)
+    total, results = Documents.search(dbsession, 'budg*', start=1, count=1)
+    assert total == 3
+    assert len(results) == 1
+
+
+def test_unindex_keeps_statistics(dbsession):
+    document = add_document(dbsession, 'http://x/1', name='budget')
+    add_document(dbsession, 'http://x/2', name='budget minutes')
+    SearchPostings.unindex_documents(dbsession, [document.id])
+    assert SearchCorpus.totals(dbsession)[0] == 1
+    terms = dict(dbsession.query(SearchTerms.term, SearchTerms.document_count))
+    assert terms['budget'] == 1
+    assert terms['minutes'] == 1
+
+
+def test_corpus_totals_sum_the_shards(dbsession):
+    for _ in range(40):
+        SearchCorpus.increment(dbsession, 1, 10)
+    assert SearchCorpus.totals(dbsession) == (40, 400)
+    assert dbsession.query(SearchCorpus).count() <= SearchCorpus.SHARDS
+
+
+def test_increment_counts_terms_added_concurrently(dbsession, monkeypatch):
+    SearchTerms.increment(dbsession, {'budget': 1})
+    query = dbsession.query
+    calls = []
+
+    def stale_query(*args):
+        # the first lookup misses the row, as if it was added after it.
+        calls.append(args)
+        if len(calls) == 1:
+            return query(*args).filter(false())
+        return query(*args)
+
+    monkeypatch.setattr(dbsession, 'query', stale_query)
+    SearchTerms.increment(dbsession, {'budget': 2, 'minutes': 1})
+    monkeypatch.undo()
+    terms = dict(dbsession.query(SearchTerms.term, SearchTerms.document_count))
+    assert terms == {'budget': 3, 'minutes': 1}
+
+
+def test_search_page_size_is_capped(testapp, app_scope, monkeypatch):
+    monkeypatch.setattr(views, 'MAX_SEARCH_PAGE', 2)
+    with app_scope() as dbsession:
+        for i in range(3):
+            add_document(dbsession, 'http://x/%d' % i, name='budget')
+    resp = testapp.get('/search', params=dict(
+        q='budget', count=100000000)).json
+    assert resp['count'] == 2
+    assert resp['total'] == 3
+    assert len(resp['documents']) == 2
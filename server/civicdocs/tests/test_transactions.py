@@ -0,0 +1,57 @@
+import pytest
+
+from ..models import Documents
+from .conftest import add_nodes
+
+
+def document_values(url):
+    return dict(
+        name='Document',
+        description='',
+        url=url,
+        source_url='http://town.example/',
+        source_url_title='',
+        link_text='',
+        doc_type='pdf',
+    )
+
+
+@pytest.fixture
+def worker_url(app_scope):
+    with app_scope() as dbsession:
+        _, _, worker = add_nodes(dbsession)
+        return '/workers/{0}/document'.format(worker.id)
+
+
+def count_documents(app_scope):
+    with app_scope() as dbsession:
+        return dbsession.query(Documents).count()
+
+
+def test_request_writes_commit(testapp, app_scope, worker_url):
+    testapp.post_json(worker_url, document_values('http://x/'), status=200)
+    assert count_documents(app_scope) == 1
+
+
+def test_exception_rolls_back_request_writes(testapp, app_scope,
+                                             worker_url, monkeypatch):
+    def failing_to_dict(self):
+        raise RuntimeError('after the write')
+
+    monkeypatch.setattr(Documents, 'to_dict', failing_to_dict)
+    with pytest.raises(RuntimeError):
+        testapp.post_json(worker_url, document_values('http://x/'))
+    assert count_documents(app_scope) == 0
+
+
+def test_error_status_rolls_back_request_writes(testapp, app_scope,
+                                                worker_url, monkeypatch):
+    add = Documents.add.__func__
+
+    def add_and_fail(cls, dbsession, **kwargs):
+        add(cls, dbsession, **kwargs)
+        return None
+
+    monkeypatch.setattr(Documents, 'add', classmethod(add_and_fail))
+    testapp.post_json(worker_url, document_values('http://x/'), status=400)
+    assert count_documents(app_scope) == 0
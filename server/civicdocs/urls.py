@@ -0,0 +1,53 @@
+import hashlib
+
+from urllib.parse import (
+    urlsplit,
+    urlunsplit,
+    parse_qsl,
+    urlencode,
+)
+
+
+DEFAULT_PORTS = {
+    'http': 80,
+    'https': 443,
+}
+
+
+def normalize_url(url):
+    '''
+    Returns a canonical form of `url` so the same document reached
+    through trivially different links compares equal: the scheme and
+    host are lowercased, default ports and fragments are dropped and
+    the query string is sorted.  Raises `ValueError` for a url that
+    can't be parsed (ex. a port that isn't a number).
+    '''
+    try:
+        parts = urlsplit(url.strip())
+        port = parts.port
+    except ValueError as e:
+        raise ValueError('invalid url: {0}'.format(e))
+    scheme = parts.scheme.lower()
+    netloc = (parts.hostname or '').rstrip('.')
+    if port and port != DEFAULT_PORTS.get(scheme):
+        netloc = '{0}:{1}'.format(netloc, port)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, netloc, parts.path or '/', query, ''))
+
+
+def url_hash(url):
+    '''
+    Fixed width (64 character) SHA-256 hex digest of the normalized url.
+    '''
+    return hashlib.sha256(normalize_url(url).encode('utf-8')).hexdigest()
+
+
+def host_key(url):
+    '''
+    The host crawl limits are kept for: the lowercased hostname, without
+    a leading `www.`.  Returns `None` for urls without a host.
+    '''
+    host = (urlsplit(url.strip()).hostname or '').rstrip('.')
+    if host.startswith('www.'):
+        host = host[len('www.'):]
+    return host or None
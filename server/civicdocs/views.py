@@ -1,10 +1,29 @@
+import re
+import json
+import time
+import uuid
+import base64
+import binascii
 import datetime
+from collections import OrderedDict
 
+from pyramid.httpexceptions import HTTPNotFound
 from pyramid.response import Response
 from pyramid.view import view_config
 
-from sqlalchemy.exc import DBAPIError
+from sqlalchemy.exc import (
+    DBAPIError,
+    IntegrityError,
+)
 
+from .schemas import (
+    ValidationError,
+    coerce_boolean,
+    coerce_url,
+    coerce_uuid,
+    get_schema,
+    parse_datetime,
+)
 from .models import (
     Users,
     Municipalities,
@@ -16,26 +35,22 @@ from .models import (
     Dispatchers,
     Workers,
     JobRuns,
+    FrontierUrls,
+    FetchStates,
     Documents,
     DocumentCategories,
+    DocumentChangeAudits,
+    DocumentFacetCounts,
+    on_commit,
+)
+from .urls import url_hash
+from .notify import wait_timeout
+from .frontier import flush_frontier
+from .blobs import (
+    SHA256,
+    BlobMismatch,
+    BlobTooLarge,
 )
-
-
-def get_keys(cls):
-    req_keys = []
-    opt_keys = []
-    table = str(cls.__table__)
-    for col in cls.__table__.columns:
-        name = str(col)[len(table)+1:]
-        if not col.nullable:
-            req_keys.append(name)
-        else:
-            opt_keys.append(name)
-    req_keys.remove('id')  # do not need the id
-    opt_keys.remove('creation_datetime')
-    opt_keys.remove('modified_datetime')
-    opt_keys.remove('last_callin_datetime')
-    return req_keys, opt_keys
 
 
 def auth_scraper(request):
@@ -43,7 +58,7 @@ def auth_scraper(request):
     try:
         token = request.GET.get('token', None)
         if token is not None:
-            _scraper = Scrapers.get_by_token(token)
+            _scraper = Scrapers.get_by_token(request.dbsession, token)
             if _scraper is not None:
                 scraper = _scraper
                 request.response.status = 200
@@ -57,26 +72,25 @@ def auth_scraper(request):
 
 
 def get_payload(request, cls, update=False):
-    payload = None
+    '''
+    Returns the json body validated against the schema of `cls`, or
+    raises `ValidationError`.
+    '''
     try:
         payload = request.json_body
-        req_keys, opt_keys = get_keys(cls)
-        all_keys = True
-        if update:
-            all_keys = all(key in payload for key in opt_keys)
-        if all(key in payload for key in req_keys) and all_keys:
-            request.response.status = 200
-        else:
-            payload = None
-            request.response.status = 200
-    except:
-        request.response.status = 400
-    return payload
+    except ValueError:
+        raise ValidationError({'body': 'expected a JSON object'})
+    return get_schema(cls).validate(payload, update=update)
+
+
+def invalid_payload(request, error):
+    request.response.status = 400
+    return dict(errors=error.errors)
 
 
 def do_get(request, cls):
     id = request.matchdict['id']
-    thing = cls.get_by_id(id)
+    thing = cls.get_by_id(request.dbsession, id, 'detail')
     if thing:
         resp = {str(cls.__table__): thing.to_dict()}
         request.response.status = 200
@@ -86,66 +100,138 @@ def do_get(request, cls):
     return resp
 
 
-def do_get_paged(request, cls):
+def get_paging(request, count=50):
     start = 0
-    count = 50
     if 'start' in request.GET and request.GET['start'].isdigit():
         start = int(request.GET['start'])
     if 'count' in request.GET and request.GET['count'].isdigit():
         count = int(request.GET['count'])
-    things = cls.get_paged(start, count)
+    return start, count
+
+
+def parse_uuid(value, name):
+    '''
+    Returns the uuid of a query parameter, or raises `ValueError`.
+    '''
+    try:
+        return uuid.UUID(value)
+    except ValueError:
+        raise ValueError('{0} must be a uuid'.format(name))
+
+
+def encode_cursor(thing):
+    return base64.urlsafe_b64encode('{0}|{1}'.format(
+        thing.creation_datetime.isoformat(),
+        thing.id,
+    ).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    '''
+    Returns the `(creation_datetime, id)` pair encoded in a cursor, or
+    raises `ValueError`.
+    '''
+    try:
+        value = base64.urlsafe_b64decode(cursor.encode('ascii'))
+        creation_datetime, id = value.decode('utf-8').split('|')
+    except (TypeError, UnicodeError, binascii.Error):
+        raise ValueError('invalid cursor')
+    return parse_datetime(creation_datetime), uuid.UUID(id)
+
+
+def do_get_paged(request, cls, criteria=()):
+    start, count = get_paging(request)
+    things = cls.get_paged(request.dbsession, start, count, 'list',
+                           criteria)
     return things
 
 
-def do_post(request, cls, extras={}):
+def get_fields(request, cls):
+    '''
+    Returns the column names selected with `?fields=a,b`, `None` when
+    there is no selection, or raises `ValueError` for unknown names.
+    '''
+    if not request.GET.get('fields'):
+        return None
+    fields = [f.strip() for f in request.GET['fields'].split(',')]
+    unknown = set(fields).difference(cls.public_fields())
+    if unknown:
+        raise ValueError('unknown fields: {0}'.format(
+            ', '.join(sorted(unknown))))
+    return fields
+
+
+def do_get_rows(request, cls, fields, criteria=()):
+    '''
+    Pages through the selected columns only, without loading instances
+    or their relationships.
+    '''
+    start, count = get_paging(request)
+    rows = cls.get_rows(request.dbsession, fields, start, count, criteria)
+    return [dict(zip(fields, row)) for row in rows]
+
+
+def get_liveness(request, cls):
+    '''
+    Returns the criteria for `?alive=true` or `?alive=false`, or raises
+    `ValueError`.
+    '''
+    alive = request.GET.get('alive')
+    if alive is None:
+        return ()
+    if alive not in ('true', 'false'):
+        raise ValueError('alive must be true or false')
+    return cls.liveness(
+        alive == 'true',
+        request.registry.settings['civicdocs.node_stale_seconds'],
+    )
+
+
+def do_post(request, cls, payload, extras={}):
     resp = {}
-    payload = get_payload(request, cls)
-    if payload:
-        try:
-            for key in extras:
-                payload[key] = extras[key]
-            thing = cls.add(**payload)
-            if thing:
-                resp = {str(cls.__table__): thing.to_dict()}
-            else:
-                request.response.status = 403
-        except Exception as e:
-            resp = dict(error=str(e))
-            request.response.status = 500
-    else:
-        request.response.status = 400
+    try:
+        for key in extras:
+            payload[key] = extras[key]
+        thing = cls.add(request.dbsession, **payload)
+        if thing:
+            resp = {str(cls.__table__): thing.to_dict()}
+        else:
+            request.response.status = 403
+    except Exception as e:
+        resp = dict(error=str(e))
+        request.response.status = 500
     return resp
 
 
-def do_put(request, cls, extras={}):
+def do_put(request, cls, payload, extras={}):
     resp = {}
     id = request.matchdict['id']
-    payload = get_payload(request, cls, update=True)
-    if payload:
-        try:
-            for key in extras:
-                payload[key] = extras[key]
-            thing = cls.update_by_id(id, **payload)
-            if thing:
-                resp = {str(cls.__table__): thing.to_dict()}
-            else:
-                request.response.status = 404
-        except Exception as e:
-            resp = {'error': str(e)}
-            request.response.status = 500
-    else:
-        request.response.status = 400
+    try:
+        for key in extras:
+            payload[key] = extras[key]
+        thing = cls.update_by_id(request.dbsession, id, **payload)
+        if thing:
+            resp = {str(cls.__table__): thing.to_dict()}
+        else:
+            request.response.status = 404
+    except Exception as e:
+        resp = {'error': str(e)}
+        request.response.status = 500
     return resp
 
 
 @view_config(request_method='POST', route_name='/dispatchers', renderer='json')
 def view_dispatchers_post(request):
-    payload = get_payload(request, Dispatchers, update=False)
-    if payload and Scrapers.get_by_id(payload['scraper_id']):
+    try:
+        payload = get_payload(request, Dispatchers)
+    except ValidationError as e:
+        return invalid_payload(request, e)
+    if Scrapers.get_cached(request.dbsession, payload['scraper_id']):
         extras = dict(
-            last_callin_datetime=datetime.datetime.now()
+            last_callin_datetime=datetime.datetime.now(),
+            status=Dispatchers.ALIVE,
         )
-        resp = do_post(request, Dispatchers, extras=extras)
+        resp = do_post(request, Dispatchers, payload, extras=extras)
     else:
         resp = {}
         request.response.status = 403
@@ -154,10 +240,21 @@ def view_dispatchers_post(request):
 
 @view_config(request_method='GET', route_name='/dispatchers', renderer='json')
 def view_dispatchers_get(request):
-    dispatchers = do_get_paged(request, Dispatchers)
-    if dispatchers and isinstance(dispatchers, list):
+    try:
+        fields = get_fields(request, Dispatchers)
+        criteria = get_liveness(request, Dispatchers)
+    except ValueError as e:
+        request.response.status = 400
+        return dict(error=str(e))
+    if fields:
+        dispatchers = do_get_rows(request, Dispatchers, fields, criteria)
+    else:
+        dispatchers = [
+            w.to_dict() for w in do_get_paged(request, Dispatchers, criteria)
+        ]
+    if dispatchers:
         resp = dict(
-            dispatchers=[w.to_dict() for w in dispatchers]
+            dispatchers=dispatchers
         )
         request.response.status = 200
     else:
@@ -167,18 +264,68 @@ def view_dispatchers_get(request):
     return resp
 
 
+MAX_JOBS_CLAIM = 100
+
+
+def get_wait(request):
+    '''
+    Returns the seconds of `?wait=` (0 by default), up to
+    `civicdocs.job_max_wait_seconds`, or raises `ValueError`.
+    '''
+    try:
+        wait = float(request.GET.get('wait', 0))
+    except ValueError:
+        raise ValueError('wait must be a number of seconds')
+    if not wait >= 0:
+        raise ValueError('wait must be a number of seconds')
+    return min(wait, request.registry.settings[
+        'civicdocs.job_max_wait_seconds'])
+
+
 @view_config(request_method='GET', route_name='/dispatchers/{id}/jobs',
              renderer='json')
 def view_dispatcher_jobs_get(request):
-    print('/dispatchers/{id}/jobs')
-    dispatcher = Dispatchers.get_by_id(request.matchdict['id'])
+    try:
+        wait = get_wait(request)
+    except ValueError as e:
+        request.response.status = 400
+        return dict(error=str(e))
+    dispatcher = Dispatchers.get_cached(request.dbsession,
+                                        request.matchdict['id'])
     if dispatcher:
-        _job = Jobs.get_job()
-        print(_job)
-        if _job:
-            resp = dict(job=_job.to_dict())
-        else:
-            resp = dict(job=None)
+        settings = request.registry.settings
+        notifier = request.registry['job_notifier']
+        _, count = get_paging(request, count=1)
+        deadline = time.time() + wait
+        while True:
+            # read before looking, so a release in between still wakes.
+            generation = notifier.generation
+            jobs = Jobs.get_jobs(
+                request.dbsession,
+                min(max(count, 1), MAX_JOBS_CLAIM),
+                dispatcher.id,
+                settings['civicdocs.job_lease_seconds'],
+                settings['civicdocs.host_max_concurrent'],
+                settings['civicdocs.host_min_delay_seconds'],
+                dispatcher.scraper_id,
+            )
+            remaining = deadline - time.time()
+            if jobs or remaining <= 0:
+                break
+            timeout = wait_timeout(
+                request.dbsession,
+                remaining,
+                settings['civicdocs.job_wait_recheck_seconds'],
+            )
+            # end the transaction so the connection goes back to the pool
+            # while the request is parked.
+            request.tm.commit()
+            request.tm.begin()
+            notifier.wait(generation, timeout)
+        resp = dict(
+            job=jobs[0].to_dict() if jobs else None,
+            jobs=[j.to_dict() for j in jobs],
+        )
         request.response.status = 200
     else:
         resp = {}
@@ -186,15 +333,168 @@ def view_dispatcher_jobs_get(request):
     return resp
 
 
+@view_config(request_method='PUT',
+             route_name='/dispatchers/{id}/jobs/{job_id}/lease',
+             renderer='json')
+def view_dispatcher_job_lease_put(request):
+    try:
+        dispatcher_id = uuid.UUID(request.matchdict['id'])
+        job_id = uuid.UUID(request.matchdict['job_id'])
+    except ValueError:
+        request.response.status = 400
+        return {}
+    expiration = Jobs.extend_lease(
+        request.dbsession,
+        job_id,
+        dispatcher_id,
+        request.registry.settings['civicdocs.job_lease_seconds'],
+    )
+    if expiration:
+        resp = dict(
+            job_id=str(job_id),
+            lease_expiration_datetime=str(expiration),
+        )
+        request.response.status = 200
+    else:
+        # the lease expired and was reaped, or is held by another
+        # dispatcher; either way this dispatcher must stop working it.
+        resp = {}
+        request.response.status = 409
+    return resp
+
+
+def get_run_metrics(payload):
+    '''
+    Returns the `JobRuns.METRICS` reported with a completion, or raises
+    `ValidationError`.  Every metric is optional.
+    '''
+    fields = get_schema(JobRuns).fields
+    errors = {}
+    metrics = {}
+    for key in JobRuns.METRICS:
+        if payload.get(key) is not None:
+            try:
+                metrics[key] = fields[key](payload[key])
+            except ValueError as e:
+                errors[key] = str(e)
+                continue
+            if metrics[key] < 0:
+                errors[key] = 'may not be negative'
+    if errors:
+        raise ValidationError(errors)
+    return metrics
+
+
+@view_config(request_method='POST',
+             route_name='/dispatchers/{id}/jobs/{job_id}/complete',
+             renderer='json')
+def view_dispatcher_job_complete_post(request):
+    try:
+        dispatcher_id = uuid.UUID(request.matchdict['id'])
+        job_id = uuid.UUID(request.matchdict['job_id'])
+    except ValueError:
+        request.response.status = 400
+        return {}
+    try:
+        payload = request.json_body
+        succeeded = coerce_boolean(payload['succeeded'])
+    except (ValueError, TypeError, KeyError):
+        return invalid_payload(request, ValidationError(
+            {'succeeded': 'expected true or false'}))
+    try:
+        metrics = get_run_metrics(payload)
+    except ValidationError as e:
+        return invalid_payload(request, e)
+    settings = request.registry.settings
+    next_run_at = Jobs.complete(
+        request.dbsession,
+        job_id,
+        dispatcher_id,
+        succeeded,
+        settings['civicdocs.job_recrawl_seconds'],
+        settings['civicdocs.job_retry_seconds'],
+        settings['civicdocs.job_max_backoff_seconds'],
+    )
+    if next_run_at:
+        # the job's host may have room for another claim now.
+        request.registry['job_notifier'].publish(request.dbsession)
+        run = JobRuns.close(
+            request.dbsession,
+            job_id,
+            dispatcher_id,
+            succeeded,
+            **metrics
+        )
+        resp = dict(
+            job_id=str(job_id),
+            next_run_at=str(next_run_at),
+            job_run=run.to_dict() if run else None,
+        )
+        request.response.status = 200
+    else:
+        # as with the lease, the job is no longer this dispatcher's.
+        resp = {}
+        request.response.status = 409
+    return resp
+
+
+def do_throughput(request, column):
+    '''
+    Returns the `JobRuns.throughput` of the runs whose `column` is the
+    `id` of the route, for `?bucket=` (a day by default) and optionally
+    `?since=` and `?until=`.
+    '''
+    try:
+        id = uuid.UUID(request.matchdict['id'])
+        bucket = request.GET.get('bucket', 'day')
+        if bucket not in JobRuns.BUCKETS:
+            raise ValueError('bucket must be one of {0}'.format(
+                ', '.join(JobRuns.BUCKETS)))
+        bounds = {}
+        for key in ('since', 'until'):
+            if key in request.GET:
+                bounds[key] = parse_datetime(request.GET[key])
+    except ValueError as e:
+        request.response.status = 400
+        return dict(error=str(e))
+    resp = dict(
+        bucket=bucket,
+        throughput=JobRuns.throughput(
+            request.dbsession,
+            (column == id,),
+            bucket,
+            **bounds
+        ),
+    )
+    request.response.status = 200
+    return resp
+
+
+@view_config(request_method='GET', route_name='/jobs/{id}/throughput',
+             renderer='json')
+def view_job_throughput_get(request):
+    return do_throughput(request, JobRuns.job_id)
+
+
+@view_config(request_method='GET',
+             route_name='/municipalities/{id}/throughput', renderer='json')
+def view_municipality_throughput_get(request):
+    return do_throughput(request, JobRuns.municipality_id)
+
+
 @view_config(request_method='PUT', route_name='/dispatchers/{id}',
              renderer='json')
 def view_dispatcher_post(request):
-    payload = get_payload(request, Dispatchers, update=False)
-    if payload and Scrapers.get_by_id(payload['scraper_id']):
+    try:
+        payload = get_payload(request, Dispatchers, update=True)
+    except ValidationError as e:
+        return invalid_payload(request, e)
+    if Scrapers.get_cached(request.dbsession, payload['scraper_id']):
         extras = dict(
-            last_callin_datetime=datetime.datetime.now()
+            last_callin_datetime=datetime.datetime.now(),
+            status=Dispatchers.ALIVE,
         )
-        resp = do_put(request, Dispatchers)
+        resp = do_put(request, Dispatchers, payload, extras=extras)
         request.response.status = 200
     else:
         resp = {}
@@ -202,31 +502,99 @@ def view_dispatcher_post(request):
     return resp
 
 
+def get_heartbeat(request, cls):
+    '''
+    Returns the `(gauges, counters)` sent in a heartbeat, or raises
+    `ValidationError`.  Every field is optional.
+    '''
+    try:
+        payload = request.json_body if request.body else {}
+    except ValueError:
+        payload = None
+    if not isinstance(payload, dict):
+        raise ValidationError({'body': 'expected a JSON object'})
+    fields = get_schema(cls).fields
+    errors = {}
+    gauges = {}
+    counters = {}
+    for keys, values in ((cls.__heartbeat_gauges__, gauges),
+                         (cls.__heartbeat_counters__, counters)):
+        for key in keys:
+            if payload.get(key) is not None:
+                try:
+                    values[key] = fields[key](payload[key])
+                except ValueError as e:
+                    errors[key] = str(e)
+    if errors:
+        raise ValidationError(errors)
+    return gauges, counters
+
+
+def do_heartbeat(request, cls):
+    try:
+        id = uuid.UUID(request.matchdict['id'])
+    except ValueError:
+        request.response.status = 404
+        return {}
+    try:
+        gauges, counters = get_heartbeat(request, cls)
+    except ValidationError as e:
+        return invalid_payload(request, e)
+    if not cls.get_cached(request.dbsession, id):
+        request.response.status = 404
+        return {}
+    heartbeats = request.registry['heartbeats']
+    if heartbeats is not None:
+        heartbeats.beat(cls, id, gauges, counters)
+    else:
+        gauges['last_callin_datetime'] = datetime.datetime.now()
+        cls.apply_heartbeats(request.dbsession, {id: (gauges, counters)})
+    return Response(status=204)
+
+
+@view_config(request_method='POST', route_name='/dispatchers/{id}/heartbeat',
+             renderer='json')
+def view_dispatcher_heartbeat_post(request):
+    return do_heartbeat(request, Dispatchers)
+
+
 @view_config(request_method='POST', route_name='/workers', renderer='json')
 def view_workers(request):
-    payload = get_payload(request, Workers, update=False)
-    if payload:
-        if Scrapers.get_by_id(payload['scraper_id']) and \
-                Dispatchers.get_by_id(payload['dispatcher_id']):
-            extras = dict(
-                last_callin_datetime=datetime.datetime.now()
-            )
-            resp = do_post(request, Workers, extras=extras)
-        else:
-            resp = {}
-            request.response.status = 403
+    try:
+        payload = get_payload(request, Workers)
+    except ValidationError as e:
+        return invalid_payload(request, e)
+    if Scrapers.get_cached(request.dbsession, payload['scraper_id']) and \
+            Dispatchers.get_cached(request.dbsession,
+                                   payload['dispatcher_id']):
+        extras = dict(
+            last_callin_datetime=datetime.datetime.now(),
+            status=Workers.ALIVE,
+        )
+        resp = do_post(request, Workers, payload, extras=extras)
     else:
         resp = {}
-        request.response.status = 400
+        request.response.status = 403
     return resp
 
 
 @view_config(request_method='GET', route_name='/workers', renderer='json')
 def view_workers_get(request):
-    workers = do_get_paged(request, Workers)
-    if workers and isinstance(workers, list):
+    try:
+        fields = get_fields(request, Workers)
+        criteria = get_liveness(request, Workers)
+    except ValueError as e:
+        request.response.status = 400
+        return dict(error=str(e))
+    if fields:
+        workers = do_get_rows(request, Workers, fields, criteria)
+    else:
+        workers = [
+            w.to_dict() for w in do_get_paged(request, Workers, criteria)
+        ]
+    if workers:
         resp = dict(
-            workers=[w.to_dict() for w in workers]
+            workers=workers
         )
         request.response.status = 200
     else:
@@ -238,12 +606,16 @@ def view_workers_get(request):
 
 @view_config(request_method='PUT', route_name='/workers/{id}', renderer='json')
 def view_worker_post(request):
-    payload = get_payload(request, Workers, update=False)
-    if payload and Scrapers.get_by_id(payload['scraper_id']):
+    try:
+        payload = get_payload(request, Workers, update=True)
+    except ValidationError as e:
+        return invalid_payload(request, e)
+    if Scrapers.get_cached(request.dbsession, payload['scraper_id']):
         extras = dict(
-            last_callin_datetime=datetime.datetime.now()
+            last_callin_datetime=datetime.datetime.now(),
+            status=Workers.ALIVE,
         )
-        resp = do_put(request, Workers, extras=extras)
+        resp = do_put(request, Workers, payload, extras=extras)
         request.response.status = 200
     else:
         resp = {}
@@ -251,33 +623,761 @@ def view_worker_post(request):
     return resp
 
 
+@view_config(request_method='POST', route_name='/workers/{id}/heartbeat',
+             renderer='json')
+def view_worker_heartbeat_post(request):
+    return do_heartbeat(request, Workers)
+
+
 @view_config(request_method='POST', route_name='/workers/{id}/document',
              renderer='json')
 def view_worker_documents_post(request):
-    worker = Workers.get_by_id(request.matchdict['id'])
+    worker = Workers.get_cached(request.dbsession, request.matchdict['id'])
     if worker:
-        payload = get_payload(request, Documents)
-        if payload:
-            document = Documents.add(**payload)
-            if document:
-                resp = dict(job=document.to_dict())
-                request.response.status = 200
-            else:
-                resp = dict(job=None)
-                request.response.status = 400
+        try:
+            payload = get_payload(request, Documents)
+        except ValidationError as e:
+            return invalid_payload(request, e)
+        document = Documents.add(request.dbsession, **payload)
+        if document:
+            resp = dict(job=document.to_dict())
+            request.response.status = 200
+        else:
+            resp = dict(job=None)
+            request.response.status = 400
     else:
         resp = {}
         request.response.status = 404
     return resp
 
 
+@view_config(request_method='PUT',
+             route_name='/workers/{id}/documents/{document_id}/content',
+             renderer='json')
+def view_worker_document_content_put(request):
+    '''
+    Stores the body as the content of a document.  With an
+    `X-Content-SHA256` header the content is checked against it, and an
+    empty body links the document to content already stored under that
+    hash without sending it again.
+    '''
+    store = request.registry['blob_store']
+    worker = Workers.get_cached(request.dbsession, request.matchdict['id'])
+    if store is None or worker is None:
+        request.response.status = 404
+        return {}
+    try:
+        document_id = uuid.UUID(request.matchdict['document_id'])
+    except ValueError:
+        request.response.status = 404
+        return {}
+    exists = request.dbsession.query(
+        Documents.id,
+    ).filter(
+        Documents.id == document_id,
+    ).first()
+    if exists is None:
+        request.response.status = 404
+        return {}
+    expected = request.headers.get('X-Content-SHA256')
+    if expected is not None:
+        expected = expected.lower()
+        if not SHA256.match(expected):
+            return invalid_payload(request, ValidationError(
+                {'X-Content-SHA256': 'expected a sha256 hex digest'}))
+    max_bytes = request.registry.settings['civicdocs.blobs.max_bytes']
+    if request.content_length and request.content_length > max_bytes:
+        request.response.status = 413
+        return dict(error='larger than {0} bytes'.format(max_bytes))
+    content_type = request.content_type or 'application/octet-stream'
+    if expected is not None and not request.content_length and \
+            store.exists(expected):
+        sha256, length = expected, None
+    else:
+        try:
+            sha256, length = store.put(request.body_file, max_bytes, expected)
+        except BlobTooLarge as e:
+            request.response.status = 413
+            return dict(error=str(e))
+        except BlobMismatch as e:
+            return invalid_payload(request, ValidationError(
+                {'X-Content-SHA256': str(e)}))
+    if length is None:
+        # linked to existing content; take its length from a document
+        # that has it.
+        length = request.dbsession.query(
+            Documents.content_length,
+        ).filter(
+            Documents.content_sha256 == sha256,
+        ).limit(1).scalar()
+    Documents.set_content(request.dbsession, document_id, sha256, length,
+                          content_type)
+    resp = dict(
+        document_id=str(document_id),
+        content_sha256=sha256,
+        content_length=length,
+        content_type=content_type,
+    )
+    request.response.status = 200
+    return resp
+
+
+MAX_FRONTIER_PUSH = 5000
+
+
+MAX_FRONTIER_PULL = 1000
+
+
+def get_frontier_job(request):
+    '''
+    Returns the job of a frontier route as `(id, link_level)`, or `None`
+    if it or the worker doesn't exist.
+    '''
+    if not Workers.get_cached(request.dbsession, request.matchdict['id']):
+        return None
+    try:
+        job_id = uuid.UUID(request.matchdict['job_id'])
+    except ValueError:
+        return None
+    return request.dbsession.query(
+        Jobs.id,
+        Jobs.link_level,
+    ).filter(
+        Jobs.id == job_id,
+    ).first()
+
+
+def get_frontier_push(request):
+    '''
+    Returns the `(urls, depth)` of a push, or raises `ValidationError`.
+    '''
+    try:
+        payload = request.json_body
+    except ValueError:
+        payload = None
+    if not isinstance(payload, dict):
+        raise ValidationError({'body': 'expected a JSON object'})
+    errors = {}
+    urls = payload.get('urls')
+    if not isinstance(urls, list) or \
+            not all(isinstance(url, str) and url for url in urls):
+        errors['urls'] = 'expected a list of urls'
+    elif len(urls) > MAX_FRONTIER_PUSH:
+        errors['urls'] = 'at most {0} urls'.format(MAX_FRONTIER_PUSH)
+    depth = payload.get('depth')
+    if isinstance(depth, bool) or not isinstance(depth, int) or depth < 1:
+        errors['depth'] = 'expected an integer of at least 1'
+    if errors:
+        raise ValidationError(errors)
+    return urls, depth
+
+
+@view_config(request_method='POST',
+             route_name='/workers/{id}/jobs/{job_id}/frontier',
+             renderer='json')
+def view_worker_frontier_post(request):
+    '''
+    Queues the links found on a page of a job, `{"depth": n, "urls":
+    [...]}` with `depth` one more than the page's (the job's url is at
+    depth 0).  Links deeper than the job's `link_level`, or seen before
+    by the job, are dropped.
+    '''
+    try:
+        urls, depth = get_frontier_push(request)
+    except ValidationError as e:
+        return invalid_payload(request, e)
+    job = get_frontier_job(request)
+    if job is None:
+        request.response.status = 404
+        return {}
+    frontier = request.registry['frontier']
+    resp = frontier.push(request.dbsession, job.id, job.link_level, urls,
+                         depth)
+    if not request.registry.settings['civicdocs.frontier.flush_interval']:
+        on_commit(request.dbsession, flush_frontier, frontier,
+                  request.registry['dbsession_factory'])
+    request.response.status = 200
+    return resp
+
+
+@view_config(request_method='GET',
+             route_name='/workers/{id}/jobs/{job_id}/frontier',
+             renderer='json')
+def view_worker_frontier_get(request):
+    '''
+    Leases the next `?count=` queued urls of a job to the worker.
+    '''
+    job = get_frontier_job(request)
+    if job is None:
+        request.response.status = 404
+        return {}
+    _, count = get_paging(request, count=10)
+    urls = FrontierUrls.lease(
+        request.dbsession,
+        job.id,
+        uuid.UUID(request.matchdict['id']),
+        min(max(count, 1), MAX_FRONTIER_PULL),
+        request.registry.settings['civicdocs.frontier.lease_seconds'],
+    )
+    resp = dict(urls=[u.to_dict() for u in urls])
+    request.response.status = 200
+    return resp
+
+
+@view_config(request_method='POST',
+             route_name='/workers/{id}/jobs/{job_id}/frontier/done',
+             renderer='json')
+def view_worker_frontier_done_post(request):
+    '''
+    Removes the leased urls the worker fetched, `{"ids": [...]}`.
+    '''
+    try:
+        payload = request.json_body
+        ids = [coerce_uuid(id) for id in payload['ids']]
+    except (ValueError, TypeError, KeyError):
+        return invalid_payload(request, ValidationError(
+            {'ids': 'expected a list of url ids'}))
+    job = get_frontier_job(request)
+    if job is None:
+        request.response.status = 404
+        return {}
+    removed = FrontierUrls.finish(
+        request.dbsession,
+        job.id,
+        uuid.UUID(request.matchdict['id']),
+        ids,
+    ) if ids else 0
+    request.response.status = 200
+    return dict(removed=removed)
+
+
+MAX_FETCH_STATES = 1000
+
+
+def get_fetch_batch(request, key):
+    '''
+    Returns the list under `key` of a JSON object body, or raises
+    `ValidationError`.
+    '''
+    try:
+        payload = request.json_body
+    except ValueError:
+        payload = None
+    items = payload.get(key) if isinstance(payload, dict) else None
+    if not isinstance(items, list):
+        raise ValidationError({key: 'expected a list'})
+    if len(items) > MAX_FETCH_STATES:
+        raise ValidationError({key: 'at most {0} per request'.format(
+            MAX_FETCH_STATES)})
+    return items
+
+
+@view_config(request_method='POST',
+             route_name='/workers/{id}/fetch_states/lookup', renderer='json')
+def view_worker_fetch_states_lookup_post(request):
+    '''
+    Returns what was last fetched from each of `{"urls": [...]}`, in
+    order, or `null` for urls never fetched, so the worker can make
+    conditional requests.
+    '''
+    if not Workers.get_cached(request.dbsession, request.matchdict['id']):
+        request.response.status = 404
+        return {}
+    try:
+        urls = get_fetch_batch(request, 'urls')
+        for url in urls:
+            coerce_url(url)
+    except ValidationError as e:
+        return invalid_payload(request, e)
+    except ValueError:
+        return invalid_payload(request, ValidationError(
+            {'urls': 'expected a list of urls'}))
+    hashes = [url_hash(url) for url in urls]
+    states = FetchStates.lookup(request.dbsession, hashes)
+    resp = dict(states=[
+        states[hash_].to_dict() if hash_ in states else None
+        for hash_ in hashes
+    ])
+    request.response.status = 200
+    return resp
+
+
+def get_fetch(item):
+    '''
+    Returns a fetch to record from an item of a report, or raises
+    `ValidationError`.
+    '''
+    if not isinstance(item, dict):
+        raise ValidationError({'fetch': 'expected an object'})
+    errors = {}
+    fetch = {}
+    try:
+        if not item.get('url'):
+            raise ValueError('expected a url')
+        fetch['url'] = coerce_url(item['url'])
+    except ValueError:
+        errors['url'] = 'expected a url'
+    for key, max_length in (('etag', 255), ('last_modified', 64)):
+        value = item.get(key)
+        if value is None:
+            fetch[key] = None
+        elif not isinstance(value, str) or len(value) > max_length:
+            errors[key] = 'expected a string of at most {0}'.format(
+                max_length)
+        else:
+            fetch[key] = value
+    try:
+        fetch['not_modified'] = coerce_boolean(
+            item.get('not_modified', False))
+    except ValueError as e:
+        errors['not_modified'] = str(e)
+    sha256 = item.get('content_sha256')
+    if sha256 is not None and \
+            (not isinstance(sha256, str) or not SHA256.match(sha256)):
+        errors['content_sha256'] = 'expected a sha256 hex digest'
+    fetch['content_sha256'] = sha256
+    length = item.get('content_length')
+    if length is not None and \
+            (isinstance(length, bool) or not isinstance(length, int) or
+             length < 0):
+        errors['content_length'] = 'expected a non negative integer'
+    fetch['content_length'] = length
+    if errors:
+        raise ValidationError(errors)
+    return fetch
+
+
+@view_config(request_method='POST', route_name='/workers/{id}/fetch_states',
+             renderer='json')
+def view_worker_fetch_states_post(request):
+    '''
+    Records what the worker fetched, `{"fetches": [...]}`; see
+    `FetchStates.record`.  Invalid fetches are reported by index and the
+    others recorded.
+    '''
+    if not Workers.get_cached(request.dbsession, request.matchdict['id']):
+        request.response.status = 404
+        return {}
+    try:
+        items = get_fetch_batch(request, 'fetches')
+    except ValidationError as e:
+        return invalid_payload(request, e)
+    fetches = []
+    failed = []
+    for index, item in enumerate(items):
+        try:
+            fetches.append(get_fetch(item))
+        except ValidationError as e:
+            failed.append(dict(index=index, errors=e.errors))
+    resp = FetchStates.record(request.dbsession, fetches) if fetches \
+        else dict(new=0, unchanged=0, changed=0)
+    resp.update(failed=failed)
+    request.response.status = 200
+    return resp
+
+
+@view_config(request_method='GET', route_name='/documents/{id}/changes',
+             renderer='json')
+def view_document_changes_get(request):
+    try:
+        id = uuid.UUID(request.matchdict['id'])
+    except ValueError:
+        request.response.status = 404
+        return {}
+    start, count = get_paging(request)
+    changes = DocumentChangeAudits.for_document(
+        request.dbsession,
+        id,
+        start,
+        count,
+    )
+    resp = dict(changes=[c.to_dict() for c in changes])
+    request.response.status = 200
+    return resp
+
+
+@view_config(request_method=('GET', 'HEAD'),
+             route_name='/documents/{id}/content')
+def view_document_content_get(request):
+    store = request.registry['blob_store']
+    try:
+        id = uuid.UUID(request.matchdict['id'])
+    except ValueError:
+        return HTTPNotFound()
+    document = request.dbsession.query(
+        Documents.content_sha256,
+        Documents.content_type,
+    ).filter(
+        Documents.id == id,
+    ).first()
+    if store is None or document is None or document.content_sha256 is None:
+        return HTTPNotFound()
+    return store.response(
+        request,
+        document.content_sha256,
+        document.content_type,
+    )
+
+
+def document_row_to_dict(row):
+    resp = dict(row)
+    for key in ('id', 'document_type_id', 'municipality_id', 'entity_id'):
+        if resp[key] is not None:
+            resp[key] = str(resp[key])
+    resp['creation_datetime'] = str(resp['creation_datetime'])
+    return resp
+
+
+def iter_ndjson(rows, batch_size=1000):
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(document_row_to_dict(row)))
+        if len(lines) == batch_size:
+            lines.append('')
+            yield '\n'.join(lines).encode('utf-8')
+            lines = []
+    if lines:
+        lines.append('')
+        yield '\n'.join(lines).encode('utf-8')
+
+
+MAX_DOCUMENTS_PAGE = 1000
+
+
+MAX_DOCUMENTS_BATCH = 5000
+
+
+def iter_batch(request):
+    '''
+    Yields the items of a JSON array body, or of an NDJSON body one line
+    at a time.  Lines that aren't valid JSON are yielded as `ValueError`s
+    so they can be reported against their index.
+    '''
+    if request.content_type == 'application/x-ndjson':
+        for line in request.body_file:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line.decode('utf-8'))
+            except ValueError as e:
+                yield e
+    else:
+        items = request.json_body
+        if not isinstance(items, list):
+            raise ValueError('expected a JSON array of documents')
+        for item in items:
+            yield item
+
+
+def add_documents(dbsession, documents, worker_id):
+    '''
+    Returns the `(id, created)` of each of `documents` added with one
+    `Documents.add_many`, or the error of each that failed.  A document
+    the database rejects fails the whole batch, which is then added one
+    document at a time so only that one fails.
+    '''
+    try:
+        with dbsession.begin_nested():
+            return Documents.add_many(dbsession, documents, worker_id)
+    except (IntegrityError, ValueError):
+        pass
+    added = []
+    for document in documents:
+        try:
+            with dbsession.begin_nested():
+                added.extend(Documents.add_many(
+                    dbsession,
+                    [document],
+                    worker_id,
+                ))
+        except (IntegrityError, ValueError) as e:
+            added.append(e)
+    return added
+
+
+@view_config(request_method='POST', route_name='/workers/{id}/documents',
+             renderer='json')
+def view_worker_documents_batch_post(request):
+    worker = Workers.get_cached(request.dbsession, request.matchdict['id'])
+    if not worker:
+        request.response.status = 404
+        return {}
+    schema = get_schema(Documents)
+    results = []
+    documents = []
+    try:
+        for index, item in enumerate(iter_batch(request)):
+            if index == MAX_DOCUMENTS_BATCH:
+                request.response.status = 413
+                return dict(error='at most {0} documents per request'.format(
+                    MAX_DOCUMENTS_BATCH))
+            if isinstance(item, ValueError):
+                results.append(dict(index=index, error=str(item)))
+                continue
+            try:
+                values = schema.validate(item)
+            except ValidationError as e:
+                results.append(dict(
+                    index=index,
+                    error=str(e),
+                    errors=e.errors,
+                ))
+                continue
+            # the rows are inserted together, so they need the same keys.
+            document = dict.fromkeys(schema.optional)
+            document.update(values)
+            results.append(dict(index=index))
+            documents.append(document)
+    except ValueError as e:
+        request.response.status = 400
+        return dict(error=str(e))
+    added = iter(add_documents(request.dbsession, documents, worker.id))
+    created = 0
+    for result in results:
+        if 'error' not in result:
+            added_ = next(added)
+            if isinstance(added_, Exception):
+                result.update(error='the document could not be added')
+                continue
+            id, _created = added_
+            result.update(
+                id=str(id),
+                status='created' if _created else 'existing',
+            )
+            created += _created
+    failed = sum(1 for result in results if 'error' in result)
+    request.response.status = 200
+    return dict(
+        created=created,
+        existing=len(results) - failed - created,
+        failed=failed,
+        results=results,
+    )
+
+
 @view_config(request_method='GET', route_name='/documents', renderer='json')
 def view_documents_get(request):
+    try:
+        filters = {}
+        for key in ('municipality_id', 'entity_id', 'document_type_id'):
+            if key in request.GET:
+                filters[key] = parse_uuid(request.GET[key], key)
+        for key in ('since', 'until'):
+            if key in request.GET:
+                filters[key] = parse_datetime(request.GET[key])
+        after = None
+        if 'cursor' in request.GET:
+            after = decode_cursor(request.GET['cursor'])
+    except ValueError as e:
+        request.response.status = 400
+        return dict(error=str(e))
+    criteria = Documents.filters(**filters)
+
+    if request.GET.get('format') == 'ndjson':
+        # the export is streamed from a server side cursor as the client
+        # reads it, rather than being rendered in memory.
+        return Response(
+            app_iter=iter_ndjson(Documents.iter_rows(
+                request.dbsession.bind,
+                criteria,
+            )),
+            content_type='application/x-ndjson',
+        )
 
+    _, count = get_paging(request)
+    count = min(count, MAX_DOCUMENTS_PAGE)
+    documents = Documents.get_keyset(
+        request.dbsession,
+        after,
+        count,
+        criteria,
+        'list',
+    )
+    cursor = None
+    if documents and len(documents) == count:
+        cursor = encode_cursor(documents[-1])
+    resp = dict(
+        documents=[d.to_dict() for d in documents],
+        cursor=cursor,
+    )
+    request.response.status = 200
     return resp
 
 
+MONTH = re.compile(r'^\d{4}-(0[1-9]|1[0-2])$')
+
+
+@view_config(request_method='GET', route_name='/documents/facets',
+             renderer='json')
+def view_documents_facets_get(request):
+    '''
+    Document counts by `?facet=` (any of `municipality`, `entity`,
+    `document_type`, `category` and `month`; all of them by default),
+    over the months from `?since=YYYY-MM` up to `?until=YYYY-MM`.  These
+    are read from the `DocumentFacetCounts` rollup.
+    '''
+    facets = request.GET.getall('facet') or \
+        list(DocumentFacetCounts.FACETS) + ['month']
+    for facet in facets:
+        if facet != 'month' and facet not in DocumentFacetCounts.FACETS:
+            request.response.status = 400
+            return dict(error='unknown facet: {0}'.format(facet))
+    months = {}
+    for key in ('since', 'until'):
+        if key in request.GET:
+            if not MONTH.match(request.GET[key]):
+                request.response.status = 400
+                return dict(error='{0} must be YYYY-MM'.format(key))
+            months[key] = request.GET[key]
+    resp = dict(
+        facets=DocumentFacetCounts.counts(request.dbsession, facets,
+                                          **months),
+    )
+    request.response.status = 200
+    return resp
+
+
+MAX_NEAR_RADIUS_KM = 250.0
+
+MAX_NEAR_RESULTS = 100
+
+
+def get_near(request):
+    '''
+    Returns the `(lat, lng, radius_km)` of `?near=lat,lng&radius=km`
+    (10km by default, at most `MAX_NEAR_RADIUS_KM`), or raises
+    `ValueError`.
+    '''
+    try:
+        lat, lng = [float(v) for v in request.GET['near'].split(',')]
+    except ValueError:
+        raise ValueError('near must be lat,lng')
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        raise ValueError('near must be lat,lng')
+    try:
+        radius = float(request.GET.get('radius', 10))
+    except ValueError:
+        raise ValueError('radius must be a number of kilometers')
+    if not 0 < radius <= MAX_NEAR_RADIUS_KM:
+        raise ValueError('radius must be a number of kilometers, up to '
+                         '{0}'.format(MAX_NEAR_RADIUS_KM))
+    return lat, lng, radius
+
+
+def get_nearest(dbsession, cls, distances, count):
+    ids = list(distances)[:count]
+    things = {}
+    if ids:
+        things = dict((thing.id, thing) for thing in dbsession.query(
+            cls,
+        ).options(
+            *cls.options('list')
+        ).filter(
+            cls.id.in_(ids),
+        ))
+    results = []
+    for id in ids:
+        if id in things:
+            _thing = things[id].to_dict()
+            _thing.update(distance_km=distances[id])
+            results.append(_thing)
+    return results
+
+
+def search_near(request):
+    '''
+    The municipalities and entities with an address within the radius,
+    nearest first, and the newest documents of those municipalities.
+    '''
+    try:
+        lat, lng, radius = get_near(request)
+    except ValueError as e:
+        request.response.status = 400
+        return dict(error=str(e))
+    _, count = get_paging(request, count=10)
+    count = min(count, MAX_NEAR_RESULTS)
+    municipality_distances = OrderedDict()
+    entity_distances = OrderedDict()
+    for distance, address in Addresses.near(
+            request.dbsession, lat, lng, radius):
+        if address.municipality_id is not None:
+            municipality_distances.setdefault(address.municipality_id,
+                                              distance)
+        if address.entity_id is not None:
+            entity_distances.setdefault(address.entity_id, distance)
+    documents = []
+    for document in Documents.for_municipalities(
+            request.dbsession, municipality_distances, count):
+        _document = document.to_dict()
+        _document.update(
+            municipality_id=str(document.municipality_id),
+            distance_km=municipality_distances[document.municipality_id],
+        )
+        documents.append(_document)
+    resp = dict(
+        near=dict(lat=lat, lng=lng),
+        radius=radius,
+        count=count,
+        municipalities=get_nearest(request.dbsession, Municipalities,
+                                   municipality_distances, count),
+        entities=get_nearest(request.dbsession, Entities,
+                             entity_distances, count),
+        documents=documents,
+    )
+    request.response.status = 200
+    return resp
+
+
+MAX_SEARCH_PAGE = 100
+
+
 @view_config(request_method='GET', route_name='/search', renderer='json')
 def view_search_get(request):
+    query = request.GET.get('q', '').strip()
+    if 'near' in request.GET:
+        if query:
+            request.response.status = 400
+            return dict(error='q and near can not be combined')
+        return search_near(request)
+    if query:
+        start, count = get_paging(request, count=10)
+        count = min(count, MAX_SEARCH_PAGE)
+        total, results = Documents.search(
+            request.dbsession,
+            query,
+            start,
+            count,
+        )
+        documents = []
+        for document, score in results:
+            _document = document.to_dict()
+            _document.update(score=score)
+            documents.append(_document)
+        resp = dict(
+            query=query,
+            total=total,
+            start=start,
+            count=count,
+            documents=documents,
+        )
+        request.response.status = 200
+    else:
+        resp = dict(documents=None)
+        request.response.status = 400
+    return resp
 
+
+@view_config(request_method='GET', route_name='/stats/pool', renderer='json')
+def view_stats_pool_get(request):
+    # internal; the counters are for the process that serves the request.
+    if request.remote_addr not in \
+            request.registry.settings['civicdocs.stats.hosts']:
+        request.response.status = 403
+        return {}
+    engine = request.registry['dbsession_factory'].kw['bind']
+    resp = dict(
+        pool=request.registry['pool_stats'].to_dict(engine.pool),
+    )
+    request.response.status = 200
     return resp
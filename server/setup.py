@@ -19,6 +19,11 @@ requires = [
     'waitress',
     ]
 
+tests_require = [
+    'WebTest >= 1.3.1',
+    'pytest',
+    ]
+
 setup(name='civicdocs',
       version='0.0',
       description='civicdocs',
@@ -38,10 +43,18 @@ setup(name='civicdocs',
       zip_safe=False,
       test_suite='civicdocs',
       install_requires=requires,
+      extras_require={
+          'testing': tests_require,
+      },
       entry_points="""\
       [paste.app_factory]
       main = civicdocs:main
       [console_scripts]
       initialize_civicdocs_db = civicdocs.scripts.initializedb:main
+      reindex_civicdocs_search = civicdocs.scripts.reindexsearch:main
+      dedupe_civicdocs_documents = civicdocs.scripts.dedupedocuments:main
+      geohash_civicdocs_addresses = civicdocs.scripts.geohashaddresses:main
+      rebuild_civicdocs_facets = civicdocs.scripts.rebuildfacets:main
+      classify_civicdocs_documents = civicdocs.scripts.classifydocuments:main
       """,
       )